@@ -0,0 +1,378 @@
+# api_async.py
+#
+# Async (ASGI) version of the read endpoints of api_server.py: GET /readings,
+# /readings/latest, /readings/aggregate, /readings/stream, /status and /status/db, with the
+# same parameters, JSON and error responses.
+#
+# Queries are awaited on async_queries' thread pools instead of blocking a worker, so one
+# process serves many concurrent requests, slow long-range queries don't hold up
+# /readings/latest, and identical queries in flight share one execution. Queries beyond
+# ASYNC_MAX_PENDING get 503 with Retry-After. Database connections are read-only.
+# An open /readings/stream costs no thread here, so many more dashboards can stream at once
+# (ASYNC_STREAM_MAX_CLIENTS) than on the threaded servers.
+#
+#   python api_async.py             built-in asyncio HTTP server on API_HOST:API_PORT (no extra packages)
+#   uvicorn api_async:app --port 5000   or any other ASGI server
+#
+# /readings/export and the response cache/ETags stay with api_server.py / wsgi.py.
+import asyncio
+import json
+import logging
+import os
+import signal
+import sqlite3
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote
+
+import config
+import async_queries
+import change_feed
+import data_processor
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def startup():
+    """Creates the database if needed, then makes every connection of this process read-only."""
+    if not os.path.exists(config.DATABASE_NAME):
+        data_processor.initialize_database()
+    config.DB_READ_ONLY = True
+    data_processor.close_connections()
+
+def _json(status: int, obj, headers: list = None) -> tuple[int, bytes, list]:
+    """A JSON response encoded like Flask's jsonify (sorted keys, compact, trailing newline)."""
+    body = (json.dumps(obj, sort_keys=True, separators=(",", ":")) + "\n").encode()
+    return status, body, [(b"content-type", b"application/json")] + (headers or [])
+
+def _arg(args: dict, name: str, default=None):
+    values = args.get(name)
+    return values[0] if values else default
+
+def _int_arg(args: dict, name: str, default: int) -> int:
+    """Like Flask's request.args.get(name, default, type=int): the default if missing or not a number."""
+    try:
+        return int(_arg(args, name, default))
+    except ValueError:
+        return default
+
+
+async def get_readings(args: dict) -> tuple[int, bytes, list]:
+    """GET /readings: same parameters and X-Next-Cursor header as api_server.get_readings()."""
+    limit = _int_arg(args, 'limit', 100)
+    sensor_id = _arg(args, 'sensor_id')
+    sensor_type = _arg(args, 'type')
+    cursor = _arg(args, 'cursor')
+    try:
+        start = data_processor.parse_time_param(_arg(args, 'start'))
+        end = data_processor.parse_time_param(_arg(args, 'end'))
+        if cursor:
+            data_processor.decode_cursor(cursor)
+    except ValueError as e:
+        return _json(400, {"error": f"Invalid parameter: {e}"})
+
+    limit = max(1, min(limit, 1000))
+    readings, next_cursor = await async_queries.get_readings_page(limit=limit, sensor_id=sensor_id,
+                                                                  sensor_type=sensor_type, start=start,
+                                                                  end=end, cursor=cursor)
+    return _json(200, readings, [(b"x-next-cursor", next_cursor.encode())] if next_cursor else None)
+
+async def get_readings_latest(args: dict) -> tuple[int, bytes, list]:
+    """GET /readings/latest: the newest value of every sensor (on the 'latest' lane)."""
+    return _json(200, await async_queries.get_latest_readings(sensor_id=_arg(args, 'sensor_id'),
+                                                              sensor_type=_arg(args, 'type')))
+
+async def get_readings_aggregate(args: dict) -> tuple[int, bytes, list]:
+    """GET /readings/aggregate: same parameters as api_server.get_readings_aggregate()."""
+    try:
+        bucket_seconds = data_processor.parse_bucket(_arg(args, 'bucket'))
+        start = data_processor.parse_time_param(_arg(args, 'start'))
+        end = data_processor.parse_time_param(_arg(args, 'end'))
+    except ValueError as e:
+        return _json(400, {"error": f"Invalid parameter: {e}"})
+    return _json(200, await async_queries.get_aggregated_readings(bucket_seconds, sensor_id=_arg(args, 'sensor_id'),
+                                                                  sensor_type=_arg(args, 'type'),
+                                                                  start=start, end=end))
+
+async def get_status(args: dict) -> tuple[int, bytes, list]:
+    """GET /status: health check (never waits for a query)."""
+    return _json(200, {"status": "ok"})
+
+async def get_db_status(args: dict) -> tuple[int, bytes, list]:
+    """GET /status/db: connection pool, query executor and live stream statistics."""
+    return _json(200, {"pool": data_processor.get_pool_stats(), "executor": async_queries.get_executor().stats(),
+                       "stream": change_feed.get_tailer().stats()})
+
+async def _send_response(send, status: int, body: bytes, headers: list):
+    headers.append((b"content-length", str(len(body)).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+async def _wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+async def stream_readings(scope, receive, send):
+    """GET /readings/stream: same parameters and events as api_server.stream_readings()."""
+    args = parse_qs(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+    try:
+        last_event_id = dict(scope["headers"]).get(b"last-event-id", b"").decode("latin-1") or _arg(args, 'last_event_id')
+        last_seq = int(last_event_id) if last_event_id else None
+    except ValueError as e:
+        return await _send_response(send, *_json(400, {"error": f"Invalid parameter: {e}"}))
+
+    if not config.CHANGE_FEED_ENABLED:
+        return await _send_response(send, *_json(503, {"error": "Live stream disabled (CHANGE_FEED_ENABLED is off)"}))
+    tailer = change_feed.get_tailer()
+    if tailer.subscriber_count() >= config.ASYNC_STREAM_MAX_CLIENTS:
+        return await _send_response(send, *_json(503, {"error": "Too many open streams, try again later"},
+                                                 [(b"retry-after", b"5")]))
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+
+    def on_data():
+        # Called on the tailer thread
+        try:
+            loop.call_soon_threadsafe(wake.set)
+        except RuntimeError:
+            pass # Event loop already closed
+    try:
+        # May read missed entries for Last-Event-ID, so not on the event loop
+        subscription = await asyncio.to_thread(tailer.subscribe, _arg(args, 'sensor_id'), _arg(args, 'type'),
+                                               last_seq, on_data)
+    except sqlite3.Error as e:
+        logging.error(f"Live stream unavailable: {e}")
+        return await _send_response(send, *_json(503, {"error": "Live stream unavailable"}))
+
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache"),
+                                (b"x-accel-buffering", b"no")]})
+        await send({"type": "http.response.body", "body": b": connected\n\n", "more_body": True})
+        while True:
+            entries, dropped = subscription.drain()
+            if entries or dropped:
+                chunk = change_feed.format_events(entries, dropped)
+            elif subscription.closed or disconnected.done():
+                break
+            else:
+                woken = asyncio.ensure_future(wake.wait())
+                done, _ = await asyncio.wait([woken, disconnected], timeout=config.STREAM_HEARTBEAT_INTERVAL,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                woken.cancel()
+                wake.clear()
+                if done:
+                    continue
+                chunk = ": keep-alive\n\n"
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        if not disconnected.done():
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        disconnected.cancel()
+        tailer.unsubscribe(subscription)
+
+ROUTES = {
+    "/readings": get_readings,
+    "/readings/latest": get_readings_latest,
+    "/readings/aggregate": get_readings_aggregate,
+    "/status": get_status,
+    "/status/db": get_db_status,
+}
+
+# Routes that send their own (streamed) response
+STREAMS = {
+    "/readings/stream": stream_readings,
+}
+
+
+async def app(scope, receive, send):
+    """The ASGI application."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.to_thread(change_feed.shutdown)
+                await asyncio.to_thread(async_queries.shutdown)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    handler = ROUTES.get(path)
+    if path in STREAMS and scope["method"] == "GET":
+        await STREAMS[path](scope, receive, send)
+        return
+    if handler is None and path not in STREAMS:
+        status, body, headers = _json(404, {"error": "Not found"})
+    elif handler is None or scope["method"] not in ("GET", "HEAD"):
+        allow = b"GET" if handler is None else b"GET, HEAD"
+        status, body, headers = _json(405, {"error": "Method not allowed"}, [(b"allow", allow)])
+    else:
+        try:
+            status, body, headers = await handler(parse_qs(scope["query_string"].decode("latin-1"),
+                                                           keep_blank_values=True))
+        except async_queries.Overloaded as e:
+            logging.warning(f"Rejected {path}: {e}")
+            status, body, headers = _json(503, {"error": "Server busy, try again"}, [(b"retry-after", b"1")])
+        except Exception as e:
+            logging.error(f"Error in {path} endpoint: {e}")
+            status, body, headers = _json(500, {"error": "An internal server error occurred"})
+    headers.append((b"content-length", str(len(body)).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else body})
+
+
+# --- Built-in server ---
+
+class Server:
+    """
+    Minimal asyncio HTTP/1.1 server for `app` (keep-alive, no request bodies), so the async
+    API runs without an ASGI server package. Streamed responses (more_body) are written as
+    they come and end by closing the connection. stop() lets requests in progress finish
+    and ends open streams.
+    """
+    def __init__(self, asgi_app=None):
+        self.app = asgi_app or app
+        self._server = None
+        self._connections = {} # Task -> True while it is handling a request
+        self._stopping = False
+
+    async def start(self, host: str, port: int):
+        self._server = await asyncio.start_server(self._handle, host, port, backlog=128)
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections[task] = False
+        try:
+            while not self._stopping:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                self._connections[task] = True
+                keep_alive = await self._respond(head, reader, writer)
+                self._connections[task] = False
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def _respond(self, head: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Handles one request; returns whether the connection stays open."""
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            writer.write(b"HTTP/1.1 400 Bad Request\r\ncontent-length: 0\r\nconnection: close\r\n\r\n")
+            await writer.drain()
+            return False
+        headers = []
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            if name:
+                headers.append((name.strip().lower().encode("latin-1"), value.strip().encode("latin-1")))
+        fields = dict(headers)
+        body = await reader.readexactly(int(fields.get(b"content-length", b"0") or 0))
+        connection = fields.get(b"connection", b"").lower()
+        keep_alive = (connection != b"close") if version == "HTTP/1.1" else (connection == b"keep-alive")
+        path, _, query = target.partition("?")
+        scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": version[5:],
+                 "method": method.upper(), "scheme": "http", "path": unquote(path), "raw_path": path.encode("latin-1"),
+                 "query_string": query.encode("latin-1"), "root_path": "", "headers": headers,
+                 "client": writer.get_extra_info("peername")[:2], "server": writer.get_extra_info("sockname")[:2]}
+        response = {"status": 500, "headers": [], "body": [], "streaming": False}
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Asked again while streaming: nothing more comes from the client until it disconnects
+            while await reader.read(4096):
+                pass
+            return {"type": "http.disconnect"}
+
+        def response_head(keep_alive: bool) -> bytes:
+            status = response["status"]
+            out = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n".encode()]
+            out += [name + b": " + value + b"\r\n" for name, value in response["headers"]]
+            out.append(b"connection: keep-alive\r\n\r\n" if keep_alive else b"connection: close\r\n\r\n")
+            return b"".join(out)
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"], response["headers"] = message["status"], list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                if message.get("more_body") and not response["streaming"]:
+                    # No content-length: the body ends when the connection is closed
+                    response["streaming"] = True
+                    writer.write(response_head(False))
+                if response["streaming"]:
+                    writer.write(message.get("body", b""))
+                    await writer.drain()
+                else:
+                    response["body"].append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        if response["streaming"]:
+            return False
+        keep_alive = keep_alive and not self._stopping
+        writer.write(response_head(keep_alive) + b"".join(response["body"]))
+        await writer.drain()
+        return keep_alive
+
+    async def stop(self, timeout: float = None):
+        """Stops accepting connections, closes idle ones and waits for requests in progress."""
+        self._stopping = True
+        self._server.close()
+        await asyncio.to_thread(change_feed.shutdown) # Open streams would never finish
+        for task, busy in list(self._connections.items()):
+            if not busy:
+                task.cancel() # Waiting for the next request of a keep-alive connection
+        busy = [task for task in self._connections]
+        if busy:
+            await asyncio.wait(busy, timeout=config.API_SHUTDOWN_TIMEOUT if timeout is None else timeout)
+        await self._server.wait_closed()
+
+
+async def _serve(host: str, port: int):
+    server = Server()
+    await server.start(host, port)
+    logging.info(f"Starting async API server on {host}:{port}")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass # Windows: Ctrl+C raises KeyboardInterrupt instead
+    await stop.wait()
+    logging.info("Termination signal received. Finishing requests in progress...")
+    await server.stop()
+    await asyncio.to_thread(async_queries.shutdown)
+
+def serve(host: str = None, port: int = None):
+    """Runs the built-in async server until SIGTERM/SIGINT."""
+    # Create the database (if needed), then read-only connections only
+    startup()
+    try:
+        asyncio.run(_serve(host or config.API_HOST, config.API_PORT if port is None else port))
+    except KeyboardInterrupt:
+        pass
+    logging.info("Async API server stopped.")
+
+
+if __name__ == '__main__':
+    serve()
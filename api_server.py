@@ -1,48 +1,304 @@
 # api_server.py
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
+import functools
 import logging
+import sqlite3
 
+import change_feed
 import config
 import data_processor # Uses the updated data_processor
+import readings_export
+import response_cache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 app = Flask(__name__)
 
+# Rendered responses of the GET /readings endpoints, reused until the database changes
+cache = response_cache.ResponseCache()
+
+def cached(view):
+    """
+    Serves a view from the response cache while the database is unchanged, and
+    answers If-None-Match requests with 304 when the ETag still matches.
+    Only successful (200) responses are cached.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not config.RESPONSE_CACHE_ENABLED:
+            return view(*args, **kwargs)
+        # Same parameters in any order (or repeated) map to the same entry
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        # Read the marker before querying: a write that lands in between makes the entry
+        # look stale on the next request (an extra query) but never serves old data as new
+        version = cache.data_version()
+        entry = cache.get(key, version)
+        if entry is None:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            headers = {name: response.headers[name] for name in ('X-Next-Cursor',) if name in response.headers}
+            entry = response_cache.CachedResponse(response.get_data(), response.mimetype, headers, version)
+            cache.put(key, entry)
+
+        response = app.response_class(entry.body, mimetype=entry.mimetype)
+        response.headers.update(entry.headers)
+        response.set_etag(entry.etag)
+        response.headers['Cache-Control'] = 'no-cache' # Clients may keep it, but must revalidate
+        return response.make_conditional(request)
+    return wrapper
+
 @app.route('/readings', methods=['GET'])
+@cached
 def get_readings():
     """
-    API endpoint to fetch sensor readings.
+    API endpoint to fetch sensor readings (newest first).
     Query Parameters:
         limit (int): Max number of readings (default 100).
         sensor_id (str): Filter by sensor ID.
         type (str): Filter by sensor type.
+        start (str): ISO-8601 time; only readings at or after it.
+        end (str): ISO-8601 time; only readings before it.
+        cursor (str): Value of the X-Next-Cursor header from the previous page.
+    The X-Next-Cursor response header is set when more readings are available.
     """
     try:
         limit = request.args.get('limit', default=100, type=int)
         sensor_id = request.args.get('sensor_id', default=None, type=str)
         # Use 'type' as query param name to match DB column
         sensor_type = request.args.get('type', default=None, type=str)
+        cursor = request.args.get('cursor', default=None, type=str)
+        try:
+            start = data_processor.parse_time_param(request.args.get('start'))
+            end = data_processor.parse_time_param(request.args.get('end'))
+            if cursor:
+                data_processor.decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid parameter: {e}"}), 400
 
         # Ensure limit is reasonable
         limit = max(1, min(limit, 1000)) # Example: Clamp limit between 1 and 1000
 
-        readings = data_processor.get_readings_from_db(limit=limit, sensor_id=sensor_id, sensor_type=sensor_type)
+        readings, next_cursor = data_processor.get_readings_page(limit=limit, sensor_id=sensor_id,
+                                                                 sensor_type=sensor_type, start=start,
+                                                                 end=end, cursor=cursor)
 
-        # data_processor.get_readings_from_db already returns a list of dicts
-        return jsonify(readings)
+        # data_processor.get_readings_page already returns a list of dicts
+        response = jsonify(readings)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
 
     except Exception as e:
         logging.error(f"Error in /readings endpoint: {e}")
         return jsonify({"error": "An internal server error occurred"}), 500
 
+@app.route('/readings/batch', methods=['POST'])
+def get_readings_batch():
+    """
+    API endpoint to fetch the newest readings of several sensors in one request (e.g. every
+    panel of a dashboard), keyed by sensor ID. All sensors are read with one query.
+    JSON Body:
+        sensor_ids (list[str]): Sensors to fetch (required, at most config.BATCH_MAX_SENSORS).
+        limit (int): Max number of readings per sensor (default 100).
+        type (str): Filter by sensor type.
+        start (str): ISO-8601 time; only readings at or after it.
+        end (str): ISO-8601 time; only readings before it.
+        cursors (dict): next_cursors from the previous response, to get the next page of those sensors.
+    Response: {"readings": {sensor_id: [...]}, "next_cursors": {sensor_id: cursor}}; next_cursors
+    lists only the sensors with more readings.
+    """
+    try:
+        body = request.get_json(silent=True)
+        try:
+            if not isinstance(body, dict):
+                raise ValueError("body must be a JSON object")
+            sensor_ids = body.get('sensor_ids')
+            if not isinstance(sensor_ids, list) or not sensor_ids or \
+                    not all(isinstance(s, str) and s.strip() for s in sensor_ids):
+                raise ValueError("sensor_ids must be a non-empty list of non-empty strings")
+            if len(sensor_ids) > config.BATCH_MAX_SENSORS:
+                raise ValueError(f"at most {config.BATCH_MAX_SENSORS} sensor_ids per request")
+            limit = body.get('limit', 100)
+            if not isinstance(limit, int) or isinstance(limit, bool):
+                raise ValueError("limit must be an integer")
+            sensor_type = body.get('type')
+            if not all(isinstance(body.get(name), (str, type(None))) for name in ('type', 'start', 'end')):
+                raise ValueError("type, start and end must be strings")
+            cursors = body.get('cursors') or {}
+            if not isinstance(cursors, dict):
+                raise ValueError("cursors must be an object")
+            start = data_processor.parse_time_param(body.get('start'))
+            end = data_processor.parse_time_param(body.get('end'))
+            readings, next_cursors = data_processor.get_readings_batch(sensor_ids, limit=max(1, min(limit, 1000)),
+                                                                       sensor_type=sensor_type, start=start,
+                                                                       end=end, cursors=cursors)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid parameter: {e}"}), 400
+
+        return jsonify({"readings": readings, "next_cursors": next_cursors})
+
+    except Exception as e:
+        logging.error(f"Error in /readings/batch endpoint: {e}")
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+@app.route('/readings/latest', methods=['GET'])
+@cached
+def get_readings_latest():
+    """
+    API endpoint to fetch the current (newest) value of every sensor.
+    Query Parameters:
+        sensor_id (str): Filter by sensor ID.
+        type (str): Filter by sensor type.
+    """
+    try:
+        sensor_id = request.args.get('sensor_id', default=None, type=str)
+        sensor_type = request.args.get('type', default=None, type=str)
+        return jsonify(data_processor.get_latest_readings(sensor_id=sensor_id, sensor_type=sensor_type))
+
+    except Exception as e:
+        logging.error(f"Error in /readings/latest endpoint: {e}")
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+@app.route('/readings/aggregate', methods=['GET'])
+@cached
+def get_readings_aggregate():
+    """
+    API endpoint to fetch downsampled readings (one row per sensor, type and time bucket).
+    Query Parameters:
+        bucket (str): Bucket size, e.g. 30s, 1m, 15m, 1h, 1d (required).
+        sensor_id (str): Filter by sensor ID.
+        type (str): Filter by sensor type.
+        start (str): ISO-8601 time; only readings at or after it.
+        end (str): ISO-8601 time; only readings before it.
+    """
+    try:
+        sensor_id = request.args.get('sensor_id', default=None, type=str)
+        sensor_type = request.args.get('type', default=None, type=str)
+        try:
+            bucket_seconds = data_processor.parse_bucket(request.args.get('bucket'))
+            start = data_processor.parse_time_param(request.args.get('start'))
+            end = data_processor.parse_time_param(request.args.get('end'))
+        except ValueError as e:
+            return jsonify({"error": f"Invalid parameter: {e}"}), 400
+
+        buckets = data_processor.get_aggregated_readings(bucket_seconds, sensor_id=sensor_id,
+                                                         sensor_type=sensor_type, start=start, end=end)
+        return jsonify(buckets)
+
+    except Exception as e:
+        logging.error(f"Error in /readings/aggregate endpoint: {e}")
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+@app.route('/readings/stream', methods=['GET'])
+def stream_readings():
+    """
+    API endpoint pushing newly stored readings as Server-Sent Events (text/event-stream), so
+    dashboards don't have to poll /readings. Each event's data is a JSON array of readings
+    (same fields as /readings, oldest first) and its id is the position in the change feed;
+    a 'dropped' event reports readings the client missed (re-query /readings to fill the gap).
+    Answers 503 unless config.CHANGE_FEED_ENABLED is on.
+    Query Parameters:
+        sensor_id (str): Filter by sensor ID.
+        type (str): Filter by sensor type.
+        last_event_id (int): Resume after this event id (EventSource sends the Last-Event-ID
+                             header by itself when it reconnects).
+    """
+    try:
+        sensor_id = request.args.get('sensor_id', default=None, type=str)
+        sensor_type = request.args.get('type', default=None, type=str)
+        try:
+            last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+            last_seq = int(last_event_id) if last_event_id else None
+        except ValueError as e:
+            return jsonify({"error": f"Invalid parameter: {e}"}), 400
+
+        if not config.CHANGE_FEED_ENABLED:
+            return jsonify({"error": "Live stream disabled (CHANGE_FEED_ENABLED is off)"}), 503
+        tailer = change_feed.get_tailer()
+        if tailer.subscriber_count() >= config.STREAM_MAX_CLIENTS:
+            return jsonify({"error": "Too many open streams, try again later"}), 503, {'Retry-After': '5'}
+        try:
+            subscription = tailer.subscribe(sensor_id, sensor_type, last_seq)
+        except sqlite3.Error as e:
+            logging.error(f"Live stream unavailable: {e}")
+            return jsonify({"error": "Live stream unavailable"}), 503
+
+        def events():
+            yield ": connected\n\n" # Sends the headers right away
+            while not subscription.closed:
+                entries, dropped = subscription.get(config.STREAM_HEARTBEAT_INTERVAL)
+                if entries or dropped:
+                    yield change_feed.format_events(entries, dropped)
+                elif not subscription.closed:
+                    # The keep-alive comment also makes a write fail once the client has gone
+                    yield ": keep-alive\n\n"
+
+        response = Response(events(), mimetype='text/event-stream')
+        # Runs however the response ends (client gone, server stopping), even if never iterated
+        response.call_on_close(lambda: tailer.unsubscribe(subscription))
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no' # Tell proxies (nginx) not to buffer the stream
+        return response
+
+    except Exception as e:
+        logging.error(f"Error in /readings/stream endpoint: {e}")
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+@app.route('/readings/export', methods=['GET'])
+def export_readings():
+    """
+    API endpoint to download every matching reading (newest first), streamed in chunks.
+    Unlike /readings there is no row limit; memory use stays constant.
+    Query Parameters:
+        format (str): 'ndjson' (default, one JSON object per line), 'csv', or
+                      'columnar' (binary typed arrays, read with columnar.decode()).
+        gzip (str): '1' to gzip the response (Content-Encoding: gzip).
+        sensor_id (str): Filter by sensor ID.
+        type (str): Filter by sensor type.
+        start (str): ISO-8601 time; only readings at or after it.
+        end (str): ISO-8601 time; only readings before it.
+    """
+    try:
+        fmt = request.args.get('format', default='ndjson', type=str).lower()
+        compress = request.args.get('gzip', default='0', type=str).lower() in ('1', 'true', 'yes')
+        sensor_id = request.args.get('sensor_id', default=None, type=str)
+        sensor_type = request.args.get('type', default=None, type=str)
+        try:
+            if fmt not in readings_export.FORMATS:
+                raise ValueError(f"format must be one of {', '.join(readings_export.FORMATS)}")
+            start = data_processor.parse_time_param(request.args.get('start'))
+            end = data_processor.parse_time_param(request.args.get('end'))
+        except ValueError as e:
+            return jsonify({"error": f"Invalid parameter: {e}"}), 400
+
+        chunks = data_processor.iter_reading_chunks(sensor_id=sensor_id, sensor_type=sensor_type,
+                                                    start=start, end=end)
+        mimetype, extension = readings_export.FORMATS[fmt]
+        response = Response(stream_with_context(readings_export.stream(fmt, chunks, gzip=compress)),
+                            mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="readings.{extension}"'
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    except Exception as e:
+        logging.error(f"Error in /readings/export endpoint: {e}")
+        return jsonify({"error": "An internal server error occurred"}), 500
+
 @app.route('/status', methods=['GET'])
 def get_status():
     """Health check endpoint."""
     # Could add more checks here (e.g., database connectivity)
     return jsonify({"status": "ok"})
 
+@app.route('/status/db', methods=['GET'])
+def get_db_status():
+    """Database connection pool, response cache and live stream statistics."""
+    return jsonify({"pool": data_processor.get_pool_stats(), "response_cache": cache.stats(),
+                    "stream": change_feed.get_tailer().stats()})
+
 if __name__ == '__main__':
     logging.info(f"Starting API server on {config.API_HOST}:{config.API_PORT}")
     # Make sure database is initialized before starting server
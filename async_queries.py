@@ -0,0 +1,140 @@
+# async_queries.py
+#
+# Awaitable versions of the data_processor read functions, for the async API (api_async.py).
+#
+# sqlite3 calls block, so each query runs on a thread of a bounded pool whose threads keep
+# their own database connection (db_pool.ConnectionPool.pin_thread). There are two pools
+# ("lanes"): 'latest' for the cheap latest-value lookups and 'query' for range queries and
+# aggregates, so a burst of slow long-range queries can never hold up latest-value polls.
+#
+# Requests for the same query (same function and arguments) while it is still running share
+# that one execution instead of queueing a copy: a dashboard polled by many clients costs
+# one query per refresh. A lane that already has ASYNC_MAX_PENDING queries queued or running
+# raises Overloaded, which the API answers with 503 instead of queueing without bound.
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+import config
+import data_processor
+import db_pool
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class Overloaded(Exception):
+    """Raised when a lane already has config.ASYNC_MAX_PENDING queries queued or running."""
+
+
+class QueryExecutor:
+    """Runs blocking query functions on bounded, per-lane thread pools, coalescing identical calls."""
+    def __init__(self, query_threads: int = None, latest_threads: int = None, max_pending: int = None):
+        """
+        Initializes a QueryExecutor instance.
+
+        Args:
+            query_threads: Threads of the 'query' lane. Defaults to config.ASYNC_QUERY_THREADS.
+            latest_threads: Threads of the 'latest' lane. Defaults to config.ASYNC_LATEST_THREADS.
+            max_pending: Queued calls per lane before Overloaded. Defaults to config.ASYNC_MAX_PENDING.
+        """
+        self.max_pending = config.ASYNC_MAX_PENDING if max_pending is None else max_pending
+        self.threads = {"query": query_threads or config.ASYNC_QUERY_THREADS,
+                        "latest": latest_threads or config.ASYNC_LATEST_THREADS}
+        self._lanes = {lane: ThreadPoolExecutor(threads, thread_name_prefix=lane, initializer=db_pool.pool.pin_thread)
+                       for lane, threads in self.threads.items()}
+        self._lock = threading.Lock()
+        self._in_flight = {} # key -> Future of the running call
+        self._pending = {lane: 0 for lane in self._lanes} # Submitted and not finished, per lane
+        self.executed = 0
+        self.coalesced = 0 # Calls that shared a running execution
+        self.rejected = 0
+
+    def submit(self, lane: str, func: Callable, *args, **kwargs) -> Future:
+        """
+        Runs func(*args, **kwargs) on the lane's pool, or returns the Future of an identical
+        call that is still running. Arguments must be hashable. The result is shared between
+        the callers, so it must not be modified.
+
+        Raises:
+            Overloaded: If the lane has max_pending calls queued or running.
+        """
+        # Connections follow config.DATABASE_NAME, so it is part of what makes a call identical
+        key = (lane, func, args, tuple(sorted(kwargs.items())), config.DATABASE_NAME)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            if self._pending[lane] >= self.max_pending:
+                self.rejected += 1
+                raise Overloaded(f"{self._pending[lane]} queries waiting in the '{lane}' lane")
+            self._pending[lane] += 1
+            self.executed += 1
+            future = self._lanes[lane].submit(func, *args, **kwargs)
+            self._in_flight[key] = future
+
+        def done(_future):
+            with self._lock:
+                self._pending[lane] -= 1
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+        future.add_done_callback(done)
+        return future
+
+    async def run(self, lane: str, func: Callable, *args, **kwargs):
+        """Awaitable submit(): the result of func(*args, **kwargs), run (or shared) on the lane's pool."""
+        # shield: one caller giving up (client disconnected) must not cancel the shared call
+        return await asyncio.shield(asyncio.wrap_future(self.submit(lane, func, *args, **kwargs)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"executed": self.executed, "coalesced": self.coalesced, "rejected": self.rejected,
+                    "pending": dict(self._pending), "in_flight": len(self._in_flight),
+                    "threads": dict(self.threads)}
+
+    def shutdown(self, wait: bool = True):
+        """Stops the threads (after the queued calls, with wait) and closes their connections."""
+        for pool in self._lanes.values():
+            pool.shutdown(wait=wait)
+        if wait:
+            db_pool.pool.close_all() # Pinned connections of the exited threads
+
+
+# Shared executor used by the async API (created on first use)
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor() -> QueryExecutor:
+    """Returns the shared QueryExecutor, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = QueryExecutor()
+        return _executor
+
+def shutdown():
+    """Shuts the shared executor down (the next get_executor() creates a new one)."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown()
+
+
+async def get_readings_page(limit: int = 100, sensor_id: str | None = None, sensor_type: str | None = None,
+                            start=None, end=None, cursor: str | None = None) -> tuple[list[dict], str | None]:
+    """Awaitable data_processor.get_readings_page() (same arguments, result and ValueError)."""
+    return await get_executor().run("query", data_processor.get_readings_page, limit, sensor_id, sensor_type,
+                                    start, end, cursor)
+
+async def get_latest_readings(sensor_id: str | None = None, sensor_type: str | None = None) -> list[dict]:
+    """Awaitable data_processor.get_latest_readings(), on the 'latest' lane."""
+    return await get_executor().run("latest", data_processor.get_latest_readings, sensor_id, sensor_type)
+
+async def get_aggregated_readings(bucket_seconds: int, sensor_id: str | None = None, sensor_type: str | None = None,
+                                  start=None, end=None) -> list[dict]:
+    """Awaitable data_processor.get_aggregated_readings()."""
+    return await get_executor().run("query", data_processor.get_aggregated_readings, bucket_seconds, sensor_id,
+                                    sensor_type, start, end)
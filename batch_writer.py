@@ -0,0 +1,156 @@
+# batch_writer.py
+import logging
+import queue
+import threading
+import time
+
+import config
+import data_processor
+from models import SensorReading
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Sentinel put on the queue by close() to wake the writer thread immediately
+_STOP = object()
+
+
+class BatchWriter:
+    """
+    Background writer that groups SensorReading objects into batched transactions.
+
+    Readings are queued in memory by submit() and written by a single writer thread
+    through data_processor.store_readings(), so many readings share one commit (and
+    one fsync) instead of paying for it individually.
+    """
+    def __init__(self, max_batch_size: int = None, max_latency: float = None, input_queue=None):
+        """
+        Initializes a BatchWriter instance (call start() to begin writing).
+
+        Args:
+            max_batch_size: Max readings per transaction. Defaults to config.WRITE_BATCH_MAX_SIZE.
+            max_latency: Max seconds a reading may wait before being written.
+                         Defaults to config.WRITE_BATCH_MAX_LATENCY.
+            input_queue: Queue to take readings from, e.g. a bounded
+                         ingest_pipeline.PipelineQueue. Defaults to an unbounded queue.Queue.
+        """
+        self.max_batch_size = max(1, max_batch_size or config.WRITE_BATCH_MAX_SIZE)
+        self.max_latency = config.WRITE_BATCH_MAX_LATENCY if max_latency is None else max_latency
+
+        self._queue = queue.Queue() if input_queue is None else input_queue
+        # The stop sentinel must not be subject to a bounded queue's overflow policy
+        self._put_control = getattr(self._queue, "put_control", self._queue.put)
+        self._thread = None
+        # Plain attribute (no lock) so it is safe to set from a signal handler
+        self._flush_requested = False
+
+        # Counters (only updated by the writer thread)
+        self.batches_written = 0
+        self.readings_written = 0
+        self.readings_failed = 0
+
+    def start(self):
+        """Starts the background writer thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="BatchWriter", daemon=True)
+        self._thread.start()
+        logging.info(f"Batch writer started (max batch {self.max_batch_size}, max latency {self.max_latency}s).")
+
+    def submit(self, reading: SensorReading):
+        """Queues a reading for the next batch. Never blocks on the database."""
+        self._queue.put(reading)
+
+    def request_flush(self):
+        """
+        Asks the writer thread to flush whatever is queued as soon as possible.
+        Only sets a flag, so it is safe to call from a signal handler.
+        """
+        self._flush_requested = True
+
+    def pending(self) -> int:
+        """Returns the approximate number of readings waiting to be written."""
+        return self._queue.qsize()
+
+    def close(self, timeout: float = None):
+        """
+        Stops the writer thread after writing every queued reading.
+
+        Args:
+            timeout: Max seconds to wait for the final flush (None waits indefinitely).
+        """
+        if self._thread and self._thread.is_alive():
+            self._put_control(_STOP)
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logging.error(f"Batch writer did not finish within {timeout}s; {self.pending()} readings may be lost.")
+                return
+        else:
+            # Writer never started (or already died): flush synchronously
+            batch = []
+            self._drain(batch)
+            self._flush(batch)
+        logging.info(f"Batch writer stopped. Wrote {self.readings_written} readings in "
+                     f"{self.batches_written} batches ({self.readings_failed} failed).")
+
+    def _drain(self, batch: list) -> bool:
+        """
+        Moves everything currently queued into batch without blocking.
+
+        Returns:
+            bool: True if the stop sentinel was among the drained items.
+        """
+        saw_stop = False
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return saw_stop
+            if item is _STOP:
+                saw_stop = True
+            else:
+                batch.append(item)
+
+    def _run(self):
+        """Writer thread: collect a batch, write it, repeat until close()."""
+        stopping = False
+        while not stopping:
+            batch = []
+            # Poll so a flush requested from a signal handler is noticed promptly
+            deadline = None
+            while len(batch) < self.max_batch_size:
+                if self._flush_requested:
+                    self._flush_requested = False
+                    stopping = self._drain(batch)
+                    break
+                if deadline is None:
+                    wait = 0.1
+                else:
+                    wait = min(0.1, deadline - time.monotonic())
+                    if wait <= 0:
+                        break
+                try:
+                    item = self._queue.get(timeout=wait)
+                except queue.Empty:
+                    continue
+                if item is _STOP:
+                    stopping = True
+                    self._drain(batch)
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.max_latency
+
+            # A drain may have produced more than one batch worth of readings
+            for i in range(0, len(batch), self.max_batch_size):
+                self._flush(batch[i:i + self.max_batch_size])
+
+    def _flush(self, batch: list):
+        """Writes one batch in a single transaction and updates the counters."""
+        if not batch:
+            return
+        stored = data_processor.store_readings(batch)
+        self.batches_written += 1
+        self.readings_written += stored
+        self.readings_failed += len(batch) - stored
+        if stored < len(batch):
+            logging.warning(f"Batch writer: {len(batch) - stored} of {len(batch)} readings were not stored.")
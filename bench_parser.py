@@ -0,0 +1,92 @@
+# bench_parser.py
+#
+# Microbenchmark: data_processor.parse_serial_data() vs. fast_parser.LineParser.
+#
+# Parses the same synthetic serial lines (in the configured ARDUINO_DATA_ORDER and
+# ARDUINO_DATA_SEPARATOR) with each approach and prints lines per second. The baseline
+# includes the bytes->str decode the serial reader used to do before calling it.
+#
+# Usage: python bench_parser.py [--lines 100000] [--repeat 5]
+import argparse
+import logging
+import random
+import time
+
+import config
+import data_processor
+import fast_parser
+
+
+def make_lines(count: int) -> list[bytes]:
+    """Builds count raw lines like an Arduino would send them (a few percent malformed)."""
+    rng = random.Random(42)
+    sensors = [("PHProbe-Tank1", "pH"), ("ECProbe-Tank1", "EC"), ("TempProbe-Tank1", "Water temperature"),
+               ("PHProbe-Tank2", "pH"), ("ECProbe-Tank2", "EC")]
+    lines = []
+    for i in range(count):
+        if i % 50 == 49:
+            lines.append(b"garbage without separators\r\n")
+            continue
+        sensor_id, sensor_type = rng.choice(sensors)
+        fields = {"SensorID": sensor_id, "SensorType": sensor_type, "Value": f"{rng.uniform(0, 14):.2f}"}
+        line = config.ARDUINO_DATA_SEPARATOR.join(fields.get(name, "") for name in config.ARDUINO_DATA_ORDER)
+        lines.append(line.encode("utf-8") + b"\r\n")
+    return lines
+
+
+def run_baseline(lines: list[bytes]) -> int:
+    parsed = 0
+    for line in lines:
+        if data_processor.parse_serial_data(line.decode('utf-8', errors='ignore').strip()):
+            parsed += 1
+    return parsed
+
+def run_parse(lines: list[bytes]) -> int:
+    parse = fast_parser.get_parser().parse
+    parsed = 0
+    for line in lines:
+        if parse(line):
+            parsed += 1
+    return parsed
+
+def run_parse_fields(lines: list[bytes]) -> int:
+    parse_fields = fast_parser.get_parser().parse_fields
+    return sum(1 for line in lines if parse_fields(line) is not None)
+
+def run_parse_batch(lines: list[bytes]) -> int:
+    return len(fast_parser.get_parser().parse_batch(lines))
+
+
+BENCHMARKS = [
+    ("parse_serial_data (decode + str)", run_baseline),
+    ("LineParser.parse (bytes)", run_parse),
+    ("LineParser.parse_fields (bytes)", run_parse_fields),
+    ("LineParser.parse_batch (bytes)", run_parse_batch),
+]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the serial line parsers.")
+    arg_parser.add_argument("--lines", type=int, default=100000, help="Lines per run")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark (best is reported)")
+    args = arg_parser.parse_args()
+
+    # The malformed lines would otherwise log one warning each
+    logging.disable(logging.WARNING)
+
+    lines = make_lines(args.lines)
+    print(f"{args.lines} lines, best of {args.repeat} runs")
+    baseline = None
+    for name, func in BENCHMARKS:
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            parsed = func(lines)
+            best = min(best, time.perf_counter() - started)
+        rate = args.lines / best
+        baseline = baseline or rate
+        print(f"  {name:<36} {rate:>12,.0f} lines/s  {rate / baseline:5.2f}x  ({parsed} parsed)")
+
+
+if __name__ == "__main__":
+    main()
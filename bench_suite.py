@@ -0,0 +1,655 @@
+# bench_suite.py
+#
+# Benchmark suite: ingest throughput and query latency, with the results as JSON so releases
+# can be compared.
+#
+#   store   - readings/s into data_processor.store_reading() and store_readings() (no serial link)
+#   ingest  - readings/s through the logger's pipeline (serial reader, spool or queues, parser,
+#             database writes), fed by a SimulatedArduino over a pseudo-terminal
+#   query   - p50/p90/p99 latency of the GET /readings endpoints (Flask test client, so without
+#             HTTP overhead) against a database seeded with --rows readings
+#   load    - requests/s and latency over HTTP with --clients concurrent clients, for the
+#             development server (python api_server.py), the production one (python wsgi.py)
+#             and the async one (python api_async.py)
+#
+# SimulatedArduino reproduces the sine-wave sketch in arduinosintest.txt (or the binary frames
+# of arduinobinarytest.txt with SERIAL_PROTOCOL=binary) for any number of sensors and rate, so
+# no hardware is needed. Pseudo-terminals need Linux/macOS (WSL2 on Windows).
+#
+# Every run prints (or writes, --output) one JSON document with the environment, settings and
+# metrics. --compare reports every rate or latency that got worse than in an earlier document
+# by more than --tolerance, and exits with 1 if there is one.
+#
+# Usage: python bench_suite.py [all|store|ingest|query] [--output results.json]
+#        python bench_suite.py query --rows 10000000 --db data/bench_10m.db   (seeded once, then reused)
+#        python bench_suite.py all --compare baseline.json
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import platform
+import random
+import select
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import config
+import binary_protocol
+import compact_schema
+import data_processor
+import ingest_pipeline
+from models import ReadingBatch, SensorReading
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+FORMAT_VERSION = 1
+
+# The three channels of arduinosintest.txt: name prefix, type, center, amplitude, phase shift
+SKETCH_CHANNELS = [("PHProbe", "pH", 7.0, 1.0, 0.0),
+                   ("ECMeter", "EC", 1500.0, 500.0, 1.57),
+                   ("TempProbe", "Water temperature", 25.0, 5.0, 3.14)]
+TIME_SCALING_FACTOR = 30000.0
+
+# Seeded databases end here, so runs against the same --db query the same data
+SEED_END_US = compact_schema.to_epoch_us(datetime(2025, 1, 1, tzinfo=timezone.utc))
+
+
+def simulated_sensors(count: int) -> list[tuple]:
+    """
+    (sensor_id, type, center, amplitude, phase) of count sensors: sensor n is channel n % 3 of
+    the sketch on tank n // 3 + 1 (PHProbe-Tank1, ECMeter-Tank1, TempProbe-Tank1, PHProbe-Tank2, ...).
+    """
+    return [(f"{prefix}-Tank{n // 3 + 1}", sensor_type, center, amplitude, phase)
+            for n in range(count) for prefix, sensor_type, center, amplitude, phase in [SKETCH_CHANNELS[n % 3]]]
+
+def sine_value(sensor: tuple, device_ms: int) -> float:
+    """The sketch's value of a simulated_sensors() entry at device time device_ms."""
+    _sensor_id, _type, center, amplitude, phase = sensor
+    return center + amplitude * math.sin(device_ms / TIME_SCALING_FACTOR + phase)
+
+
+class SimulatedArduino:
+    """
+    The example sketch behind a pseudo-terminal: the logger opens .port like a real Arduino.
+    Sensors are simulated_sensors(); lines follow config.ARDUINO_DATA_ORDER and
+    ARDUINO_DATA_SEPARATOR (DeviceTime and Seq included when configured).
+    """
+    def __init__(self, sensors: int = 3, rate: float = 10.0, protocol: str = None):
+        """
+        Initializes a SimulatedArduino instance.
+
+        Args:
+            sensors: Number of simulated sensors.
+            rate: Readings per second over all sensors; 0 sends as fast as the port takes them.
+            protocol: 'ascii' or 'binary'. Defaults to config.SERIAL_PROTOCOL. In binary mode
+                      the sensor index is the position in sensor_ids, which the logger must
+                      find in config.BINARY_SENSOR_IDS.
+        """
+        self.sensors = simulated_sensors(sensors)
+        self.rate = rate
+        self.protocol = protocol or config.SERIAL_PROTOCOL
+        self._master, self._slave = os.openpty()
+        os.set_blocking(self._master, False) # A reader that falls behind must not hang close()
+        self.port = os.ttyname(self._slave)
+        self.sent = 0
+        self.bytes_sent = 0
+        self.started = None
+        self.finished = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def sensor_ids(self) -> list[str]:
+        return [sensor[0] for sensor in self.sensors]
+
+    def reading(self, number: int, device_ms: int) -> bytes:
+        """Encodes reading number (0, 1, ...; sensors take turns) as sent at device time device_ms."""
+        index = number % len(self.sensors)
+        sensor_id, sensor_type = self.sensors[index][:2]
+        value = sine_value(self.sensors[index], device_ms)
+        if self.protocol == "binary":
+            return binary_protocol.encode_frame(index, config.BINARY_SENSOR_TYPES.index(sensor_type),
+                                                value, device_ms)
+        fields = {"SensorID": sensor_id, "SensorType": sensor_type, "Value": f"{value:.2f}",
+                  "DeviceTime": str(device_ms), "Seq": str(number)}
+        line = config.ARDUINO_DATA_SEPARATOR.join(fields.get(name, "") for name in config.ARDUINO_DATA_ORDER)
+        return line.encode("utf-8") + b"\r\n" # Serial.println() ends lines with CRLF
+
+    def start(self, count: int = None, duration: float = None):
+        """Starts sending in a thread until count readings are sent or duration seconds have passed."""
+        self._thread = threading.Thread(target=self._run, args=(count, duration), name="SimulatedArduino", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: float = None):
+        """Waits until sending has finished."""
+        self._thread.join(timeout)
+
+    def _write(self, data: bytes) -> bool:
+        """Writes all of data, waiting while the port's buffer is full. False once stopped."""
+        view = memoryview(data)
+        while view:
+            if self._stop.is_set():
+                return False
+            if not select.select([], [self._master], [], 0.1)[1]:
+                continue
+            try:
+                written = os.write(self._master, view)
+            except BlockingIOError:
+                continue
+            view = view[written:]
+            self.bytes_sent += written
+        return True
+
+    def _run(self, count: int | None, duration: float | None):
+        self.started = time.perf_counter()
+        number = 0
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            elapsed = now - self.started
+            if (duration is not None and elapsed >= duration) or (count is not None and number >= count):
+                break
+            due = int(elapsed * self.rate) - number if self.rate else 256
+            if count is not None:
+                due = min(due, count - number)
+            if due <= 0:
+                time.sleep(min(0.005, 1 / self.rate))
+                continue
+            device_ms = int(elapsed * 1000)
+            chunk = b"".join(self.reading(n, device_ms) for n in range(number, number + due))
+            if not self._write(chunk):
+                break
+            number += due
+            self.sent = number
+        self.finished = time.perf_counter()
+
+    def close(self):
+        """Stops sending and closes the pseudo-terminal."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0-100) of an ascending list."""
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def count_readings() -> int:
+    """Raw readings in the current database (config.DATABASE_NAME)."""
+    table = "compact_readings" if data_processor.use_compact_schema() else "sensor_readings"
+    with data_processor.db_pool.pool.connection() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+# --- Store ---
+
+def run_store(readings: int = 20000, single: int = 2000, batch_sizes: tuple = (100, 1000, 10000)) -> dict:
+    """
+    Measures readings/s into the current database: one store_reading() call (and commit) per
+    reading for the first `single` readings, then store_readings() with each batch size
+    (SensorReading lists, and a ReadingBatch for the largest size).
+    """
+    rng = random.Random(42)
+    sensors = simulated_sensors(3)
+    base_us = compact_schema.to_epoch_us(datetime.now(timezone.utc))
+    serial = 0 # Keeps timestamps unique across the runs
+
+    def make(count: int) -> list[tuple]:
+        nonlocal serial
+        rows = []
+        for _ in range(count):
+            sensor_id, sensor_type = sensors[serial % len(sensors)][:2]
+            rows.append((sensor_id, sensor_type, round(rng.uniform(0, 14), 2), base_us + serial * 1000))
+            serial += 1
+        return rows
+
+    metrics = {}
+    rows = make(single)
+    objects = [SensorReading.trusted(s, t, v, compact_schema.from_epoch_us(ts)) for s, t, v, ts in rows]
+    started = time.perf_counter()
+    stored = sum(1 for reading in objects if data_processor.store_reading(reading))
+    metrics["store_reading_per_second"] = round(stored / (time.perf_counter() - started), 1)
+
+    for size in batch_sizes:
+        rows = make(readings)
+        objects = [SensorReading.trusted(s, t, v, compact_schema.from_epoch_us(ts)) for s, t, v, ts in rows]
+        started = time.perf_counter()
+        stored = sum(data_processor.store_readings(objects[i:i + size]) for i in range(0, len(objects), size))
+        metrics[f"store_readings_{size}_per_second"] = round(stored / (time.perf_counter() - started), 1)
+
+    size = batch_sizes[-1]
+    rows = make(readings)
+    started = time.perf_counter()
+    stored = 0
+    for i in range(0, len(rows), size):
+        batch = ReadingBatch()
+        for row in rows[i:i + size]:
+            batch.append(*row)
+        stored += data_processor.store_readings(batch)
+    metrics[f"store_readings_batch_{size}_per_second"] = round(stored / (time.perf_counter() - started), 1)
+    return metrics
+
+
+# --- Ingest ---
+
+def run_ingest(sensors: int = 3, rate: float = 0, duration: float = 5.0, use_spool: bool = None,
+               drain_timeout: float = 30.0) -> dict:
+    """
+    Sends simulated readings through a full IngestPipeline into the current database.
+
+    Args:
+        sensors: Number of simulated sensors.
+        rate: Offered readings per second (0 = as fast as the pipeline takes them).
+        duration: Seconds to send for.
+        use_spool: Defaults to config.INGEST_SPOOL_ENABLED.
+        drain_timeout: Give up waiting for the last readings after this many seconds without progress.
+
+    Returns:
+        dict: sent/stored counts, the send and store rates, and drain_seconds (how long storing
+        lagged behind the last reading sent).
+    """
+    simulator = SimulatedArduino(sensors, rate)
+    binary_ids = config.BINARY_SENSOR_IDS
+    if simulator.protocol == "binary":
+        config.BINARY_SENSOR_IDS = simulator.sensor_ids
+    pipeline = ingest_pipeline.IngestPipeline(ports=[simulator.port], use_spool=use_spool)
+
+    def stored() -> int:
+        stats = pipeline.stats()
+        return stats["replayer"]["written"] if pipeline.use_spool else stats["writer"]["written"]
+
+    try:
+        pipeline.start()
+        deadline = time.monotonic() + 10
+        while not pipeline.reader.stats()[0]["connected"]:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"The logger didn't open {simulator.port}")
+            time.sleep(0.01)
+        simulator.start(duration=duration)
+        simulator.wait()
+        done, last_change = stored(), time.perf_counter()
+        while done < simulator.sent and time.perf_counter() - last_change < drain_timeout:
+            time.sleep(0.005)
+            count = stored()
+            if count != done:
+                done, last_change = count, time.perf_counter()
+        finished = last_change
+    finally:
+        pipeline.stop(timeout=drain_timeout)
+        simulator.close()
+        config.BINARY_SENSOR_IDS = binary_ids
+    elapsed = finished - simulator.started
+    return {"sensors": sensors, "offered_per_second": rate or None, "sent": simulator.sent, "stored": done,
+            "lost": simulator.sent - done,
+            "sent_per_second": round(simulator.sent / (simulator.finished - simulator.started), 1),
+            "stored_per_second": round(done / elapsed, 1) if elapsed > 0 else None,
+            "drain_seconds": round(max(0.0, finished - simulator.finished), 3)}
+
+
+# --- Query ---
+
+def seed_database(rows: int, sensors: int = 10, interval: float = 1.0, chunk_size: int = 50000) -> dict:
+    """
+    Fills the current database with rows simulated readings (sensors take turns, each one
+    reading every interval seconds, ending at SEED_END_US) through store_readings(), so the
+    rollups and latest values are filled too. A database seeded the same way before (noted
+    in a .seed.json file next to it) is reused as is.
+
+    Returns:
+        dict: The seed description (rows, sensors, interval, start_us, end_us, seconds).
+    """
+    seed = {"rows": rows, "sensors": sensors, "interval": interval, "schema": config.DB_SCHEMA,
+            "rollups": config.ROLLUPS_ENABLED}
+    marker = config.DATABASE_NAME + ".seed.json"
+    if os.path.exists(marker):
+        with open(marker) as f:
+            previous = json.load(f)
+        if {key: previous.get(key) for key in seed} == seed:
+            return previous
+    if count_readings():
+        raise RuntimeError(f"{config.DATABASE_NAME} already holds readings that weren't seeded with these settings")
+
+    sensor_list = simulated_sensors(sensors)
+    step_us = int(interval * 1_000_000)
+    per_sensor = -(-rows // sensors)
+    start_us = SEED_END_US - per_sensor * step_us
+    started = time.perf_counter()
+    for first in range(0, rows, chunk_size):
+        batch = ReadingBatch()
+        for n in range(first, min(first + chunk_size, rows)):
+            sensor = sensor_list[n % sensors]
+            ts = start_us + (n // sensors) * step_us
+            batch.append(sensor[0], sensor[1], round(sine_value(sensor, (ts - start_us) // 1000), 2), ts)
+        data_processor.store_readings(batch, raise_errors=True)
+        if first // chunk_size % 20 == 19:
+            print(f"  seeded {first + len(batch):,}/{rows:,} readings", file=sys.stderr)
+    seed.update(start_us=start_us, end_us=SEED_END_US, sensor_ids=[sensor[0] for sensor in sensor_list],
+                seconds=round(time.perf_counter() - started, 1))
+    with open(marker, "w") as f:
+        json.dump(seed, f)
+    return seed
+
+def _iso(ts: int) -> str:
+    return compact_schema.from_epoch_us(ts).strftime("%Y-%m-%dT%H:%M:%S")
+
+def _window(rng: random.Random, seed: dict, seconds: int, align: int = 1) -> str:
+    """start/end parameters of a random window of the seeded range, starting on a multiple of align seconds."""
+    start = rng.randrange(seed["start_us"], max(seed["start_us"] + 1, seed["end_us"] - seconds * 1_000_000))
+    start -= start % (align * 1_000_000)
+    return f"start={_iso(start)}&end={_iso(start + seconds * 1_000_000)}"
+
+def _cursor_page(client, rng, seed):
+    """Second page of a sensor's readings (the first one is fetched untimed for its cursor)."""
+    url = f"/readings?sensor_id={rng.choice(seed['sensor_ids'])}&limit=100&{_window(rng, seed, 86400)}"
+    cursor = client.get(url).headers.get("X-Next-Cursor", "")
+    return f"{url}&cursor={cursor}"
+
+# Scenario name -> function(client, rng, seed) returning the URL to time
+QUERY_SCENARIOS = {
+    "readings_newest": lambda client, rng, seed: "/readings?limit=100",
+    "readings_sensor": lambda client, rng, seed: f"/readings?sensor_id={rng.choice(seed['sensor_ids'])}&limit=100",
+    "readings_sensor_hour": lambda client, rng, seed:
+        f"/readings?sensor_id={rng.choice(seed['sensor_ids'])}&limit=1000&{_window(rng, seed, 3600)}",
+    "readings_type_day": lambda client, rng, seed: f"/readings?type=pH&limit=1000&{_window(rng, seed, 86400)}",
+    "readings_cursor_page": _cursor_page,
+    "latest": lambda client, rng, seed: "/readings/latest",
+    # Charts ask for whole buckets, which the rollups answer; an unaligned range needs the raw readings
+    "aggregate_1m_hour": lambda client, rng, seed:
+        f"/readings/aggregate?bucket=1m&sensor_id={rng.choice(seed['sensor_ids'])}&{_window(rng, seed, 3600, 60)}",
+    "aggregate_1h_week": lambda client, rng, seed:
+        f"/readings/aggregate?bucket=1h&{_window(rng, seed, 7 * 86400, 3600)}",
+    "aggregate_raw_hour": lambda client, rng, seed:
+        f"/readings/aggregate?bucket=1m&sensor_id={rng.choice(seed['sensor_ids'])}&{_window(rng, seed, 3600)}",
+    "aggregate_1d_all": lambda client, rng, seed: "/readings/aggregate?bucket=1d",
+}
+
+def run_query(seed: dict, requests: int = 200, warmup: int = 10, scenarios: list[str] = None) -> dict:
+    """
+    Times the QUERY_SCENARIOS against the current (seeded) database with the Flask test client.
+    URLs are randomized (sensor, time window) with a fixed seed, so runs are comparable.
+    The response cache is bypassed unless config.RESPONSE_CACHE_ENABLED is set by the caller.
+
+    Returns:
+        dict: Per scenario p50/p90/p99/max/mean in milliseconds and requests per second.
+    """
+    import api_server
+    api_server.cache.clear()
+    results = {}
+    with api_server.app.test_client() as client:
+        for name in scenarios or QUERY_SCENARIOS:
+            make_url = QUERY_SCENARIOS[name]
+            rng = random.Random(name)
+            timings = []
+            for i in range(warmup + requests):
+                url = make_url(client, rng, seed)
+                started = time.perf_counter()
+                response = client.get(url)
+                response.get_data()
+                elapsed = time.perf_counter() - started
+                if response.status_code != 200:
+                    raise RuntimeError(f"{url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+                if i >= warmup:
+                    timings.append(elapsed * 1000)
+            timings.sort()
+            results[name] = {"p50_ms": round(percentile(timings, 50), 3), "p90_ms": round(percentile(timings, 90), 3),
+                             "p99_ms": round(percentile(timings, 99), 3), "max_ms": round(timings[-1], 3),
+                             "mean_ms": round(sum(timings) / len(timings), 3),
+                             "requests_per_second": round(len(timings) / (sum(timings) / 1000), 1)}
+    return results
+
+
+# --- Load ---
+
+# Scenarios whose URLs don't depend on an earlier response
+LOAD_SCENARIOS = ["readings_newest", "readings_sensor", "readings_sensor_hour", "latest",
+                  "aggregate_1m_hour", "aggregate_1h_week"]
+# Server name -> script started for it
+SERVERS = {"development": "api_server.py", "production": "wsgi.py", "async": "api_async.py"}
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _get(port: int, url: str, timeout: float = 30.0) -> int:
+    """One GET on a new connection (what a browser's dashboard poll costs the server); returns the status."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request("GET", url)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+def run_load(server: str, seed: dict, clients: int = 16, duration: float = 10.0, env: dict = None) -> dict:
+    """
+    Starts one of the SERVERS on the current (seeded) database and sends it requests from
+    `clients` threads for `duration` seconds, then stops it with SIGTERM.
+
+    Args:
+        server: A key of SERVERS.
+        seed: What seed_database() returned.
+        clients: Concurrent clients, each sending its next request when the last one is answered.
+        duration: Seconds of load.
+        env: Extra environment for the server (e.g. API_WORKERS, API_THREADS).
+
+    Returns:
+        dict: Requests/s, latency percentiles (ms), errors and the server's exit code after SIGTERM.
+    """
+    port = _free_port()
+    server_env = dict(os.environ, DATABASE_NAME=config.DATABASE_NAME, API_PORT=str(port),
+                      RESPONSE_CACHE_ENABLED="1" if config.RESPONSE_CACHE_ENABLED else "0", **(env or {}))
+    process = subprocess.Popen([sys.executable, os.path.join(config.BASE_DIR, SERVERS[server])], env=server_env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if _get(port, "/status", timeout=1) == 200:
+                    break
+            except OSError:
+                pass
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"The {server} server didn't start (exit code {process.poll()})")
+            time.sleep(0.1)
+
+        rng = random.Random(server)
+        urls = [QUERY_SCENARIOS[name](None, rng, seed) for _ in range(100) for name in LOAD_SCENARIOS]
+        timings = [[] for _ in range(clients)]
+        errors = [0] * clients
+        for url in urls[:len(LOAD_SCENARIOS)]:
+            _get(port, url) # Warm up
+        started = time.perf_counter()
+        stop_at = started + duration
+
+        def client(number: int):
+            i = number * 7
+            while time.perf_counter() < stop_at:
+                url = urls[i % len(urls)]
+                i += 1
+                sent = time.perf_counter()
+                try:
+                    ok = _get(port, url) == 200
+                except OSError:
+                    ok = False
+                if ok:
+                    timings[number].append((time.perf_counter() - sent) * 1000)
+                else:
+                    errors[number] += 1
+
+        threads = [threading.Thread(target=client, args=(number,), daemon=True) for number in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            exit_code = process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            exit_code = process.wait()
+    all_timings = sorted(t for client_timings in timings for t in client_timings)
+    if not all_timings:
+        raise RuntimeError(f"No request to the {server} server succeeded")
+    return {"clients": clients, "requests": len(all_timings), "errors": sum(errors),
+            "requests_per_second": round(len(all_timings) / elapsed, 1),
+            "p50_ms": round(percentile(all_timings, 50), 3), "p90_ms": round(percentile(all_timings, 90), 3),
+            "p99_ms": round(percentile(all_timings, 99), 3), "max_ms": round(all_timings[-1], 3),
+            "exit_code": exit_code}
+
+
+# --- Results ---
+
+def environment() -> dict:
+    """Machine, versions and the settings that matter for the numbers."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=config.BASE_DIR, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    settings = ["DB_SCHEMA", "ROLLUPS_ENABLED", "DB_JOURNAL_MODE", "DB_SYNCHRONOUS", "DB_CACHE_SIZE_KIB", "DB_MMAP_SIZE",
+                "SERIAL_PROTOCOL", "ARDUINO_DATA_ORDER", "INGEST_SPOOL_ENABLED", "INGEST_SPOOL_FSYNC",
+                "INGEST_OVERFLOW_POLICY", "WRITE_BATCH_MAX_SIZE", "WRITE_BATCH_MAX_LATENCY"]
+    return {"commit": commit, "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(), "machine": platform.machine(), "cpus": os.cpu_count(),
+            "config": {name: getattr(config, name) for name in settings}}
+
+def flatten_metrics(results: dict, prefix: str = "") -> dict:
+    """{"query": {"latest": {"p99_ms": 1.2}}} -> {"query.latest.p99_ms": 1.2}"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten_metrics(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.10) -> list[dict]:
+    """
+    Compares two result documents. Rates (*_per_second, higher is better) and times (*_ms and
+    *_seconds, lower is better) present in both are checked; counts and max_ms (a single
+    request) are ignored.
+
+    Returns:
+        list[dict]: The metrics that got worse by more than tolerance (0.10 = 10 %), worst first.
+    """
+    now, before = flatten_metrics(current["results"]), flatten_metrics(baseline["results"])
+    regressions = []
+    for name, value in now.items():
+        old = before.get(name)
+        if not old:
+            continue
+        if name.endswith("_per_second"):
+            change = (old - value) / old
+        elif name.endswith(("_ms", "_seconds")) and not name.endswith("max_ms"):
+            change = (value - old) / old
+        else:
+            continue
+        if change > tolerance:
+            regressions.append({"metric": name, "baseline": old, "current": value, "worse_by": round(change, 3)})
+    return sorted(regressions, key=lambda regression: -regression["worse_by"])
+
+
+def _use_database(path: str):
+    config.DATABASE_NAME = path
+    data_processor.close_connections()
+    data_processor.initialize_database()
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Ingest and query benchmarks with JSON results.")
+    arg_parser.add_argument("suite", nargs="?", default="all", choices=["all", "store", "ingest", "query", "load"])
+    arg_parser.add_argument("--output", help="Write the JSON results to this file (default: stdout)")
+    arg_parser.add_argument("--compare", metavar="BASELINE", help="Earlier results to check for regressions")
+    arg_parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed slowdown for --compare (0.10 = 10%%)")
+    arg_parser.add_argument("--store-readings", type=int, default=20000, help="Readings per store_readings run")
+    arg_parser.add_argument("--sensors", type=int, default=3, help="Simulated sensors for the ingest runs")
+    arg_parser.add_argument("--rates", default="100,1000,0", help="Offered readings/s per ingest run (0 = unlimited)")
+    arg_parser.add_argument("--duration", type=float, default=5.0, help="Seconds per ingest run")
+    arg_parser.add_argument("--rows", type=int, default=1_000_000, help="Readings to seed for the query runs")
+    arg_parser.add_argument("--seed-sensors", type=int, default=10, help="Sensors in the seeded database")
+    arg_parser.add_argument("--db", help="Database for the query runs; seeded once and reused (default: temporary)")
+    arg_parser.add_argument("--requests", type=int, default=200, help="Timed requests per query scenario")
+    arg_parser.add_argument("--response-cache", action="store_true", help="Leave the response cache on for queries")
+    arg_parser.add_argument("--clients", type=int, default=16, help="Concurrent HTTP clients for the load runs")
+    arg_parser.add_argument("--load-duration", type=float, default=10.0, help="Seconds per load run")
+    arg_parser.add_argument("--workers", type=int, help="API_WORKERS of the production server (default: config)")
+    arg_parser.add_argument("--threads", type=int, help="API_THREADS of the production server (default: config)")
+    args = arg_parser.parse_args()
+
+    # The pipeline and store functions log every connection and database setup
+    logging.disable(logging.INFO)
+    results = {}
+    settings = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    started = datetime.now(timezone.utc)
+    with tempfile.TemporaryDirectory(prefix="bench_") as scratch:
+        config.INGEST_SPOOL_DIR = os.path.join(scratch, "spool")
+        config.INGEST_SPILL_DIR = os.path.join(scratch, "spill")
+        if args.suite in ("all", "store"):
+            print("store: timing store_reading/store_readings...", file=sys.stderr)
+            _use_database(os.path.join(scratch, "store.db"))
+            results["store"] = run_store(args.store_readings)
+        if args.suite in ("all", "ingest"):
+            results["ingest"] = {}
+            for rate in [float(rate) for rate in args.rates.split(",") if rate.strip()]:
+                name = f"rate_{rate:g}" if rate else "rate_unlimited"
+                print(f"ingest: {name}, {args.sensors} sensors, {args.duration:g}s...", file=sys.stderr)
+                _use_database(os.path.join(scratch, f"ingest_{name}.db"))
+                results["ingest"][name] = run_ingest(args.sensors, rate, args.duration)
+        if args.suite in ("all", "query", "load"):
+            _use_database(args.db or os.path.join(scratch, "query.db"))
+            print(f"{args.suite}: seeding {args.rows:,} readings into {config.DATABASE_NAME} (if not done before)...",
+                  file=sys.stderr)
+            seed = seed_database(args.rows, args.seed_sensors)
+            seed_info = {key: seed[key] for key in ("rows", "sensors", "interval", "seconds") if key in seed}
+            config.RESPONSE_CACHE_ENABLED = args.response_cache
+        if args.suite in ("all", "query"):
+            print(f"query: timing {len(QUERY_SCENARIOS)} scenarios...", file=sys.stderr)
+            results["query"] = {"seed": seed_info, **run_query(seed, args.requests)}
+        if args.suite in ("all", "load"):
+            data_processor.close_connections()
+            env = {name: str(value) for name, value in (("API_WORKERS", args.workers), ("API_THREADS", args.threads))
+                   if value}
+            results["load"] = {"seed": seed_info}
+            for server in SERVERS:
+                print(f"load: {server} server, {args.clients} clients, {args.load_duration:g}s...", file=sys.stderr)
+                results["load"][server] = run_load(server, seed, args.clients, args.load_duration, env)
+        data_processor.close_connections()
+
+    document = {"format": FORMAT_VERSION, "created": started.isoformat(), "environment": environment(),
+                "settings": settings, "results": results}
+    text = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(document, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']} -> {regression['current']} "
+                  f"({regression['worse_by']:.0%} worse)", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare} (tolerance {args.tolerance:.0%}).", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
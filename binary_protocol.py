@@ -0,0 +1,190 @@
+# binary_protocol.py
+#
+# Optional binary framing for the serial link (config.SERIAL_PROTOCOL = 'binary').
+#
+# Instead of "PHProbe-Tank1,pH,7.01\r\n" (21+ bytes per sample at 9600 baud) the Arduino
+# sends fixed 12-byte frames, little-endian:
+#
+#     u8   sync         0xA5
+#     u8   sensor index into config.BINARY_SENSOR_IDS
+#     u8   type code    into config.BINARY_SENSOR_TYPES
+#     f32  value
+#     u32  device time  millis() on the Arduino; becomes the reading time (clock_sync.py)
+#     u8   CRC-8        Dallas/Maxim (poly 0x31 reflected, as in the OneWire library) of
+#                       the 10 bytes between sync and CRC
+#
+# FrameDecoder pulls frames out of whatever chunks the port delivers, unpacking whole runs
+# of them with struct.iter_unpack, and counts CRC errors and skipped bytes instead of
+# silently dropping them. A corrupt frame makes it re-synchronize on the next sync byte.
+# encode_frame() is the reference encoder; arduinobinarytest.txt is the matching sketch.
+import logging
+import struct
+from datetime import datetime, timezone
+
+import config
+import clock_sync
+import compact_schema
+from models import ParsedBatch, SensorReading
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SYNC = 0xA5
+FRAME = struct.Struct("<BBBfIB") # sync, sensor index, type code, value, device ms, crc
+_PAYLOAD = struct.Struct("<BBfI") # The CRC-protected part
+
+def _crc8_table() -> bytes:
+    table = bytearray(256)
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8C if crc & 1 else crc >> 1
+        table[byte] = crc
+    return bytes(table)
+
+_CRC8_TABLE = _crc8_table()
+
+def crc8(data) -> int:
+    """CRC-8/MAXIM of data (same result as OneWire::crc8 on the Arduino)."""
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+def encode_frame(sensor_index: int, type_code: int, value: float, device_ms: int) -> bytes:
+    """
+    Reference encoder: builds one frame exactly as the Arduino sketch does.
+
+    Raises:
+        struct.error: If an index/code doesn't fit in a byte or device_ms in 32 bits.
+    """
+    payload = _PAYLOAD.pack(sensor_index, type_code, value, device_ms & 0xFFFFFFFF)
+    return bytes((SYNC,)) + payload + bytes((crc8(payload),))
+
+
+class FrameDecoder:
+    """Splits a serial byte stream into CRC-checked frames (one decoder per port)."""
+    def __init__(self):
+        self._buffer = bytearray()
+        self.frames = 0
+        self.crc_errors = 0 # Candidate frames whose checksum didn't match
+        self.skipped_bytes = 0 # Bytes dropped while looking for a valid frame
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """
+        Adds received bytes and returns every complete, valid frame (12 bytes each).
+        An incomplete frame at the end is kept for the next call.
+        """
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        pos = 0
+        size = FRAME.size
+        while True:
+            start = buffer.find(SYNC, pos)
+            if start < 0:
+                self.skipped_bytes += len(buffer) - pos
+                pos = len(buffer)
+                break
+            self.skipped_bytes += start - pos
+            count = (len(buffer) - start) // size
+            if not count:
+                pos = start
+                break
+            # Unpack the whole run of frames after the sync byte at once
+            chunk = bytes(buffer[start:start + count * size])
+            bad = None
+            for i, (sync, _index, _code, _value, _ms, crc) in enumerate(FRAME.iter_unpack(chunk)):
+                offset = i * size
+                if sync != SYNC or crc8(chunk[offset + 1:offset + size - 1]) != crc:
+                    bad = offset
+                    break
+                frames.append(chunk[offset:offset + size])
+            if bad is None:
+                pos = start + count * size
+                continue
+            # Corrupted frame (or a 0xA5 that wasn't a frame start): count it and
+            # re-synchronize on the next sync byte after it
+            if chunk[bad] == SYNC:
+                self.crc_errors += 1
+            self.skipped_bytes += 1
+            pos = start + bad + 1
+        del buffer[:pos]
+        self.frames += len(frames)
+        return frames
+
+    def stats(self) -> dict:
+        return {"frames": self.frames, "crc_errors": self.crc_errors, "skipped_bytes": self.skipped_bytes}
+
+
+class FrameParser:
+    """
+    Turns validated frames into readings. Offers the same parse()/parse_batch() interface as
+    fast_parser.LineParser, so the ingest stages and the spool don't care which protocol is used.
+    """
+    def __init__(self, sensor_ids: list[str] = None, sensor_types: list[str] = None):
+        self.sensor_ids = list(config.BINARY_SENSOR_IDS if sensor_ids is None else sensor_ids)
+        self.sensor_types = list(config.BINARY_SENSOR_TYPES if sensor_types is None else sensor_types)
+        self.aligner = clock_sync.TimestampAligner() # Readings are timed by the device clock in each frame
+
+    def parse_fields(self, frame: bytes) -> tuple | None:
+        """
+        Returns (sensor_id, sensor_type, value, device_ms, seq), or None for a short frame or
+        an unknown index/code. Frames have no sequence number, so seq is None.
+        """
+        if len(frame) != FRAME.size:
+            return None
+        _sync, index, code, value, device_ms, _crc = FRAME.unpack(frame)
+        if index >= len(self.sensor_ids) or code >= len(self.sensor_types):
+            return None
+        # float32 rounded to the 7 significant digits it resolves (7.01, not 7.010000228881836). Not
+        # lossless: some float32 values need 9 digits to round-trip, and move by < 1 in the 7th digit
+        return self.sensor_ids[index], self.sensor_types[code], float(f"{value:.7g}"), device_ms, None
+
+    def parse(self, frame: bytes, timestamp: datetime | None = None) -> SensorReading | None:
+        """
+        Builds a SensorReading from one frame.
+
+        Args:
+            frame: A frame returned by FrameDecoder.feed().
+            timestamp: When the frame was received (the device clock is aligned to it).
+                       Defaults to now (UTC).
+
+        Returns:
+            A SensorReading object, or None if the sensor index or type code is unknown.
+        """
+        fields = self.parse_fields(frame)
+        if fields is None:
+            logging.warning(f"Unknown sensor index/type code in frame: {frame.hex()}")
+            return None
+        host_us = compact_schema.to_epoch_us(timestamp or datetime.now(timezone.utc))
+        ts = self.aligner.timestamp_us(fields[0], fields[3], host_us)
+        return SensorReading.trusted(fields[0], fields[1], fields[2], compact_schema.from_epoch_us(ts))
+
+    def parse_batch(self, frames, timestamps=None):
+        """
+        Parses many frames into a ParsedBatch, unpacking them with one iter_unpack.
+
+        Args:
+            frames: Sequence of frames.
+            timestamps: Epoch microseconds per frame, or None to use the current time.
+        """
+        batch = ParsedBatch()
+        frames = list(frames)
+        if any(len(frame) != FRAME.size for frame in frames):
+            # Shouldn't happen (the decoder only returns whole frames); parse one by one
+            fields_list = [self.parse_fields(frame) for frame in frames]
+        else:
+            ids, types = self.sensor_ids, self.sensor_types
+            fields_list = [(ids[index], types[code], float(f"{value:.7g}"), device_ms, None)
+                           if index < len(ids) and code < len(types) else None
+                           for _sync, index, code, value, device_ms, _crc in FRAME.iter_unpack(b"".join(frames))]
+        now = compact_schema.to_epoch_us(datetime.now(timezone.utc)) if timestamps is None else None
+        for i, fields in enumerate(fields_list):
+            if fields is None:
+                batch.rejected += 1
+                continue
+            host_us = now if timestamps is None else timestamps[i]
+            batch.append(fields[0], fields[1], fields[2], self.aligner.timestamp_us(fields[0], fields[3], host_us))
+        if batch.rejected:
+            logging.warning(f"Skipped {batch.rejected} frames with an unknown sensor index/type code.")
+        return batch
@@ -0,0 +1,331 @@
+# change_feed.py
+#
+# Change feed of stored readings, for the live stream (GET /readings/stream).
+#
+# With config.CHANGE_FEED_ENABLED every insert also appends the stored readings to the small
+# readings_feed table, in the same transaction, numbered by seq (its rowid). Only the newest config.CHANGE_FEED_SIZE entries are
+# kept, so the table stays a few hundred KiB whatever the database size.
+#
+# In an API process one FeedTailer thread follows the table for all connected clients: each
+# tick it reads PRAGMA data_version (no table access) and only if another connection has
+# committed since, runs one "seq > last seq" query. New readings are then handed to every
+# Subscription whose filters match. N clients cost one tail query per tick instead of N
+# /readings polls, and nothing is queried while the logger is idle.
+#
+# seq doubles as the Server-Sent Events id, so a reconnecting client (Last-Event-ID) is sent
+# what it missed, as long as it is still in the feed.
+import json
+import logging
+import sqlite3
+import threading
+from collections import deque
+from typing import Callable
+
+import config
+import compact_schema
+import db_pool
+from models import ReadingBatch
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS readings_feed (
+        seq INTEGER PRIMARY KEY,
+        timestamp TEXT NOT NULL,
+        sensor_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        value REAL NOT NULL
+    )
+'''
+
+_INSERT_SQL = "INSERT INTO readings_feed(timestamp, sensor_id, type, value) VALUES(?,?,?,?)"
+
+# Only the oldest entries are ever deleted, so a new seq is always above every earlier one
+_PRUNE_SQL = "DELETE FROM readings_feed WHERE seq <= (SELECT MAX(seq) FROM readings_feed) - ?"
+
+_SELECT_SQL = "SELECT seq, timestamp, sensor_id, type, value FROM readings_feed WHERE seq > ? ORDER BY seq"
+_REPLAY_SQL = "SELECT seq, timestamp, sensor_id, type, value FROM readings_feed WHERE seq > ? AND seq <= ? ORDER BY seq"
+
+
+def create_schema(cursor: sqlite3.Cursor):
+    """Creates the readings_feed table if it doesn't exist."""
+    cursor.execute(_TABLE_SQL)
+
+def apply(cursor: sqlite3.Cursor, readings: list):
+    """
+    Appends freshly stored readings (SensorReading objects or a ReadingBatch) to the feed and
+    drops entries beyond config.CHANGE_FEED_SIZE. Call inside the same transaction as the raw insert.
+    """
+    if not readings:
+        return
+    # Timestamps are formatted exactly as /readings returns them (see latest_readings.apply)
+    if isinstance(readings, ReadingBatch):
+        rows = [(compact_schema.format_epoch_us(ts), sid, stype, value) for sid, stype, ts, value in readings.epoch_rows()]
+    elif config.DB_SCHEMA == "compact":
+        rows = [(compact_schema.format_epoch_us(compact_schema.to_epoch_us(r.timestamp)), r.sensor_id, r.sensor_type, r.value)
+                for r in readings]
+    else:
+        rows = [r.to_db_tuple() for r in readings]
+    cursor.executemany(_INSERT_SQL, rows)
+    cursor.execute(_PRUNE_SQL, (config.CHANGE_FEED_SIZE,))
+
+def to_dict(entry: tuple) -> dict:
+    """Converts a (seq, timestamp, sensor_id, type, value) feed entry to the /readings dictionary."""
+    return {"timestamp": entry[1], "sensor_id": entry[2], "type": entry[3], "value": entry[4]}
+
+def format_events(entries: list[tuple], dropped: int = 0) -> str:
+    """
+    Formats feed entries as Server-Sent Events: one 'message' event holding the JSON array of
+    readings (same shape as /readings, oldest first) with the last seq as its id, preceded by a
+    'dropped' event when readings were lost (the client should re-query to fill the gap).
+    """
+    out = []
+    if dropped:
+        out.append(f"event: dropped\ndata: {json.dumps({'dropped': dropped})}\n\n")
+    if entries:
+        data = json.dumps([to_dict(entry) for entry in entries], separators=(",", ":"))
+        out.append(f"id: {entries[-1][0]}\ndata: {data}\n\n")
+    return "".join(out)
+
+
+class Subscription:
+    """One client's filters plus a bounded buffer of feed entries not yet sent."""
+    def __init__(self, sensor_id: str | None = None, sensor_type: str | None = None,
+                 max_buffer: int = None, on_data: Callable[[], None] | None = None):
+        """
+        Initializes a Subscription instance.
+
+        Args:
+            sensor_id: Only readings of this sensor, if provided.
+            sensor_type: Only readings of this type, if provided.
+            max_buffer: Entries kept for a slow client before the oldest are dropped.
+                        Defaults to config.STREAM_BUFFER_SIZE.
+            on_data: Called (on the tailer thread) after entries were added, e.g. to wake an event loop.
+        """
+        self.sensor_id = sensor_id
+        self.sensor_type = sensor_type
+        self.max_buffer = max_buffer or config.STREAM_BUFFER_SIZE
+        self.on_data = on_data
+        self._entries = deque()
+        self._dropped = 0 # Dropped since the last take
+        self._cond = threading.Condition()
+        self.closed = False
+        self.delivered = 0
+        self.dropped = 0 # Total
+
+    def matches(self, entry: tuple) -> bool:
+        return ((not self.sensor_id or entry[2] == self.sensor_id) and
+                (not self.sensor_type or entry[3] == self.sensor_type))
+
+    def push(self, entries: list[tuple], missed: int = 0):
+        """Adds the matching entries; missed counts entries lost before they could be read (all sensors)."""
+        matched = [entry for entry in entries if self.matches(entry)]
+        if not matched and not missed:
+            return
+        with self._cond:
+            self._entries.extend(matched)
+            excess = max(0, len(self._entries) - self.max_buffer)
+            for _ in range(excess):
+                self._entries.popleft()
+            if excess + missed:
+                self._dropped += excess + missed
+                self.dropped += excess + missed
+            self._cond.notify_all()
+        if self.on_data is not None:
+            self.on_data()
+
+    def close(self):
+        """Ends the subscription: get() returns at once from now on."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        if self.on_data is not None:
+            self.on_data()
+
+    def _take(self) -> tuple[list[tuple], int]:
+        entries, dropped = list(self._entries), self._dropped
+        self._entries.clear()
+        self._dropped = 0
+        self.delivered += len(entries)
+        return entries, dropped
+
+    def get(self, timeout: float = None) -> tuple[list[tuple], int]:
+        """
+        Waits up to timeout seconds for entries, then returns (entries, dropped): everything
+        buffered (oldest first) and how many entries were dropped since the last call.
+        Returns ([], 0) on timeout or once closed.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._entries or self._dropped or self.closed, timeout)
+            return self._take()
+
+    def drain(self) -> tuple[list[tuple], int]:
+        """Like get() without waiting (for event loops woken by on_data)."""
+        with self._cond:
+            return self._take()
+
+
+class FeedTailer:
+    """
+    Follows the readings_feed table on one thread and fans new entries out to subscriptions.
+    The thread runs only while there are subscribers.
+    """
+    def __init__(self, interval: float = None):
+        """
+        Initializes a FeedTailer instance.
+
+        Args:
+            interval: Seconds between checks for new readings. Defaults to config.STREAM_POLL_INTERVAL.
+        """
+        self.interval = config.STREAM_POLL_INTERVAL if interval is None else interval
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._thread = None
+        self._stop = threading.Event()
+        self._conn = None
+        self._conn_path = None
+        self._version = None
+        self.last_seq = None # Newest feed entry already handed out
+        self.polls = 0
+        self.queries = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """The tailer's own connection (data_version only changes for commits of other connections)."""
+        if self._conn is None or self._conn_path != config.DATABASE_NAME:
+            self._close_connection()
+            self._conn = db_pool.open_connection(config.DATABASE_NAME)
+            self._conn_path = config.DATABASE_NAME
+        return self._conn
+
+    def _close_connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+        self._conn = None
+        self._conn_path = None
+        self._version = None
+        self.last_seq = None
+
+    def _start_position(self, conn: sqlite3.Connection):
+        if self.last_seq is None:
+            self.last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM readings_feed").fetchone()[0]
+
+    def subscribe(self, sensor_id: str | None = None, sensor_type: str | None = None, last_seq: int | None = None,
+                  on_data: Callable[[], None] | None = None, max_buffer: int = None) -> Subscription:
+        """
+        Registers a subscription for readings stored from now on.
+
+        Args:
+            sensor_id, sensor_type: Filters (None for all).
+            last_seq: id of the last event a reconnecting client received; newer entries
+                      still in the feed are queued for it right away.
+            on_data, max_buffer: See Subscription.
+
+        Raises:
+            sqlite3.Error: If the feed can't be read (e.g. the table doesn't exist yet).
+        """
+        subscription = Subscription(sensor_id, sensor_type, max_buffer, on_data)
+        with self._lock:
+            conn = self._connection()
+            self._start_position(conn)
+            if last_seq is not None and last_seq < self.last_seq:
+                entries = conn.execute(_REPLAY_SQL, (last_seq, self.last_seq)).fetchall()
+                # Entries between last_seq and the oldest kept one were pruned
+                oldest = entries[0][0] if entries else self.last_seq + 1
+                subscription.push(entries, missed=max(0, oldest - last_seq - 1))
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="feed-tailer", daemon=True)
+                self._thread.start()
+        return subscription
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def poll(self) -> int:
+        """
+        One tick: if the database changed, reads the new feed entries and hands them to the
+        subscribers. Returns the number of new entries.
+        """
+        with self._lock:
+            self.polls += 1
+            conn = self._connection()
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._version and self.last_seq is not None:
+                return 0
+            self._version = version
+            self._start_position(conn)
+            entries = conn.execute(_SELECT_SQL, (self.last_seq,)).fetchall()
+            self.queries += 1
+            if not entries:
+                return 0
+            # More readings were stored between two ticks than the feed keeps
+            missed = max(0, entries[0][0] - self.last_seq - 1)
+            self.last_seq = entries[-1][0]
+            for subscription in self._subscribers:
+                subscription.push(entries, missed)
+            return len(entries)
+
+    def _run(self):
+        current = threading.current_thread()
+        while True:
+            with self._lock:
+                if self._thread is not current:
+                    return # close() was called
+                if not self._subscribers:
+                    self._thread = None
+                    self._close_connection()
+                    return
+            try:
+                self.poll()
+            except sqlite3.Error as e:
+                logging.warning(f"Change feed: could not read new readings: {e}")
+                with self._lock:
+                    self._close_connection()
+            self._stop.wait(self.interval)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"subscribers": len(self._subscribers), "last_seq": self.last_seq,
+                    "polls": self.polls, "queries": self.queries}
+
+    def close(self):
+        """Closes every subscription and stops the thread (a later subscribe() starts it again)."""
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, set()
+            thread, self._thread = self._thread, None
+            self._stop.set()
+        for subscription in subscribers:
+            subscription.close()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        with self._lock:
+            self._close_connection()
+
+
+# Shared tailer of this process (created on first use)
+_tailer = None
+_tailer_lock = threading.Lock()
+
+def get_tailer() -> FeedTailer:
+    """Returns the process's FeedTailer, creating it on first use."""
+    global _tailer
+    with _tailer_lock:
+        if _tailer is None:
+            _tailer = FeedTailer()
+        return _tailer
+
+def shutdown():
+    """Ends every open stream of this process (before a graceful server shutdown)."""
+    with _tailer_lock:
+        tailer = _tailer
+    if tailer is not None:
+        tailer.close()
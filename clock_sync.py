@@ -0,0 +1,206 @@
+# clock_sync.py
+#
+# Maps device-supplied timestamps (Arduino millis(), see DeviceTime/Seq in ARDUINO_DATA_ORDER
+# and the binary frames) to host time.
+#
+# A device clock starts at 0 on every reset and runs a little fast or slow, and a line reaches
+# the host after a variable delay (serial buffering, a stalled reader draining a burst). For
+# each device clock we track host_time - device_time per CLOCK_SYNC_SEGMENT of device time and
+# keep the smallest value of each segment: the sample that waited least in buffers. The offset
+# is the lower envelope of those minima, a least-squares line through them once there are
+# enough segments (the slope is the drift). Readings drained in a burst therefore keep the
+# spacing the device measured instead of all getting the same host time.
+#
+# TimestampAligner adds one clock per sensor and makes the result unique per sensor: readings
+# in the same millisecond are told apart in the microsecond digits by their sequence number
+# (Seq field), or by arrival order when there is none.
+#
+# The result depends on every sample seen before, so state() / restore() let the spool replayer
+# checkpoint the aligners with its position: replaying the same lines then gives the same times.
+import logging
+import threading
+from collections import deque
+
+import config
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_WRAP_MS = 1 << 32 # millis() is an unsigned long and wraps after ~49.7 days
+
+
+class DeviceClock:
+    """Offset/drift estimate between one device clock and the host clock."""
+    def __init__(self, window: float = None, segment: float = None):
+        """
+        Initializes a DeviceClock instance.
+
+        Args:
+            window: Seconds of device time used for the estimate. Defaults to config.CLOCK_SYNC_WINDOW.
+            segment: Seconds of device time per envelope point. Defaults to config.CLOCK_SYNC_SEGMENT.
+        """
+        self.window_us = int((window or config.CLOCK_SYNC_WINDOW) * 1_000_000)
+        self.segment_us = int((segment or config.CLOCK_SYNC_SEGMENT) * 1_000_000)
+        self._segments = deque() # [segment number, device_us, smallest offset_us] per segment
+        self._last_raw_ms = None
+        self._wraps = 0
+        self.resets = 0
+        self._fit = None # (intercept, slope) of the envelope line, None = constant offset
+
+    def state(self) -> dict:
+        """The estimate as JSON-serializable data (see restore())."""
+        return {"segments": [list(segment) for segment in self._segments], "last_ms": self._last_raw_ms,
+                "wraps": self._wraps, "resets": self.resets}
+
+    def restore(self, state: dict):
+        """Continues from a state() taken earlier."""
+        self._segments = deque(list(segment) for segment in state["segments"])
+        self._last_raw_ms = state["last_ms"]
+        self._wraps = state["wraps"]
+        self.resets = state["resets"]
+        self._fit = None
+
+    def reset(self):
+        """Forgets the estimate (the device restarted)."""
+        self._segments.clear()
+        self._fit = None
+        self._wraps = 0
+
+    def _unwrap(self, device_ms: int) -> int:
+        """Handles millis() wrapping around and detects device resets."""
+        last = self._last_raw_ms
+        if last is not None and device_ms < last:
+            if last - device_ms > _WRAP_MS // 2:
+                self._wraps += 1 # Wrapped around
+            else:
+                self.resets += 1
+                logging.info(f"Device clock went back from {last} to {device_ms} ms (device restarted?); re-syncing.")
+                self.reset()
+        self._last_raw_ms = device_ms
+        return device_ms + self._wraps * _WRAP_MS
+
+    def align(self, device_ms: int, host_us: int) -> int:
+        """
+        Adds a (device time, host receive time) sample and returns the device time in host
+        epoch microseconds.
+
+        Args:
+            device_ms: Device time in milliseconds.
+            host_us: When the host received it, epoch microseconds.
+        """
+        device_us = self._unwrap(device_ms) * 1000
+        offset = host_us - device_us
+        segment = device_us // self.segment_us
+        segments = self._segments
+        if segments and segments[-1][0] == segment:
+            if offset < segments[-1][2]:
+                segments[-1][1:] = [device_us, offset]
+                self._fit = None
+        else:
+            segments.append([segment, device_us, offset])
+            while device_us - segments[0][1] > self.window_us:
+                segments.popleft()
+            self._fit = None
+        return device_us + self.offset_at(device_us)
+
+    def offset_at(self, device_us: int) -> int:
+        """Estimated host - device offset (microseconds) at a device time."""
+        segments = self._segments
+        if len(segments) < config.CLOCK_SYNC_MIN_SEGMENTS:
+            # Too little history for a drift estimate: the best (smallest) offset so far
+            return min(offset for _, _, offset in segments)
+        if self._fit is None:
+            # Least squares through the segment minima (x relative to the first for precision)
+            x0 = segments[0][1]
+            n = len(segments)
+            mean_x = sum(d - x0 for _, d, _ in segments) / n
+            mean_y = sum(o for _, _, o in segments) / n
+            var = sum((d - x0 - mean_x) ** 2 for _, d, _ in segments)
+            slope = sum((d - x0 - mean_x) * (o - mean_y) for _, d, o in segments) / var if var else 0.0
+            # Shift the line down onto the envelope, so no minimum lies below it
+            intercept = min(o - slope * (d - x0) for _, d, o in segments)
+            self._fit = (x0, intercept, slope)
+        x0, intercept, slope = self._fit
+        return int(intercept + slope * (device_us - x0))
+
+    def current_offset_us(self) -> int | None:
+        """Estimated host - device offset (microseconds) at the latest sample, None before the first."""
+        if not self._segments:
+            return None
+        return self.offset_at(self._segments[-1][1])
+
+    @property
+    def drift_ppm(self) -> float | None:
+        """Estimated drift (device clock vs host) in parts per million, once there is a fit."""
+        if len(self._segments) >= config.CLOCK_SYNC_MIN_SEGMENTS:
+            self.offset_at(self._segments[-1][1])
+            return -self._fit[2] * 1e6
+        return None
+
+
+class TimestampAligner:
+    """
+    Turns device times (and sequence numbers) into unique host timestamps, one DeviceClock per sensor.
+
+    Thread-safe: the parse stage aligns readings while stats() is read from the API thread.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clocks = {} # sensor_id -> DeviceClock
+        self._last = {} # sensor_id -> timestamp (epoch us) of its previous reading
+        self.carried = {} # sensor_id -> times its readings ran out of microsecond slots in a millisecond
+
+    def timestamp_us(self, sensor_id: str, device_ms: int, host_us: int, seq: int | None = None) -> int:
+        """
+        Returns the reading's timestamp in epoch microseconds.
+
+        The aligned time is rounded to the device's millisecond; the microsecond digits are
+        seq % 1000 (0 without a Seq field). The result is always after the sensor's previous
+        timestamp, so two readings never share a primary key: a reading that would not be is
+        placed 1 us after the previous one. If that runs past the millisecond's last
+        microsecond (more than 1000 readings in it), the reading moves into the next
+        millisecond, which is logged and counted.
+        """
+        with self._lock:
+            clock = self._clocks.get(sensor_id)
+            if clock is None:
+                clock = self._clocks[sensor_id] = DeviceClock()
+            ms = clock.align(device_ms, host_us) // 1000
+            ts = ms * 1000 + (seq % 1000 if seq is not None else 0)
+            last = self._last.get(sensor_id)
+            if last is not None and ts <= last:
+                ts = last + 1
+                if ts % 1000 == 0:
+                    if sensor_id not in self.carried:
+                        logging.warning(f"{sensor_id}: readings ran past the 1000 microsecond slots of a device "
+                                        "millisecond; moving them into the next one.")
+                    self.carried[sensor_id] = self.carried.get(sensor_id, 0) + 1
+            self._last[sensor_id] = ts
+            return ts
+
+    def state(self) -> dict:
+        """Every sensor's clock and last timestamp as JSON-serializable data (see restore())."""
+        with self._lock:
+            return {sensor_id: {"clock": clock.state(), "last_us": self._last.get(sensor_id)}
+                    for sensor_id, clock in self._clocks.items()}
+
+    def restore(self, state: dict):
+        """Replaces the current state with a state() taken earlier."""
+        clocks, last = {}, {}
+        for sensor_id, entry in state.items():
+            clock = clocks[sensor_id] = DeviceClock()
+            clock.restore(entry["clock"])
+            if entry["last_us"] is not None:
+                last[sensor_id] = entry["last_us"]
+        with self._lock:
+            self._clocks, self._last = clocks, last
+
+    def stats(self) -> dict:
+        """Offset (ms) and drift (ppm) per sensor clock."""
+        stats = {}
+        with self._lock:
+            for sensor_id, clock in self._clocks.items():
+                offset, drift = clock.current_offset_us(), clock.drift_ppm
+                stats[sensor_id] = {"offset_ms": None if offset is None else round(offset / 1000, 1),
+                                    "drift_ppm": None if drift is None else round(drift, 1),
+                                    "resets": clock.resets, "carried": self.carried.get(sensor_id, 0)}
+        return stats
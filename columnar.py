@@ -0,0 +1,206 @@
+# columnar.py
+#
+# Compact binary columnar format for bulk readings ("rcol"), served by
+# /readings/export?format=columnar and read back with decode() / to_dataframe().
+#
+# The server side needs only the standard library; it packs each chunk of rows from
+# data_processor.iter_reading_chunks() straight into typed arrays. Analysis clients get
+# timestamps and values as fixed-width little-endian arrays that numpy.frombuffer() maps
+# without parsing, instead of one JSON string per timestamp and per value.
+#
+# Layout (all integers little-endian):
+#   stream header:  b"RCOL" | u8 version | 3 zero bytes
+#   batch, repeated:
+#       u32 rows | u32 new sensor names | u32 new type names
+#       new names:  (u32 byte length | UTF-8 bytes) per name, then zero padding to 8 bytes
+#       int64[rows]   timestamp, epoch microseconds (UTC)
+#       float64[rows] value
+#       uint32[rows]  sensor index (into every sensor name sent so far, in order)
+#       uint32[rows]  type index   (same, for type names)
+#   end of stream:  a batch header with rows = 0 and no new names
+# Name dictionaries grow across batches (each batch only adds unseen names), so the
+# encoder never needs to see the whole result first.
+# Version 1 used u16 name counts and lengths; decode() still reads it.
+import struct
+import sys
+from array import array
+
+import compact_schema
+
+MAGIC = b"RCOL"
+VERSION = 2
+MIMETYPE = "application/vnd.sensor-readings.columnar"
+
+_STREAM_HEADER = struct.Struct("<4sB3x")
+_BATCH_HEADER = struct.Struct("<III")
+_NAME_LENGTH = struct.Struct("<I")
+# version -> (batch header, name length) structs decode() accepts
+_VERSIONS = {1: (struct.Struct("<IHH"), struct.Struct("<H")), VERSION: (_BATCH_HEADER, _NAME_LENGTH)}
+
+
+def _little_endian(values: array) -> bytes:
+    """Raw bytes of an array in little-endian order."""
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _pad(size: int) -> bytes:
+    """Zero bytes that bring size up to a multiple of 8 (keeps the arrays 8-byte aligned)."""
+    return b"\0" * (-size % 8)
+
+
+class ColumnarEncoder:
+    """Turns row chunks into format batches, keeping the name dictionaries between them."""
+    def __init__(self):
+        self._sensors = {} # name -> index
+        self._types = {}
+
+    @staticmethod
+    def _index(dictionary: dict, name: str, new: list) -> int:
+        index = dictionary.get(name)
+        if index is None:
+            index = dictionary[name] = len(dictionary)
+            new.append(name)
+        return index
+
+    def header(self) -> bytes:
+        return _STREAM_HEADER.pack(MAGIC, VERSION)
+
+    def batch(self, rows: list) -> bytes:
+        """
+        Encodes one chunk of (timestamp, sensor_id, type, value) rows.
+        timestamp may be epoch microseconds (compact schema) or an ISO string (legacy schema).
+        """
+        timestamps = array("q")
+        values = array("d")
+        sensor_indexes = array("I")
+        type_indexes = array("I")
+        new_sensors = []
+        new_types = []
+        for ts, sensor_id, sensor_type, value in rows:
+            timestamps.append(ts if isinstance(ts, int) else compact_schema.iso_to_epoch_us(ts))
+            values.append(value)
+            sensor_indexes.append(self._index(self._sensors, sensor_id, new_sensors))
+            type_indexes.append(self._index(self._types, sensor_type, new_types))
+
+        names = bytearray(_BATCH_HEADER.pack(len(rows), len(new_sensors), len(new_types)))
+        for name in new_sensors + new_types:
+            encoded = name.encode("utf-8")
+            names += _NAME_LENGTH.pack(len(encoded)) + encoded
+        names += _pad(len(names))
+        return b"".join([bytes(names), _little_endian(timestamps), _little_endian(values),
+                         _little_endian(sensor_indexes), _little_endian(type_indexes)])
+
+    def end(self) -> bytes:
+        return _BATCH_HEADER.pack(0, 0, 0) + _pad(_BATCH_HEADER.size)
+
+def encode_stream(chunks):
+    """Yields the format's bytes for an iterable of row chunks, one piece per chunk."""
+    encoder = ColumnarEncoder()
+    yield encoder.header()
+    for rows in chunks:
+        if rows:
+            yield encoder.batch(rows)
+    yield encoder.end()
+
+
+# --- Client side ---
+
+def decode(data: bytes) -> dict:
+    """
+    Reads a columnar export.
+
+    With numpy installed the arrays are numpy views of data (no copy for a single-batch
+    export, one concatenation otherwise); without it they are array.array objects.
+
+    Args:
+        data: The complete response body (gunzipped).
+
+    Returns:
+        dict: {"timestamp_us": int64 array, "value": float64 array,
+               "sensor_index": uint32 array, "type_index": uint32 array,
+               "sensors": [names], "types": [names]}
+
+    Raises:
+        ValueError: If data isn't a complete columnar export.
+    """
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    view = memoryview(data)
+    if len(view) < _STREAM_HEADER.size:
+        raise ValueError("not a columnar readings export")
+    magic, version = _STREAM_HEADER.unpack_from(view, 0)
+    if magic != MAGIC or version not in _VERSIONS:
+        raise ValueError("not a columnar readings export (or unsupported version)")
+    batch_header, name_length = _VERSIONS[version]
+
+    offset = _STREAM_HEADER.size
+    sensors, types = [], []
+    columns = {"timestamp_us": [], "value": [], "sensor_index": [], "type_index": []}
+    dtypes = [("timestamp_us", "q", "<i8", 8), ("value", "d", "<f8", 8),
+              ("sensor_index", "I", "<u4", 4), ("type_index", "I", "<u4", 4)]
+    try:
+        while True:
+            rows, new_sensors, new_types = batch_header.unpack_from(view, offset)
+            offset += batch_header.size
+            for names, count in ((sensors, new_sensors), (types, new_types)):
+                for _ in range(count):
+                    (length,) = name_length.unpack_from(view, offset)
+                    offset += name_length.size
+                    if offset + length > len(view):
+                        raise ValueError("truncated columnar readings export")
+                    names.append(bytes(view[offset:offset + length]).decode("utf-8"))
+                    offset += length
+            offset += -offset % 8
+            if rows == 0:
+                break
+            for name, typecode, dtype, width in dtypes:
+                end = offset + rows * width
+                if end > len(view):
+                    raise ValueError("truncated columnar readings export")
+                if numpy is not None:
+                    columns[name].append(numpy.frombuffer(view, dtype=dtype, count=rows, offset=offset))
+                else:
+                    values = array(typecode)
+                    values.frombytes(view[offset:end])
+                    if sys.byteorder == "big":
+                        values.byteswap()
+                    columns[name].append(values)
+                offset = end
+    except struct.error:
+        raise ValueError("truncated columnar readings export")
+
+    result = {"sensors": sensors, "types": types}
+    for name, typecode, dtype, _ in dtypes:
+        parts = columns[name]
+        if numpy is not None:
+            if not parts:
+                result[name] = numpy.empty(0, dtype=dtype)
+            else:
+                result[name] = parts[0] if len(parts) == 1 else numpy.concatenate(parts)
+        else:
+            combined = array(typecode)
+            for part in parts:
+                combined.extend(part)
+            result[name] = combined
+    return result
+
+def to_dataframe(data: bytes):
+    """
+    Reads a columnar export into a pandas DataFrame with the /readings columns:
+    timestamp (datetime64[ns, UTC]), sensor_id and type (categoricals), value (float64).
+    Requires pandas.
+    """
+    import pandas as pd
+
+    columns = decode(data)
+    return pd.DataFrame({
+        "timestamp": pd.to_datetime(columns["timestamp_us"], unit="us", utc=True),
+        "sensor_id": pd.Categorical.from_codes(columns["sensor_index"].astype("int64"), categories=columns["sensors"]),
+        "type": pd.Categorical.from_codes(columns["type_index"].astype("int64"), categories=columns["types"]),
+        "value": columns["value"],
+    })
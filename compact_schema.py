@@ -0,0 +1,238 @@
+# compact_schema.py
+#
+# Compact storage schema for sensor readings (enabled with DB_SCHEMA = 'compact' in config.py).
+#
+# Instead of repeating sensor_id/type strings and a 32-byte ISO timestamp in every row
+# (and again in every index), readings are stored as small integers:
+#
+#     sensors(sensor_key, sensor_id)         dictionary table, one row per sensor
+#     types(type_key, type)                  dictionary table, one row per sensor type
+#     compact_readings(sensor_key, ts, type_key, value)
+#                                            WITHOUT ROWID, clustered on (sensor_key, ts)
+#
+# ts is the reading time in microseconds since the Unix epoch (UTC).
+#
+# Run this file to migrate an existing database from the legacy sensor_readings table:
+#     python compact_schema.py [--batch-size N] [--drop-legacy]
+import argparse
+import logging
+import sqlite3
+import sys
+import threading
+
+import config
+import db_pool
+# Epoch-microsecond conversions (ts columns); re-exported for existing callers
+from models import to_epoch_us, from_epoch_us, format_epoch_us, iso_to_epoch_us
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SCHEMA_STATEMENTS = [
+    '''
+    CREATE TABLE IF NOT EXISTS sensors (
+        sensor_key INTEGER PRIMARY KEY,
+        sensor_id TEXT NOT NULL UNIQUE
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS types (
+        type_key INTEGER PRIMARY KEY,
+        type TEXT NOT NULL UNIQUE
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS compact_readings (
+        sensor_key INTEGER NOT NULL,
+        ts INTEGER NOT NULL,
+        type_key INTEGER NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (sensor_key, ts, type_key)
+    ) WITHOUT ROWID
+    ''',
+    # Secondary indexes on a WITHOUT ROWID table carry the primary key columns,
+    # so these stay three or four small integers wide.
+    'CREATE INDEX IF NOT EXISTS idx_compact_type_ts ON compact_readings (type_key, ts)',
+    'CREATE INDEX IF NOT EXISTS idx_compact_ts ON compact_readings (ts)',
+]
+
+INSERT_SQL = ''' INSERT INTO compact_readings(sensor_key, ts, type_key, value)
+                 VALUES(?,?,?,?) '''
+
+
+# --- Dictionary tables ---
+
+class KeyCache:
+    """
+    In-process cache of the sensors/types dictionary tables.
+
+    Keys are never deleted or reused, so a cached mapping stays valid for the life
+    of the database file. Mappings are kept per database path.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._maps = {} # (database, table) -> {name: key}
+
+    def _map(self, table: str) -> dict:
+        return self._maps.setdefault((config.DATABASE_NAME, table), {})
+
+    def lookup(self, conn: sqlite3.Connection, table: str, name: str) -> int | None:
+        """
+        Returns the key for name in table ('sensors' or 'types'), or None if unknown.
+        Never creates a key, so it is safe on read-only paths.
+        """
+        with self._lock:
+            key = self._map(table).get(name)
+        if key is not None:
+            return key
+        key_col, name_col = _TABLE_COLUMNS[table]
+        row = conn.execute(f"SELECT {key_col} FROM {table} WHERE {name_col} = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        with self._lock:
+            self._map(table)[name] = row[0]
+        return row[0]
+
+    def get_or_create(self, conn: sqlite3.Connection, table: str, names: set) -> dict:
+        """
+        Returns {name: key} for every name, inserting unknown names into table.
+
+        New keys are committed immediately so that a later rollback of the reading
+        insert can never leave the cache pointing at a key that isn't in the file.
+        """
+        with self._lock:
+            known = self._map(table)
+            result = {name: known[name] for name in names if name in known}
+        missing = [name for name in names if name not in result]
+        if missing:
+            key_col, name_col = _TABLE_COLUMNS[table]
+            conn.executemany(f"INSERT OR IGNORE INTO {table}({name_col}) VALUES(?)",
+                             [(name,) for name in missing])
+            conn.commit()
+            for name in missing:
+                row = conn.execute(f"SELECT {key_col} FROM {table} WHERE {name_col} = ?", (name,)).fetchone()
+                result[name] = row[0]
+            with self._lock:
+                self._map(table).update({name: result[name] for name in missing})
+        return result
+
+    def clear(self):
+        """Forgets every cached mapping (e.g. when the database file is replaced)."""
+        with self._lock:
+            self._maps.clear()
+
+
+_TABLE_COLUMNS = {
+    "sensors": ("sensor_key", "sensor_id"),
+    "types": ("type_key", "type"),
+}
+
+keys = KeyCache()
+
+
+def create_schema(cursor: sqlite3.Cursor):
+    """Creates the compact tables and indexes if they don't exist."""
+    for statement in SCHEMA_STATEMENTS:
+        cursor.execute(statement)
+
+def to_db_rows(conn: sqlite3.Connection, readings: list) -> list[tuple]:
+    """
+    Converts SensorReading objects (or a models.ReadingBatch) to compact_readings rows,
+    creating any new sensor/type keys on the way.
+
+    Returns:
+        A list of (sensor_key, ts, type_key, value) tuples in the same order as readings.
+    """
+    if hasattr(readings, "sensor_codes"):
+        # ReadingBatch: map the batch's codes to database keys once per name
+        sensor_keys = keys.get_or_create(conn, "sensors", set(readings.sensor_names))
+        type_keys = keys.get_or_create(conn, "types", set(readings.type_names))
+        sensor_key_of = [sensor_keys[name] for name in readings.sensor_names]
+        type_key_of = [type_keys[name] for name in readings.type_names]
+        return list(zip(map(sensor_key_of.__getitem__, readings.sensor_codes), readings.timestamps,
+                        map(type_key_of.__getitem__, readings.type_codes), readings.values))
+    sensor_keys = keys.get_or_create(conn, "sensors", {r.sensor_id for r in readings})
+    type_keys = keys.get_or_create(conn, "types", {r.sensor_type for r in readings})
+    return [(sensor_keys[r.sensor_id], to_epoch_us(r.timestamp), type_keys[r.sensor_type], r.value)
+            for r in readings]
+
+
+# --- Migration from the legacy schema ---
+
+def migrate_from_legacy(database: str = None, batch_size: int = 10000, drop_legacy: bool = False) -> int:
+    """
+    Copies every row of the legacy sensor_readings table into the compact schema.
+
+    Rows are copied in rowid order, batch_size rows per transaction, with INSERT OR
+    IGNORE, so an interrupted migration can simply be run again.
+
+    Args:
+        database: Database file to migrate. Defaults to config.DATABASE_NAME.
+        batch_size: Rows copied per transaction.
+        drop_legacy: Drop sensor_readings (and VACUUM) once everything is copied.
+
+    Returns:
+        int: The number of legacy rows processed.
+    """
+    database = database or config.DATABASE_NAME
+    conn = db_pool.open_connection(database)
+    try:
+        cursor = conn.cursor()
+        create_schema(cursor)
+        conn.commit()
+
+        exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='sensor_readings'").fetchone()
+        if not exists:
+            logging.info("No legacy sensor_readings table found; nothing to migrate.")
+            return 0
+
+        # Dictionary tables first, in one statement each
+        cursor.execute("INSERT OR IGNORE INTO sensors(sensor_id) SELECT DISTINCT sensor_id FROM sensor_readings")
+        cursor.execute("INSERT OR IGNORE INTO types(type) SELECT DISTINCT type FROM sensor_readings")
+        conn.commit()
+        sensor_keys = dict(cursor.execute("SELECT sensor_id, sensor_key FROM sensors").fetchall())
+        type_keys = dict(cursor.execute("SELECT type, type_key FROM types").fetchall())
+
+        total = cursor.execute("SELECT COUNT(*) FROM sensor_readings").fetchone()[0]
+        logging.info(f"Migrating {total} readings to the compact schema...")
+
+        migrated = 0
+        last_rowid = -1
+        while True:
+            rows = cursor.execute(
+                "SELECT rowid, timestamp, sensor_id, type, value FROM sensor_readings "
+                "WHERE rowid > ? ORDER BY rowid LIMIT ?", (last_rowid, batch_size)).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+            cursor.executemany(
+                INSERT_SQL.replace("INSERT", "INSERT OR IGNORE", 1),
+                [(sensor_keys[sensor_id], iso_to_epoch_us(timestamp), type_keys[sensor_type], value)
+                 for _, timestamp, sensor_id, sensor_type, value in rows])
+            conn.commit()
+            migrated += len(rows)
+            logging.info(f"Migrated {migrated}/{total} readings")
+
+        if drop_legacy:
+            cursor.execute("DROP TABLE sensor_readings")
+            conn.commit()
+            logging.info("Dropped legacy sensor_readings table; running VACUUM to reclaim space...")
+            conn.execute("VACUUM")
+
+        logging.info("Migration complete. Set DB_SCHEMA=compact (config.py or environment) to use it.")
+        return migrated
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate sensor_readings to the compact integer-keyed schema.")
+    parser.add_argument("--database", default=None, help="Database file (default: config.DATABASE_NAME)")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Rows copied per transaction")
+    parser.add_argument("--drop-legacy", action="store_true",
+                        help="Drop the legacy table and VACUUM after copying (irreversible)")
+    args = parser.parse_args()
+    try:
+        migrate_from_legacy(args.database, batch_size=args.batch_size, drop_legacy=args.drop_legacy)
+    except (sqlite3.Error, ValueError) as e:
+        logging.error(f"Migration failed: {e}")
+        sys.exit(1)
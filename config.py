@@ -10,20 +10,111 @@ SERIAL_PORT = os.environ.get("SERIAL_PORT", "/dev/ttyACM0")
 # To hardcode for development, uncomment one of the following (but don't commit secrets or local paths!):
 # SERIAL_PORT = '/dev/ttyACM0'  # Linux/Raspberry Pi typical
 # SERIAL_PORT = 'COM3'          # Windows typical
+# SERIAL_PORTS: every port the logger reads (one per Arduino), comma-separated in the environment.
+# Example: --env SERIAL_PORTS=/dev/ttyACM0,/dev/ttyACM1,/dev/ttyUSB0
+# Defaults to just SERIAL_PORT.
+SERIAL_PORTS = [port.strip() for port in os.environ.get("SERIAL_PORTS", SERIAL_PORT).split(",") if port.strip()]
 SERIAL_BAUD_RATE = 9600       # Must match Arduino's Serial.begin() rate
 SERIAL_TIMEOUT = 1            # Serial read timeout (seconds)
-SERIAL_RETRY_DELAY = 5        # Seconds to wait before retrying connection
+SERIAL_RETRY_DELAY = 5        # Seconds to wait before retrying a port's connection (doubles on each failure)
+SERIAL_RETRY_MAX_DELAY = 60   # Longest wait between retries of one port
+SERIAL_POLL_INTERVAL = 0.05   # Seconds between reads where ports can't be watched by the event loop (Windows)
+SERIAL_MAX_LINE_LENGTH = 1024 # Bytes without a newline before the partial line is discarded as noise
+SERIAL_READ_SIZE = 4096       # Bytes requested per read when the driver reports nothing waiting (non-blocking reads)
 
 # ----------------------
 # Database Configuration
 # ----------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
-DATABASE_NAME = os.path.join(DATA_DIR, 'sensor_data.db') # Path for DB file (inside container or local)
+DATABASE_NAME = os.environ.get("DATABASE_NAME", os.path.join(DATA_DIR, 'sensor_data.db')) # Path for DB file (inside container or local)
 os.makedirs(DATA_DIR, exist_ok=True)
 
 # SECURITY NOTE: Do not expose your database file or path in public endpoints or error messages.
 
+# DB_SCHEMA selects how readings are stored:
+#   'legacy'  - sensor_readings table with TEXT sensor_id/type and ISO timestamp strings (default)
+#   'compact' - sensors/types dictionary tables + integer-keyed compact_readings table (much smaller on disk)
+# Migrate existing data with: python compact_schema.py   (then set DB_SCHEMA=compact)
+DB_SCHEMA = os.environ.get("DB_SCHEMA", "legacy")
+
+# ROLLUPS_ENABLED: keep 1-minute/1-hour/1-day rollup tables up to date as readings are stored,
+# so /readings/aggregate can answer long ranges without scanning raw readings.
+# After enabling on an existing database (or re-enabling after running with it off),
+# backfill once with: python rollups.py
+ROLLUPS_ENABLED = os.environ.get("ROLLUPS_ENABLED", "1") == "1"
+
+# ----------------------
+# Retention (used by retention.py / serial_data_logger.py)
+# ----------------------
+# RETENTION_POLICIES: sensor type -> days of raw readings to keep. "*" applies to every type
+# not listed. None keeps raw readings forever. Example: {"*": 14, "pH": 30}
+RETENTION_POLICIES = {
+    "*": float(os.environ["RETENTION_RAW_DAYS"]) if os.environ.get("RETENTION_RAW_DAYS") else None,
+}
+# Days to keep each rollup level (None = forever), e.g. keep raw 14d, 1m rollups 90d, 1h/1d forever
+RETENTION_ROLLUP_DAYS = {"1m": None, "1h": None, "1d": None}
+RETENTION_ENABLED = os.environ.get("RETENTION_ENABLED", "0") == "1"  # Run as a background thread in the logger
+RETENTION_INTERVAL = 3600      # Seconds between retention runs in the logger
+RETENTION_CHUNK_SIZE = 1000    # Rows deleted per transaction (keeps write locks short)
+RETENTION_CHUNK_PAUSE = 0.05   # Seconds to pause between chunks so the logger can commit
+RETENTION_VACUUM_PAGES = 256   # Pages released per incremental_vacuum step
+DB_AUTO_VACUUM = "INCREMENTAL" # Applied to new databases; convert old ones with: python retention.py --enable-incremental-vacuum
+
+# ----------------------
+# Database Connection Tuning (used by db_pool.py)
+# ----------------------
+# Connections are pooled and reused. WAL lets the API read while the logger writes.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "4"))  # Idle connections kept per process
+DB_JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "WAL")  # 'WAL' or 'DELETE' (SQLite default)
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")  # NORMAL is safe with WAL; FULL fsyncs every commit
+DB_CACHE_SIZE_KIB = int(os.environ.get("DB_CACHE_SIZE_KIB", "8192"))  # Page cache per connection (KiB)
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(64 * 1024 * 1024)))  # Bytes of the DB file to memory-map (0 disables)
+DB_BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", "5.0"))  # Seconds to wait on a locked database
+DB_READ_ONLY = False  # Open connections read-only (set by wsgi.py in API workers; the logger is the only writer)
+
+# ----------------------
+# Database Write Batching (used by batch_writer.py / serial_data_logger.py)
+# ----------------------
+# Readings are queued in memory and written with one INSERT transaction per batch.
+# A batch is flushed when it reaches WRITE_BATCH_MAX_SIZE readings or when the oldest
+# queued reading has waited WRITE_BATCH_MAX_LATENCY seconds, whichever comes first.
+WRITE_BATCH_MAX_SIZE = int(os.environ.get("WRITE_BATCH_MAX_SIZE", "500"))
+WRITE_BATCH_MAX_LATENCY = float(os.environ.get("WRITE_BATCH_MAX_LATENCY", "1.0"))  # seconds
+
+# ----------------------
+# Ingest Pipeline (used by ingest_pipeline.py / serial_data_logger.py)
+# ----------------------
+# Serial reading, parsing and database writes run as separate stages connected by bounded
+# queues, so a slow commit never stops the serial ports from being drained.
+# INGEST_OVERFLOW_POLICY - what a full queue does:
+#   'spill'       - write the overflow to files in INGEST_SPILL_DIR and process it later (nothing lost)
+#   'block'       - pause the stage feeding it (the serial reader stops reading while the writer catches up)
+#   'drop_oldest' - discard the oldest queued item (bounded memory and latency, may lose readings)
+INGEST_OVERFLOW_POLICY = os.environ.get("INGEST_OVERFLOW_POLICY", "spill")
+INGEST_LINE_QUEUE_SIZE = int(os.environ.get("INGEST_LINE_QUEUE_SIZE", "10000"))  # Raw lines waiting to be parsed
+INGEST_READING_QUEUE_SIZE = int(os.environ.get("INGEST_READING_QUEUE_SIZE", "10000"))  # Readings waiting to be written
+INGEST_SPILL_DIR = os.path.join(DATA_DIR, 'spill')
+# INGEST_SPOOL_ENABLED: every line read is first appended to a write-ahead spool on disk
+# (INGEST_SPOOL_DIR) and stored in SQLite from there, with a checkpoint after each batch.
+# Readings then survive database stalls, crashes and restarts (replayed on the next start)
+# instead of living only in memory. Takes the place of the queues above, so
+# INGEST_OVERFLOW_POLICY and the queue sizes don't apply while it is on, and every write
+# batch costs an fsync (see INGEST_SPOOL_FSYNC). Opt-in.
+INGEST_SPOOL_ENABLED = os.environ.get("INGEST_SPOOL_ENABLED", "0") == "1"
+INGEST_SPOOL_DIR = os.path.join(DATA_DIR, 'spool')
+INGEST_SPOOL_SEGMENT_BYTES = 8 * 1024 * 1024  # Segment file size before starting a new one
+INGEST_SPOOL_FLUSH_INTERVAL = 0.2  # Seconds between spool writes (one write per interval; max data at risk on power loss)
+INGEST_SPOOL_FSYNC = os.environ.get("INGEST_SPOOL_FSYNC", "1") == "1"  # fsync every spool write and checkpoint
+INGEST_STATS_INTERVAL = 300  # Seconds between pipeline statistics in the logger's log (0 disables)
+# PUBSUB_ENABLED: the logger publishes every reading on a local Unix-domain socket as soon as it
+# is parsed, before it is stored (see pubsub.py), for live consumers such as alerting, pump
+# control or an MQTT bridge. Costs nothing while no one is subscribed. Off by default; the
+# socket is created owner/group read-write only (0660), so subscribers must share the logger's group.
+PUBSUB_ENABLED = os.environ.get("PUBSUB_ENABLED", "0") == "1"
+PUBSUB_SOCKET = os.environ.get("PUBSUB_SOCKET", os.path.join(DATA_DIR, 'readings.sock'))
+PUBSUB_BUFFER_SIZE = 1000  # Readings queued per subscriber before its oldest are dropped (slow subscribers)
+
 # ----------------------
 # Arduino Data Format (Parsing)
 # ----------------------
@@ -32,17 +123,85 @@ os.makedirs(DATA_DIR, exist_ok=True)
 # If your Arduino sends extra fields (e.g., timestamp), add them here and update the parser accordingly.
 # Example for custom order: ["SensorType", "SensorID", "Value"]
 #
+# Optional device clock fields:
+#   'DeviceTime' - the Arduino's millis() when it took the reading. The reading is then timed by
+#                  the device clock mapped to host time (clock_sync.py) instead of by when the
+#                  line arrived, so a burst drained after a stall keeps its real spacing.
+#   'Seq'        - a counter incremented per reading; orders readings within the same millisecond.
+# Example: ["SensorID", "SensorType", "Value", "DeviceTime", "Seq"]
+#
 # JSON compatibility: If you want to output JSON with different field names or structure,
 #   - Change ARDUINO_DATA_ORDER to match your data
 #   - Update any code that builds/parses SensorReading objects or serializes to JSON
 ARDUINO_DATA_ORDER = ["SensorID", "SensorType", "Value"]
 ARDUINO_DATA_SEPARATOR = ","  # Change if your Arduino uses a different delimiter (e.g., ';' or '\t')
 
+# SERIAL_PROTOCOL: 'ascii' (the lines above, default) or 'binary' (12-byte frames with a CRC,
+# see binary_protocol.py and arduinobinarytest.txt). Binary frames carry a sensor index and a
+# type code instead of names; they are looked up in the two lists below (index 0 = first entry).
+SERIAL_PROTOCOL = os.environ.get("SERIAL_PROTOCOL", "ascii").lower()
+BINARY_SENSOR_IDS = ["PHProbe-Tank1", "ECMeter-Tank1", "TempProbe-Tank1"]
+BINARY_SENSOR_TYPES = ["pH", "EC", "Water temperature"]
+
+# Device clock alignment (clock_sync.py): the offset to the host clock is the lower envelope of
+# the (host - device) time per segment; with enough segments a drift is fitted too.
+CLOCK_SYNC_WINDOW = 6 * 3600   # Seconds of device time the estimate is based on
+CLOCK_SYNC_SEGMENT = 60        # Seconds of device time per envelope point
+CLOCK_SYNC_MIN_SEGMENTS = 5    # Envelope points needed before drift is estimated
+
 # ----------------------
 # API Server Configuration
 # ----------------------
 API_HOST = '0.0.0.0'  # Listen on all network interfaces (for Docker/production)
-API_PORT = 5000       # Change if you want the API on a different port
+API_PORT = int(os.environ.get("API_PORT", "5000"))  # Change if you want the API on a different port
+
+# Production serving (python wsgi.py, used by the Dockerfile). `python api_server.py` still
+# starts Flask's single-process development server.
+# API_SERVER: 'builtin' (pre-forked worker processes, each with a pool of request threads)
+#             or 'waitress' (pip install waitress; one process with API_THREADS threads)
+API_SERVER = os.environ.get("API_SERVER", "builtin").lower()
+API_WORKERS = int(os.environ.get("API_WORKERS", str(min(4, os.cpu_count() or 1))))  # Worker processes (builtin server)
+API_THREADS = int(os.environ.get("API_THREADS", "8"))  # Request threads per worker
+API_SHUTDOWN_TIMEOUT = 10  # Seconds a stopping worker waits for requests in progress
+API_ACCESS_LOG = os.environ.get("API_ACCESS_LOG", "0") == "1"  # Log every request (costs throughput)
+
+# Async API (python api_async.py, or any ASGI server: uvicorn api_async:app). Queries run on
+# two bounded thread pools (async_queries.py), each thread with its own database connection:
+# one for /readings/latest and /status (cheap), one for range queries and aggregates, so slow
+# long-range queries never make latest-value polls wait. Identical queries in flight at the
+# same time are run once and share the result.
+ASYNC_QUERY_THREADS = int(os.environ.get("ASYNC_QUERY_THREADS", "4"))  # Threads for /readings and /readings/aggregate
+ASYNC_LATEST_THREADS = int(os.environ.get("ASYNC_LATEST_THREADS", "2"))  # Threads for /readings/latest
+ASYNC_MAX_PENDING = int(os.environ.get("ASYNC_MAX_PENDING", "256"))  # Queued queries per pool before answering 503
+
+# Response cache for the GET /readings endpoints (see response_cache.py). Entries are
+# dropped as soon as the database changes; the TTL only bounds how long an entry may live.
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))  # Max cached responses (LRU eviction)
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "300"))  # Max age of a cached response (seconds)
+
+# Live stream (GET /readings/stream, see change_feed.py). With CHANGE_FEED_ENABLED every stored
+# reading is also appended to the small readings_feed table, which adds an insert and a prune to
+# every write transaction; each API process tails it once per interval for all of its connected
+# clients, so the cost doesn't grow with the number of dashboards. Off by default (the stream
+# answers 503); enable it for both the logger and the API.
+CHANGE_FEED_ENABLED = os.environ.get("CHANGE_FEED_ENABLED", "0") == "1"
+CHANGE_FEED_SIZE = int(os.environ.get("CHANGE_FEED_SIZE", "10000"))  # Newest readings kept (how far a reconnecting client can catch up)
+STREAM_POLL_INTERVAL = float(os.environ.get("STREAM_POLL_INTERVAL", "0.5"))  # Seconds between checks for new readings
+STREAM_HEARTBEAT_INTERVAL = 15  # Seconds between keep-alive comments on an idle stream
+STREAM_BUFFER_SIZE = 1000  # Readings queued per client before the oldest are dropped (slow clients)
+# Open streams per process. On api_server.py/wsgi.py each one holds a request thread
+# (API_THREADS per worker), so keep it below that; api_async.py streams need no thread.
+STREAM_MAX_CLIENTS = int(os.environ.get("STREAM_MAX_CLIENTS", "4"))
+ASYNC_STREAM_MAX_CLIENTS = int(os.environ.get("ASYNC_STREAM_MAX_CLIENTS", "256"))
+
+# POST /readings/batch fetches many sensors in one query (one UNION ALL member per sensor);
+# SQLite allows at most 500 members in a compound SELECT
+BATCH_MAX_SENSORS = int(os.environ.get("BATCH_MAX_SENSORS", "100"))
+
+# /readings/export streams rows in chunks of this many readings (one short query each),
+# so memory use depends on this and not on the exported range
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", "5000"))
 
 # ----------------------
 # How to add/change config:
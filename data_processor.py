@@ -1,21 +1,45 @@
 # data_processor.py
 import sqlite3
 import logging
+import json
+import base64
 from datetime import datetime, timezone
 import config  # Assuming config.py exists
-from models import SensorReading # Class with the model of our sensor readings.
+import db_pool # Pooled, tuned SQLite connections
+import compact_schema # Optional integer-keyed storage (config.DB_SCHEMA = 'compact')
+import rollups # 1m/1h/1d rollup tables maintained at ingest
+import latest_readings # Newest value per sensor, maintained at ingest
+import change_feed # Recently stored readings, tailed by /readings/stream
+from models import ReadingBatch, SensorReading # Classes with the model of our sensor readings.
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- Database Functions ---
 
+LEGACY_INSERT_SQL = ''' INSERT INTO sensor_readings(timestamp, sensor_id, type, value)
+                        VALUES(?,?,?,?) '''
+
+def use_compact_schema() -> bool:
+    """True when readings are stored in the compact integer-keyed schema."""
+    return config.DB_SCHEMA == "compact"
+
+def _insert_sql_and_rows(conn, readings: list[SensorReading] | ReadingBatch) -> tuple[str, list[tuple]]:
+    """Returns the INSERT statement and parameter rows for the configured schema."""
+    if use_compact_schema():
+        return compact_schema.INSERT_SQL, compact_schema.to_db_rows(conn, readings)
+    if isinstance(readings, ReadingBatch):
+        return LEGACY_INSERT_SQL, readings.to_db_tuples()
+    return LEGACY_INSERT_SQL, [reading.to_db_tuple() for reading in readings]
+
 def get_db_connection():
-    """Establishes a connection to the SQLite database."""
+    """
+    Establishes a new (unpooled) connection to the SQLite database.
+    Prefer db_pool.pool.connection() for short operations; the caller must close this one.
+    """
     try:
-        # isolation_level=None for autocommit (simpler for single inserts)
-        # or manage transactions explicitly if needed
-        conn = sqlite3.connect(config.DATABASE_NAME, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+        # Pragmas (WAL, synchronous, cache/mmap size, busy timeout) come from config.py
+        conn = db_pool.open_connection(config.DATABASE_NAME)
         # Use Row factory for easier access to columns by name if needed later
         # conn.row_factory = sqlite3.Row
         return conn
@@ -23,30 +47,47 @@ def get_db_connection():
         logging.error(f"Database connection error: {e}")
         raise # Re-raise the exception if connection fails
 
+def get_pool_stats() -> dict:
+    """Returns hit/miss counters of the shared connection pool."""
+    return db_pool.pool.stats()
+
+def close_connections():
+    """Closes all idle pooled connections (e.g. before deleting or replacing the DB file)."""
+    db_pool.pool.close_all()
+    compact_schema.keys.clear()
+
 def initialize_database():
-    """Creates the sensor_readings table if it doesn't exist."""
+    """Creates the readings tables (legacy or compact, per config.DB_SCHEMA) if they don't exist."""
     conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sensor_readings (
-                timestamp TEXT NOT NULL,
-                sensor_id TEXT NOT NULL,
-                type TEXT NOT NULL,
-                value REAL NOT NULL,
-                PRIMARY KEY (timestamp, sensor_id, type)
-            )
-        ''')
-        # Add index for faster querying
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_sensor_time ON sensor_readings (sensor_id, timestamp DESC);
-        ''')
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_type_time ON sensor_readings (type, timestamp DESC);
-        ''')
+        if use_compact_schema():
+            compact_schema.create_schema(cursor)
+        else:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sensor_readings (
+                    timestamp TEXT NOT NULL,
+                    sensor_id TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    PRIMARY KEY (timestamp, sensor_id, type)
+                )
+            ''')
+            # Add index for faster querying
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_sensor_time ON sensor_readings (sensor_id, timestamp DESC);
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_type_time ON sensor_readings (type, timestamp DESC);
+            ''')
+        if config.ROLLUPS_ENABLED:
+            rollups.create_schema(cursor)
+        latest_readings.create_schema(cursor)
+        if config.CHANGE_FEED_ENABLED:
+            change_feed.create_schema(cursor)
         conn.commit()
-        logging.info("Database initialized successfully.")
+        logging.info(f"Database initialized successfully ({config.DB_SCHEMA} schema).")
     except sqlite3.Error as e:
         logging.error(f"Database initialization error: {e}")
     finally:
@@ -63,15 +104,20 @@ def store_reading(reading: SensorReading):
     Returns:
         bool: True if storage was successful, False otherwise.
     """
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        sql = ''' INSERT INTO sensor_readings(timestamp, sensor_id, type, value)
-                  VALUES(?,?,?,?) '''
-        # Use the tuple generated by the SensorReading object
-        cursor.execute(sql, reading.to_db_tuple())
-        conn.commit()
+        with db_pool.pool.connection() as conn:
+            cursor = conn.cursor()
+            # Rows come from SensorReading.to_db_tuple() (legacy) or compact_schema.to_db_rows()
+            sql, rows = _insert_sql_and_rows(conn, [reading])
+            cursor.execute(sql, rows[0])
+            if config.ROLLUPS_ENABLED:
+                rollups.apply(cursor, [reading])
+            else:
+                rollups.mark_incomplete(cursor)
+            latest_readings.apply(cursor, [reading])
+            if config.CHANGE_FEED_ENABLED:
+                change_feed.apply(cursor, [reading])
+            conn.commit()
         logging.debug(f"Stored reading: {reading}")
         return True
     except sqlite3.IntegrityError:
@@ -80,18 +126,69 @@ def store_reading(reading: SensorReading):
         logging.warning(f"IntegrityError: Could not store duplicate reading: {reading}")
         return False
     except sqlite3.Error as e:
+        # The pool rolls back anything left uncommitted
         logging.error(f"Database error storing reading {reading}: {e}")
-        # Optionally rollback if not using autocommit
-        # if conn:
-        #     conn.rollback()
         return False
-    finally:
-        if conn:
-            conn.close()
+
+def store_readings(readings: list[SensorReading] | ReadingBatch, raise_errors: bool = False) -> int:
+    """
+    Stores many SensorReading objects (or a ReadingBatch) in a single transaction.
+
+    The whole batch is written with one executemany() and one commit. If a
+    duplicate primary key aborts the batch, it is rolled back and replayed row
+    by row (still in one transaction) so only the duplicate rows are skipped.
+
+    Args:
+        readings: The SensorReading objects to store, or a ReadingBatch (stored without
+                  creating an object per reading).
+        raise_errors: Re-raise database errors (other than duplicates) instead of
+                      returning 0, for callers that retry the batch (e.g. spool.py).
+
+    Returns:
+        int: The number of readings actually stored.
+    """
+    if not readings:
+        return 0
+
+    try:
+        with db_pool.pool.connection() as conn:
+            cursor = conn.cursor()
+            sql, rows = _insert_sql_and_rows(conn, readings)
+            try:
+                cursor.executemany(sql, rows)
+                stored = readings
+            except sqlite3.IntegrityError:
+                # executemany stops at the first duplicate; undo the partial batch and
+                # insert row by row so one duplicate doesn't cost the other readings.
+                conn.rollback()
+                stored = []
+                for reading, row in zip(readings, rows):
+                    try:
+                        cursor.execute(sql, row)
+                        stored.append(reading)
+                    except sqlite3.IntegrityError:
+                        logging.warning(f"IntegrityError: Could not store duplicate reading: {reading}")
+            # Rollups, latest values and the change feed only see rows that were actually inserted, in the same transaction
+            if config.ROLLUPS_ENABLED:
+                rollups.apply(cursor, stored)
+            elif stored:
+                rollups.mark_incomplete(cursor)
+            latest_readings.apply(cursor, stored)
+            if config.CHANGE_FEED_ENABLED:
+                change_feed.apply(cursor, stored)
+            conn.commit()
+        logging.debug(f"Stored batch of {len(stored)}/{len(rows)} readings")
+        return len(stored)
+    except sqlite3.Error as e:
+        # The pool rolls back anything left uncommitted
+        logging.error(f"Database error storing batch of {len(readings)} readings: {e}")
+        if raise_errors:
+            raise
+        return 0
 
 # --- Data Parsing ---
 
-def parse_serial_data(data_line: str) -> SensorReading | None:
+def parse_serial_data(data_line: str, timestamp: datetime | None = None) -> SensorReading | None:
     """
     Parses a raw line of serial data into a SensorReading object.
     Expects data in the format defined by ARDUINO_DATA_SEPARATOR
@@ -99,6 +196,7 @@ def parse_serial_data(data_line: str) -> SensorReading | None:
 
     Args:
         data_line: The raw string received from the serial port.
+        timestamp: When the line was received. Defaults to now (UTC).
 
     Returns:
         A SensorReading object if parsing is successful, None otherwise.
@@ -122,7 +220,7 @@ def parse_serial_data(data_line: str) -> SensorReading | None:
              return None
 
         # Attempt to create a SensorReading object (handles value conversion and validation)
-        reading = SensorReading(sensor_id=sensor_id, sensor_type=sensor_type, value=value_str)
+        reading = SensorReading(sensor_id=sensor_id, sensor_type=sensor_type, value=value_str, timestamp=timestamp)
         logging.debug(f"Parsed data successfully: {reading}")
         return reading
 
@@ -134,55 +232,486 @@ def parse_serial_data(data_line: str) -> SensorReading | None:
         return None
 
 
-def get_readings_from_db(limit: int = 100, sensor_id: str | None = None, sensor_type: str | None = None) -> list[dict]:
+# --- Query Helpers ---
+
+def parse_time_param(value: str | None) -> datetime | None:
     """
-    Retrieves readings from the database, optionally filtering.
+    Parses an ISO-8601 timestamp given as a query parameter.
+    Naive timestamps are taken to be UTC.
+
+    Raises:
+        ValueError: If the value is not a valid ISO-8601 timestamp.
+    """
+    if value is None or value == "":
+        return None
+    parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def _legacy_ts(timestamp: datetime) -> str:
+    """Formats a datetime the way sensor_readings stores it, so TEXT comparisons order correctly."""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc).isoformat()
+
+def encode_cursor(key: list) -> str:
+    """Packs a keyset position into an opaque, URL-safe cursor string."""
+    payload = json.dumps({"s": config.DB_SCHEMA, "k": key}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    """
+    Unpacks a cursor produced by encode_cursor().
+
+    Raises:
+        ValueError: If the cursor is malformed or was issued for another storage schema.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        schema, key = payload["s"], payload["k"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("invalid cursor") from e
+    expected = 3 if schema == "compact" else 2
+    if schema != config.DB_SCHEMA or not isinstance(key, list) or len(key) != expected:
+        raise ValueError("invalid cursor")
+    return key
+
+def _build_readings_query(conn, sensor_id: str | None = None, sensor_type: str | None = None,
+                          start: datetime | None = None, end: datetime | None = None,
+                          after: list | None = None) -> tuple[str, list] | None:
+    """
+    Builds the newest-first readings query for the configured schema.
+
+    Every result row is (timestamp, sensor_id, type, value, *key), where key is the
+    keyset position used for cursors: (timestamp, rowid) for the legacy schema and
+    (ts, sensor_key, type_key) for the compact one. Filters, the time range and the
+    cursor all become range conditions on idx_sensor_time / idx_type_time (or their
+    compact equivalents), so paging never scans skipped rows.
 
     Args:
-        limit: Maximum number of readings to return.
+        conn: Connection used to resolve compact sensor/type keys.
         sensor_id: Filter by sensor ID if provided.
         sensor_type: Filter by sensor type if provided.
+        start: Only readings at or after this time.
+        end: Only readings before this time.
+        after: Decoded cursor; only readings strictly after it in result order.
 
     Returns:
-        A list of dictionaries, where each dictionary represents a reading.
+        (query, params) without a LIMIT clause, or None if the filters can't match anything.
     """
-    conn = None
-    try:
-        conn = get_db_connection()
-        conn.row_factory = sqlite3.Row # Get results as dictionary-like rows
-        cursor = conn.cursor()
-
-        query = "SELECT timestamp, sensor_id, type, value FROM sensor_readings"
-        params = []
-        conditions = []
+    params = []
+    conditions = []
 
+    if not use_compact_schema():
         if sensor_id:
             conditions.append("sensor_id = ?")
             params.append(sensor_id)
         if sensor_type:
             conditions.append("type = ?")
             params.append(sensor_type)
-
+        if start:
+            conditions.append("timestamp >= ?")
+            params.append(_legacy_ts(start))
+        if end:
+            conditions.append("timestamp < ?")
+            params.append(_legacy_ts(end))
+        if after:
+            conditions.append("(timestamp, rowid) < (?, ?)")
+            params.extend(after)
+        query = "SELECT timestamp, sensor_id, type, value, timestamp, rowid FROM sensor_readings"
         if conditions:
             query += " WHERE " + " AND ".join(conditions)
+        # rowid is the tie-breaker for readings with the same timestamp
+        query += " ORDER BY timestamp DESC, rowid DESC"
+        return query, params
+
+    # Resolve names to keys up front so the filters are plain integer index seeks
+    fixed = set()
+    if sensor_id:
+        sensor_key = compact_schema.keys.lookup(conn, "sensors", sensor_id)
+        if sensor_key is None:
+            return None
+        conditions.append("r.sensor_key = ?")
+        params.append(sensor_key)
+        fixed.add("r.sensor_key")
+    if sensor_type:
+        type_key = compact_schema.keys.lookup(conn, "types", sensor_type)
+        if type_key is None:
+            return None
+        conditions.append("r.type_key = ?")
+        params.append(type_key)
+        fixed.add("r.type_key")
+    if start:
+        conditions.append("r.ts >= ?")
+        params.append(compact_schema.to_epoch_us(start))
+    if end:
+        conditions.append("r.ts < ?")
+        params.append(compact_schema.to_epoch_us(end))
+    if after:
+        # Compare only the key columns not already pinned by a filter, so the
+        # row value lines up with the index being walked
+        key_columns = ["r.ts", "r.sensor_key", "r.type_key"]
+        free = [(col, val) for col, val in zip(key_columns, after) if col not in fixed]
+        conditions.append(f"({', '.join(col for col, _ in free)}) < ({', '.join('?' for _ in free)})")
+        params.extend(val for _, val in free)
+
+    # CROSS JOIN keeps compact_readings as the outer loop (walked in index order);
+    # the dictionary tables are only probed by primary key for the returned rows.
+    query = ("SELECT r.ts, s.sensor_id, t.type, r.value, r.ts, r.sensor_key, r.type_key "
+             "FROM compact_readings r "
+             "CROSS JOIN sensors s ON s.sensor_key = r.sensor_key "
+             "CROSS JOIN types t ON t.type_key = r.type_key")
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY r.ts DESC, r.sensor_key DESC, r.type_key DESC"
+    return query, params
+
+def _row_to_dict(row: tuple) -> dict:
+    """Converts a (timestamp, sensor_id, type, value, *key) row to the API dictionary."""
+    timestamp = row[0]
+    if not isinstance(timestamp, str):
+        timestamp = compact_schema.format_epoch_us(timestamp)
+    return {"timestamp": timestamp, "sensor_id": row[1], "type": row[2], "value": row[3]}
+
+
+def get_readings_page(limit: int = 100, sensor_id: str | None = None, sensor_type: str | None = None,
+                      start: datetime | None = None, end: datetime | None = None,
+                      cursor: str | None = None) -> tuple[list[dict], str | None]:
+    """
+    Retrieves one page of readings (newest first) plus a cursor for the next page.
+
+    Args:
+        limit: Maximum number of readings to return.
+        sensor_id: Filter by sensor ID if provided.
+        sensor_type: Filter by sensor type if provided.
+        start: Only readings at or after this time (inclusive).
+        end: Only readings before this time (exclusive).
+        cursor: next_cursor from a previous page, to continue where it stopped.
 
-        # Inside get_readings_from_db in data_processor.py
-        # Add rowid DESC as a secondary sort key for deterministic order
-        query += " ORDER BY timestamp DESC, rowid DESC LIMIT ?"
-        params.append(limit)
+    Returns:
+        (readings, next_cursor). next_cursor is None when there are no more readings.
 
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
+    Raises:
+        ValueError: If cursor is invalid.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    try:
+        with db_pool.pool.connection() as conn:
+            built = _build_readings_query(conn, sensor_id, sensor_type, start, end, after)
+            if built is None:
+                return [], None
+            query, params = built
+            rows = conn.execute(query + " LIMIT ?", params + [limit]).fetchall()
 
         # Convert rows to simple dictionaries
         # Note: We are *not* converting back to SensorReading objects here,
         # just returning the raw data structure expected by the API.
-        results = [dict(row) for row in rows]
-        return results
+        results = [_row_to_dict(row) for row in rows]
+        next_cursor = encode_cursor(list(rows[-1][4:])) if rows and len(rows) == limit else None
+        return results, next_cursor
 
     except sqlite3.Error as e:
         logging.error(f"Database error fetching readings: {e}")
-        return [] # Return empty list on error
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        return [], None # Return empty list on error
+
+
+def get_readings_from_db(limit: int = 100, sensor_id: str | None = None, sensor_type: str | None = None,
+                         start: datetime | None = None, end: datetime | None = None,
+                         cursor: str | None = None) -> list[dict]:
+    """
+    Retrieves readings from the database, optionally filtering.
+
+    Args:
+        limit: Maximum number of readings to return.
+        sensor_id: Filter by sensor ID if provided.
+        sensor_type: Filter by sensor type if provided.
+        start: Only readings at or after this time (inclusive).
+        end: Only readings before this time (exclusive).
+        cursor: next_cursor from get_readings_page(), to continue where it stopped.
+
+    Returns:
+        A list of dictionaries, where each dictionary represents a reading.
+    """
+    readings, _ = get_readings_page(limit, sensor_id, sensor_type, start, end, cursor)
+    return readings
+
+
+def get_readings_batch(sensor_ids: list[str], limit: int = 100, sensor_type: str | None = None,
+                       start: datetime | None = None, end: datetime | None = None,
+                       cursors: dict[str, str] | None = None) -> tuple[dict[str, list[dict]], dict[str, str]]:
+    """
+    Retrieves the newest readings of several sensors at once (what get_readings_page()
+    returns for each sensor), with one query on one connection.
+
+    The query is a UNION ALL of one "sensor_id = ? ... ORDER BY ... LIMIT ?" subquery per
+    sensor, so each sensor is an index seek on idx_sensor_time (or the compact primary key)
+    that stops after its own limit, however much history the other sensors have.
+
+    Args:
+        sensor_ids: Sensors to fetch (duplicates are ignored).
+        limit: Maximum number of readings per sensor.
+        sensor_type: Filter by sensor type if provided.
+        start: Only readings at or after this time (inclusive).
+        end: Only readings before this time (exclusive).
+        cursors: next_cursor of a previous call per sensor, to continue where it stopped.
+
+    Returns:
+        (readings, next_cursors). readings maps every requested sensor ID to its list of
+        readings (newest first); next_cursors has an entry for each sensor with more readings.
+
+    Raises:
+        ValueError: If a sensor ID is empty or blank (it would match every sensor), or a cursor is invalid.
+    """
+    if not all(sensor_id and sensor_id.strip() for sensor_id in sensor_ids):
+        raise ValueError("sensor IDs must not be empty")
+    cursors = cursors or {}
+    sensor_ids = list(dict.fromkeys(sensor_ids))
+    afters = {sensor_id: decode_cursor(cursors[sensor_id]) for sensor_id in sensor_ids if cursors.get(sensor_id)}
+    results = {sensor_id: [] for sensor_id in sensor_ids}
+    next_cursors = {}
+    try:
+        with db_pool.pool.connection() as conn:
+            subqueries = []
+            params = []
+            for sensor_id in sensor_ids:
+                built = _build_readings_query(conn, sensor_id, sensor_type, start, end, afters.get(sensor_id))
+                if built is None:
+                    continue # Unknown sensor or type (compact schema): nothing to read
+                query, query_params = built
+                # ORDER BY/LIMIT inside a compound SELECT need their own subquery
+                subqueries.append(f"SELECT * FROM ({query} LIMIT ?)")
+                params.extend(query_params + [limit])
+            if not subqueries:
+                return results, next_cursors
+            rows = conn.execute(" UNION ALL ".join(subqueries), params).fetchall()
+
+        last_rows = {}
+        for row in rows:
+            results[row[1]].append(_row_to_dict(row))
+            last_rows[row[1]] = row
+        for sensor_id, row in last_rows.items():
+            if len(results[sensor_id]) == limit:
+                next_cursors[sensor_id] = encode_cursor(list(row[4:]))
+        return results, next_cursors
+
+    except sqlite3.Error as e:
+        logging.error(f"Database error fetching batch readings: {e}")
+        return {sensor_id: [] for sensor_id in sensor_ids}, {}
+
+
+def iter_reading_chunks(sensor_id: str | None = None, sensor_type: str | None = None,
+                        start: datetime | None = None, end: datetime | None = None,
+                        chunk_size: int = None):
+    """
+    Yields every matching reading (newest first) in chunks, for exports of any size.
+
+    Each chunk is one short keyset query (the same one /readings pages with), so memory
+    stays at one chunk whatever the range, and no read transaction is held open between
+    chunks (a long export neither pins a pooled connection nor stalls WAL checkpoints).
+
+    Args:
+        sensor_id: Filter by sensor ID if provided.
+        sensor_type: Filter by sensor type if provided.
+        start: Only readings at or after this time (inclusive).
+        end: Only readings before this time (exclusive).
+        chunk_size: Rows per chunk. Defaults to config.EXPORT_CHUNK_SIZE.
+
+    Yields:
+        list[tuple]: (timestamp, sensor_id, type, value) rows. timestamp is stored as-is:
+                     an ISO string (legacy schema) or epoch microseconds (compact schema).
+
+    Raises:
+        sqlite3.Error: If a chunk can't be read (the export is then incomplete).
+    """
+    chunk_size = chunk_size or config.EXPORT_CHUNK_SIZE
+    after = None
+    while True:
+        try:
+            with db_pool.pool.connection() as conn:
+                built = _build_readings_query(conn, sensor_id, sensor_type, start, end, after)
+                if built is None:
+                    return
+                query, params = built
+                rows = conn.execute(query + " LIMIT ?", params + [chunk_size]).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Database error exporting readings: {e}")
+            raise
+        if rows:
+            yield [row[:4] for row in rows]
+        if len(rows) < chunk_size:
+            return
+        after = list(rows[-1][4:])
+
+
+def get_latest_readings(sensor_id: str | None = None, sensor_type: str | None = None) -> list[dict]:
+    """
+    Retrieves the newest reading of every (sensor_id, type) from the latest_readings table.
+
+    Args:
+        sensor_id: Filter by sensor ID if provided.
+        sensor_type: Filter by sensor type if provided.
+
+    Returns:
+        A list of dictionaries (same shape as get_readings_from_db()), ordered by sensor_id and type.
+    """
+    try:
+        with db_pool.pool.connection() as conn:
+            return latest_readings.fetch(conn, sensor_id, sensor_type)
+    except sqlite3.Error as e:
+        logging.error(f"Database error fetching latest readings: {e}")
+        return []
+
+
+# --- Aggregation ---
+
+# Whole epoch seconds of a legacy ISO timestamp. The fraction is cut off before
+# strftime() sees it (strftime rounds to milliseconds, which could push a reading
+# taken just before a bucket boundary into the next bucket); the UTC offset is kept.
+_LEGACY_EPOCH_SECONDS_SQL = (
+    "CAST(strftime('%s', CASE WHEN substr(timestamp, -6, 1) IN ('+', '-') "
+    "THEN substr(timestamp, 1, 19) || substr(timestamp, -6) "
+    "ELSE substr(timestamp, 1, 19) END) AS INTEGER)"
+)
+
+_BUCKET_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_bucket(value: str) -> int:
+    """
+    Parses a bucket size such as '30s', '1m', '15m', '1h' or '1d' into seconds.
+
+    Raises:
+        ValueError: If the bucket size is missing or malformed.
+    """
+    value = (value or "").strip().lower()
+    unit = _BUCKET_UNITS.get(value[-1:]) if value else None
+    if unit is None or not value[:-1].isdigit() or int(value[:-1]) <= 0:
+        raise ValueError(f"bucket must look like 30s, 1m, 1h or 1d, got '{value}'")
+    return int(value[:-1]) * unit
+
+def get_aggregated_readings(bucket_seconds: int, sensor_id: str | None = None, sensor_type: str | None = None,
+                            start: datetime | None = None, end: datetime | None = None) -> list[dict]:
+    """
+    Downsamples readings into fixed time buckets, computed entirely in SQL.
+
+    Buckets are aligned to the Unix epoch (e.g. 1h buckets start on the hour, UTC)
+    and computed separately for every (sensor_id, type) pair. When the bucket and
+    range line up with a rollup level (1m/1h/1d), the coarsest such rollup table is
+    read instead of the raw readings.
+
+    Args:
+        bucket_seconds: Bucket width in seconds (see parse_bucket()).
+        sensor_id: Filter by sensor ID if provided.
+        sensor_type: Filter by sensor type if provided.
+        start: Only readings at or after this time (inclusive).
+        end: Only readings before this time (exclusive).
+
+    Returns:
+        A list of dictionaries ordered by sensor_id, type and bucket, each with
+        bucket (ISO start time), sensor_id, type, count, min, max, avg, first and last.
+    """
+    try:
+        with db_pool.pool.connection() as conn:
+            level = rollups.choose_level(bucket_seconds, start, end) if config.ROLLUPS_ENABLED else None
+            if level and rollups.is_complete(conn):
+                built = rollups.build_aggregate_query(level[0], bucket_seconds, sensor_id, sensor_type, start, end)
+            else:
+                built = _build_aggregate_query(conn, bucket_seconds, sensor_id, sensor_type, start, end)
+            if built is None:
+                return []
+            query, params = built
+            rows = conn.execute(query, params).fetchall()
+        return [_aggregate_row_to_dict(row) for row in rows]
+
+    except sqlite3.Error as e:
+        logging.error(f"Database error aggregating readings: {e}")
+        return []
+
+def _aggregate_row_to_dict(row: tuple) -> dict:
+    """Converts a (bucket_epoch, sensor_id, type, count, min, max, avg, first, last) row to a dictionary."""
+    bucket, sensor_id, sensor_type, count, minimum, maximum, average, first, last = row
+    return {
+        "bucket": datetime.fromtimestamp(bucket, tz=timezone.utc).isoformat(),
+        "sensor_id": sensor_id,
+        "type": sensor_type,
+        "count": count,
+        "min": minimum,
+        "max": maximum,
+        "avg": average,
+        "first": first,
+        "last": last,
+    }
+
+def _build_aggregate_query(conn, bucket_seconds: int, sensor_id: str | None, sensor_type: str | None,
+                           start: datetime | None, end: datetime | None) -> tuple[str, list] | None:
+    """
+    Builds the GROUP BY query for get_aggregated_readings() against the raw readings.
+
+    Returns:
+        (query, params), or None if the filters can't match anything.
+    """
+    params = []
+    conditions = []
+    if not use_compact_schema():
+        # series = columns identifying one series; order = tie-breaker for first/last
+        series, order = "sensor_id, type", "timestamp, rowid"
+        epoch = _LEGACY_EPOCH_SECONDS_SQL
+        source = "sensor_readings"
+        if sensor_id:
+            conditions.append("sensor_id = ?")
+            params.append(sensor_id)
+        if sensor_type:
+            conditions.append("type = ?")
+            params.append(sensor_type)
+        if start:
+            conditions.append("timestamp >= ?")
+            params.append(_legacy_ts(start))
+        if end:
+            conditions.append("timestamp < ?")
+            params.append(_legacy_ts(end))
+    else:
+        series, order = "sensor_key, type_key", "ts"
+        epoch = "(ts / 1000000)"
+        source = "compact_readings"
+        if sensor_id:
+            sensor_key = compact_schema.keys.lookup(conn, "sensors", sensor_id)
+            if sensor_key is None:
+                return None
+            conditions.append("sensor_key = ?")
+            params.append(sensor_key)
+        if sensor_type:
+            type_key = compact_schema.keys.lookup(conn, "types", sensor_type)
+            if type_key is None:
+                return None
+            conditions.append("type_key = ?")
+            params.append(type_key)
+        if start:
+            conditions.append("ts >= ?")
+            params.append(compact_schema.to_epoch_us(start))
+        if end:
+            conditions.append("ts < ?")
+            params.append(compact_schema.to_epoch_us(end))
+
+    where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+    # The window functions pick the first/last value of each bucket; the outer
+    # GROUP BY collapses every bucket to one row.
+    aggregate = (
+        f"SELECT bucket, {series}, COUNT(*) AS n, MIN(value) AS lo, MAX(value) AS hi, AVG(value) AS mean, "
+        f"MAX(fv) AS fv, MAX(lv) AS lv "
+        f"FROM (SELECT {series}, bucket, value, "
+        f"FIRST_VALUE(value) OVER w AS fv, LAST_VALUE(value) OVER w AS lv "
+        f"FROM (SELECT {series}, value, {order}, ({epoch} / ?) * ? AS bucket FROM {source}{where}) "
+        f"WINDOW w AS (PARTITION BY {series}, bucket ORDER BY {order} "
+        f"ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)) "
+        f"GROUP BY {series}, bucket"
+    )
+    params = [bucket_seconds, bucket_seconds] + params
+    if not use_compact_schema():
+        return aggregate + " ORDER BY sensor_id, type, bucket", params
+    # Names are joined onto the (few) aggregated rows, not onto every reading
+    query = (f"SELECT a.bucket, s.sensor_id, t.type, a.n, a.lo, a.hi, a.mean, a.fv, a.lv "
+             f"FROM ({aggregate}) a "
+             f"JOIN sensors s ON s.sensor_key = a.sensor_key JOIN types t ON t.type_key = a.type_key "
+             f"ORDER BY s.sensor_id, t.type, a.bucket")
+    return query, params
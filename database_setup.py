@@ -2,6 +2,11 @@
 import sqlite3
 import logging
 import config # Get DB name from config
+import db_pool # Applies journal mode and other pragmas from config
+import compact_schema # Optional integer-keyed schema (config.DB_SCHEMA = 'compact')
+import rollups # 1m/1h/1d rollup tables
+import latest_readings # Newest value per sensor
+import change_feed # Recently stored readings for /readings/stream
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -10,33 +15,47 @@ def setup():
     conn = None
     try:
         logging.info(f"Initializing database: {config.DATABASE_NAME}")
-        conn = sqlite3.connect(config.DATABASE_NAME)
+        # Also switches the file to config.DB_JOURNAL_MODE (WAL by default), which persists
+        conn = db_pool.open_connection(config.DATABASE_NAME)
         cursor = conn.cursor()
 
         # Drop table if it exists (optional, for clean setup during dev)
         # cursor.execute("DROP TABLE IF EXISTS sensor_readings")
         # logging.info("Dropped existing sensor_readings table (if any).")
 
-        # Create sensor_readings table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sensor_readings (
-                timestamp TEXT NOT NULL,
-                sensor_id TEXT NOT NULL,
-                type TEXT NOT NULL,
-                value REAL NOT NULL,
-                PRIMARY KEY (timestamp, sensor_id, type)
-            )
-        ''')
-        logging.info("Created sensor_readings table (if it didn't exist).")
-
-        # Create indexes for faster queries
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_sensor_time ON sensor_readings (sensor_id, timestamp DESC);
-        ''')
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_type_time ON sensor_readings (type, timestamp DESC);
-        ''')
-        logging.info("Created indexes (if they didn't exist).")
+        if config.DB_SCHEMA == "compact":
+            compact_schema.create_schema(cursor)
+            logging.info("Created compact schema tables and indexes (if they didn't exist).")
+        else:
+            # Create sensor_readings table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sensor_readings (
+                    timestamp TEXT NOT NULL,
+                    sensor_id TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    PRIMARY KEY (timestamp, sensor_id, type)
+                )
+            ''')
+            logging.info("Created sensor_readings table (if it didn't exist).")
+
+            # Create indexes for faster queries
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_sensor_time ON sensor_readings (sensor_id, timestamp DESC);
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_type_time ON sensor_readings (type, timestamp DESC);
+            ''')
+            logging.info("Created indexes (if they didn't exist).")
+
+        if config.ROLLUPS_ENABLED:
+            rollups.create_schema(cursor)
+            logging.info("Created rollup tables (if they didn't exist).")
+        latest_readings.create_schema(cursor)
+        logging.info("Created latest_readings table (if it didn't exist).")
+        if config.CHANGE_FEED_ENABLED:
+            change_feed.create_schema(cursor)
+            logging.info("Created readings_feed table (if it didn't exist).")
 
         conn.commit()
         logging.info("Database setup complete.")
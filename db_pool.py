@@ -0,0 +1,210 @@
+# db_pool.py
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+import config
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def open_connection(database: str = None, read_only: bool = None) -> sqlite3.Connection:
+    """
+    Opens a new SQLite connection with the tuning pragmas from config.py applied.
+
+    Args:
+        database: Path of the database file. Defaults to config.DATABASE_NAME.
+        read_only: Open the file read-only (it must exist); writes then fail with
+                   sqlite3.OperationalError. Defaults to config.DB_READ_ONLY.
+
+    Returns:
+        sqlite3.Connection: A connection that may be shared between threads
+                            (one thread at a time).
+    """
+    database = database or config.DATABASE_NAME
+    read_only = config.DB_READ_ONLY if read_only is None else read_only
+    conn = sqlite3.connect(f"file:{pathname2url(database)}?mode=ro" if read_only else database,
+                           timeout=config.DB_BUSY_TIMEOUT,
+                           detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                           check_same_thread=False,
+                           uri=read_only)
+    try:
+        if not read_only:
+            # auto_vacuum only takes effect on a database without tables (new files); after
+            # that SQLite keeps the mode stored in the file and ignores this
+            conn.execute(f"PRAGMA auto_vacuum={config.DB_AUTO_VACUUM}")
+            # journal_mode is stored in the database file (a reader uses whatever the writer set);
+            # the others are per connection
+            conn.execute(f"PRAGMA journal_mode={config.DB_JOURNAL_MODE}")
+            conn.execute(f"PRAGMA synchronous={config.DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size={-int(config.DB_CACHE_SIZE_KIB)}") # Negative = KiB instead of pages
+        conn.execute(f"PRAGMA mmap_size={int(config.DB_MMAP_SIZE)}")
+        conn.execute(f"PRAGMA busy_timeout={int(config.DB_BUSY_TIMEOUT * 1000)}")
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+
+class ConnectionPool:
+    """
+    Keeps idle SQLite connections around so they can be reused instead of
+    reopened (and re-tuned) for every reading or API request.
+
+    Connections are kept per database path, so changing config.DATABASE_NAME
+    (e.g. in tests) never hands out a connection to the wrong file.
+    """
+    def __init__(self, max_idle: int = None):
+        """
+        Initializes a ConnectionPool instance.
+
+        Args:
+            max_idle: Max idle connections kept per database. Defaults to config.DB_POOL_SIZE.
+        """
+        self.max_idle = config.DB_POOL_SIZE if max_idle is None else max_idle
+        self._lock = threading.Lock()
+        self._idle = {} # database path -> list of idle connections
+        self._paths = {} # id(connection) -> database path (for connections handed out)
+        self._local = threading.local() # .pinned: database path -> (connection, generation) of this thread
+        self._pinned = [] # (thread, connection) of every pinned connection
+        self._generation = 0 # Bumped by close_all(); older pinned connections are reopened
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def pin_thread(self):
+        """
+        Makes the calling thread keep its connections: acquire() hands it the same connection
+        every time (one per database) and release() keeps it with the thread instead of
+        returning it to the pool. Meant for long-lived worker threads (async_queries.py).
+        """
+        if getattr(self._local, "pinned", None) is None:
+            self._local.pinned = {}
+
+    def acquire(self) -> sqlite3.Connection:
+        """Returns an idle connection to config.DATABASE_NAME, opening one if needed."""
+        database = config.DATABASE_NAME
+        pinned = getattr(self._local, "pinned", None)
+        if pinned is not None and database in pinned:
+            conn, generation = pinned[database]
+            if generation == self._generation:
+                with self._lock:
+                    self.hits += 1
+                    self._paths[id(conn)] = database
+                return conn
+            # Opened before close_all() (the file may have been replaced since)
+            del pinned[database]
+            self._unpin(conn)
+            conn.close()
+        with self._lock:
+            idle = self._idle.get(database)
+            conn = idle.pop() if idle else None
+            if conn is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if conn is None:
+            conn = open_connection(database)
+        with self._lock:
+            self._paths[id(conn)] = database
+            if pinned is not None:
+                pinned[database] = (conn, self._generation)
+                self._pinned.append((threading.current_thread(), conn))
+        return conn
+
+    def _unpin(self, conn: sqlite3.Connection):
+        with self._lock:
+            self._pinned = [(thread, c) for thread, c in self._pinned if c is not conn]
+
+    def release(self, conn: sqlite3.Connection, discard: bool = False):
+        """
+        Returns a connection to the pool.
+
+        Args:
+            conn: A connection obtained from acquire().
+            discard: Close the connection instead of keeping it (e.g. after an error).
+        """
+        with self._lock:
+            database = self._paths.pop(id(conn), None)
+        pinned = getattr(self._local, "pinned", None)
+        if pinned is not None and database is not None and pinned.get(database, (None,))[0] is conn:
+            if not discard:
+                try:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    conn.row_factory = None
+                    return # Stays with this thread
+                except sqlite3.Error:
+                    pass
+            del pinned[database]
+            self._unpin(conn)
+            database = None # Closed below
+        if not discard and database is not None:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.row_factory = None
+            except sqlite3.Error:
+                discard = True
+        if not discard and database is not None:
+            with self._lock:
+                idle = self._idle.setdefault(database, [])
+                if len(idle) < self.max_idle:
+                    idle.append(conn)
+                    return
+        with self._lock:
+            self.discarded += 1
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that lends out a pooled connection.
+        Uncommitted work is rolled back when the block exits.
+        """
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except sqlite3.DatabaseError as e:
+            # Errors other than constraint/lock problems may leave the connection unusable
+            broken = not isinstance(e, (sqlite3.IntegrityError, sqlite3.OperationalError))
+            raise
+        finally:
+            self.release(conn, discard=broken)
+
+    def close_all(self):
+        """
+        Closes every idle connection (connections currently lent out are unaffected).
+        Threads that pinned connections reopen them on their next acquire().
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            self._generation += 1
+            # Pinned connections of threads that have exited can go now; live threads close theirs
+            dead = [conn for thread, conn in self._pinned if not thread.is_alive()]
+            self._pinned = [(thread, conn) for thread, conn in self._pinned if thread.is_alive()]
+        for connections in [*idle.values(), dead]:
+            for conn in connections:
+                conn.close()
+
+    def stats(self) -> dict:
+        """Returns pool usage counters."""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests, 4) if requests else None,
+                "idle": sum(len(c) for c in self._idle.values()),
+                "in_use": len(self._paths),
+                "discarded": self.discarded,
+                "pinned": len(self._pinned),
+                "max_idle": self.max_idle,
+            }
+
+
+# Shared pool used by data_processor
+pool = ConnectionPool()
@@ -0,0 +1,35 @@
+#!/bin/sh
+# docker-entrypoint.sh
+#
+# Runs the serial logger and the API server (wsgi.py) side by side in one container.
+# docker stop only signals PID 1 (this script), so TERM/INT are forwarded to both, and the
+# script waits until both have shut down: the logger stores its buffered readings on SIGTERM.
+# If either one exits on its own (e.g. the logger on a serial error), the other is stopped
+# too and the container exits non-zero, so its restart policy brings both back.
+
+python serial_data_logger.py &
+logger=$!
+python wsgi.py &
+api=$!
+
+status=1
+stop() {
+    kill -TERM "$logger" "$api" 2>/dev/null
+}
+on_signal() {
+    status=0
+    stop
+}
+trap on_signal TERM INT
+
+# Until one of them is gone (sleep in the background so a signal interrupts the wait)
+while kill -0 "$logger" 2>/dev/null && kill -0 "$api" 2>/dev/null; do
+    sleep 1 &
+    wait $!
+done
+stop
+while kill -0 "$logger" 2>/dev/null || kill -0 "$api" 2>/dev/null; do
+    sleep 0.2 &
+    wait $!
+done
+exit $status
@@ -0,0 +1,196 @@
+# fast_parser.py
+#
+# Serial line parser compiled once from ARDUINO_DATA_ORDER / ARDUINO_DATA_SEPARATOR.
+#
+# Accepts the same lines as data_processor.parse_serial_data(), but the field positions
+# are worked out once instead of zipping every line into a dict, lines can be parsed as
+# bytes straight from the serial port (only the ID and type fields are decoded, and those
+# strings are cached), and parse_batch() turns many lines into columnar arrays at once.
+# Compare the two with: python bench_parser.py
+import logging
+import sys
+from datetime import datetime, timezone
+
+import config
+import compact_schema
+import binary_protocol
+import clock_sync
+from models import ParsedBatch, SensorReading
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Decoded ID/type strings kept per parser; new names beyond this are decoded every time
+_MAX_CACHED_NAMES = 4096
+
+
+class LineParser:
+    """Parser for one ARDUINO_DATA_ORDER / ARDUINO_DATA_SEPARATOR combination."""
+    def __init__(self, order: list[str] = None, separator: str = None):
+        """
+        Initializes a LineParser instance.
+
+        Args:
+            order: Field names as sent by the Arduino. Defaults to config.ARDUINO_DATA_ORDER.
+            separator: Field delimiter. Defaults to config.ARDUINO_DATA_SEPARATOR.
+
+        Raises:
+            ValueError: If order lacks SensorID, SensorType or Value.
+        """
+        order = list(config.ARDUINO_DATA_ORDER if order is None else order)
+        self.separator = config.ARDUINO_DATA_SEPARATOR if separator is None else separator
+        self._separator_bytes = self.separator.encode("utf-8")
+        missing = [name for name in ("SensorID", "SensorType", "Value") if name not in order]
+        if missing:
+            raise ValueError(f"ARDUINO_DATA_ORDER is missing {', '.join(missing)}")
+        self.field_count = len(order)
+        # Like dict(zip(order, parts)), a repeated name refers to its last position
+        self.id_index = len(order) - 1 - order[::-1].index("SensorID")
+        self.type_index = len(order) - 1 - order[::-1].index("SensorType")
+        self.value_index = len(order) - 1 - order[::-1].index("Value")
+        # Optional device clock fields; with DeviceTime the reading time comes from the device
+        self.device_time_index = len(order) - 1 - order[::-1].index("DeviceTime") if "DeviceTime" in order else None
+        self.seq_index = len(order) - 1 - order[::-1].index("Seq") if "Seq" in order else None
+        self.aligner = clock_sync.TimestampAligner() if self.device_time_index is not None else None
+        self._names = {} # raw bytes -> interned str
+
+    def _name(self, raw: bytes) -> str:
+        name = self._names.get(raw)
+        if name is None:
+            # Same lenient decoding as the serial reader
+            name = sys.intern(raw.decode("utf-8", errors="ignore"))
+            if len(self._names) < _MAX_CACHED_NAMES:
+                self._names[raw] = name
+        return name
+
+    def parse_fields(self, line) -> tuple | None:
+        """
+        Splits one line (bytes or str) into (sensor_id, sensor_type, value), followed by
+        (device_ms, seq) when the order has a DeviceTime field.
+
+        Returns:
+            The fields, or None if the line is malformed (wrong field count, empty
+            ID/type, or a value/device time/sequence number that isn't a number).
+        """
+        if isinstance(line, str):
+            parts = line.strip().split(self.separator)
+            if len(parts) != self.field_count:
+                return None
+            sensor_id, sensor_type = parts[self.id_index], parts[self.type_index]
+        else:
+            parts = line.strip().split(self._separator_bytes)
+            if len(parts) != self.field_count:
+                return None
+            sensor_id, sensor_type = self._name(parts[self.id_index]), self._name(parts[self.type_index])
+        if not sensor_id or not sensor_type:
+            return None
+        raw_value = parts[self.value_index]
+        try:
+            value = float(raw_value) # float() accepts bytes directly
+        except ValueError:
+            if isinstance(raw_value, str):
+                return None
+            try:
+                # Undecodable bytes are ignored, as parse_serial_data's decoding did
+                value = float(raw_value.decode("utf-8", errors="ignore"))
+            except ValueError:
+                return None
+        if self.aligner is None:
+            return sensor_id, sensor_type, value
+        try:
+            # int() accepts bytes too
+            device_ms = int(parts[self.device_time_index])
+            seq = int(parts[self.seq_index]) if self.seq_index is not None else None
+        except ValueError:
+            return None
+        return sensor_id, sensor_type, value, device_ms, seq
+
+    def parse(self, line, timestamp: datetime | None = None) -> SensorReading | None:
+        """
+        Drop-in for data_processor.parse_serial_data(), also accepting bytes.
+
+        Args:
+            line: A raw line (bytes or str).
+            timestamp: When the line was received. Defaults to now (UTC).
+
+        Returns:
+            A SensorReading object if parsing is successful, None otherwise.
+        """
+        fields = self.parse_fields(line)
+        if fields is None:
+            logging.warning(f"Malformed data line: {line!r}")
+            return None
+        timestamp = timestamp or datetime.now(timezone.utc)
+        if len(fields) > 3:
+            timestamp = compact_schema.from_epoch_us(
+                self.aligner.timestamp_us(fields[0], fields[3], compact_schema.to_epoch_us(timestamp), fields[4]))
+        # parse_fields() already checked what SensorReading.__init__ would
+        return SensorReading.trusted(fields[0], fields[1], fields[2], timestamp)
+
+    def parse_batch(self, lines, timestamps=None) -> ParsedBatch:
+        """
+        Parses many lines into columnar arrays without building per-line objects.
+
+        Args:
+            lines: Iterable of raw lines (bytes or str).
+            timestamps: Epoch microseconds per line (same length as lines), or None to
+                        stamp every line with the current time. With DeviceTime these are
+                        the receive times the device clock is aligned to.
+
+        Returns:
+            ParsedBatch: Accepted lines as a ReadingBatch; .rejected counts the others.
+        """
+        batch = ParsedBatch()
+        now = compact_schema.to_epoch_us(datetime.now(timezone.utc)) if timestamps is None else None
+        # The common case (well-formed bytes, known names) is inlined; anything else
+        # goes through parse_fields()
+        separator, field_count = self._separator_bytes, self.field_count
+        id_index, type_index, value_index = self.id_index, self.type_index, self.value_index
+        names, parse_fields = self._names, self.parse_fields
+        append_ts, append_value = batch.timestamps.append, batch.values.append
+        append_sensor, append_type = batch.sensor_codes.append, batch.type_codes.append
+        sensor_code, type_code = batch.sensor_code, batch.type_code
+        aligner = self.aligner
+        for i, line in enumerate(lines):
+            fields = None
+            if aligner is None and isinstance(line, bytes):
+                parts = line.strip().split(separator)
+                if len(parts) == field_count:
+                    sensor_id, sensor_type = names.get(parts[id_index]), names.get(parts[type_index])
+                    if sensor_id and sensor_type:
+                        try:
+                            fields = (sensor_id, sensor_type, float(parts[value_index]))
+                        except ValueError:
+                            pass
+            if fields is None:
+                fields = parse_fields(line)
+                if fields is None:
+                    batch.rejected += 1
+                    continue
+            append_sensor(sensor_code(fields[0]))
+            append_type(type_code(fields[1]))
+            append_value(fields[2])
+            ts = now if timestamps is None else timestamps[i]
+            append_ts(ts if aligner is None else aligner.timestamp_us(fields[0], fields[3], ts, fields[4]))
+        if batch.rejected:
+            logging.warning(f"Skipped {batch.rejected} malformed lines in a batch of {len(batch) + batch.rejected}.")
+        return batch
+
+
+_parsers = {}
+
+def get_parser():
+    """
+    Returns the parser for the current config (compiled on first use, and again if the config
+    changes): a LineParser, or a binary_protocol.FrameParser with SERIAL_PROTOCOL = 'binary'.
+    """
+    if config.SERIAL_PROTOCOL == "binary":
+        key = ("binary", tuple(config.BINARY_SENSOR_IDS), tuple(config.BINARY_SENSOR_TYPES))
+        parser = _parsers.get(key)
+        if parser is None:
+            parser = _parsers[key] = binary_protocol.FrameParser(list(key[1]), list(key[2]))
+        return parser
+    key = (tuple(config.ARDUINO_DATA_ORDER), config.ARDUINO_DATA_SEPARATOR)
+    parser = _parsers.get(key)
+    if parser is None:
+        parser = _parsers[key] = LineParser(list(key[0]), key[1])
+    return parser
@@ -0,0 +1,237 @@
+# ingest_engine.py
+#
+# Asyncio serial ingest for one or more Arduinos (config.SERIAL_PORTS).
+#
+# Every port gets its own coroutine that reads without blocking (the port's file descriptor
+# is watched by the event loop), splits the byte stream into lines, parses them and hands
+# the readings to one shared sink - the logger's BatchWriter queue. A port that can't be
+# opened or drops out is retried with its own exponential backoff, so one unplugged
+# Arduino never stalls the others.
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+import serial
+
+import config
+import binary_protocol
+import fast_parser
+import serial_reader
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+class PortReader:
+    """Reads, parses and forwards the lines of one serial port, reconnecting as needed."""
+    def __init__(self, port: str, sink: Callable, baud_rate: int = None, parse: bool = True):
+        """
+        Initializes a PortReader instance.
+
+        Args:
+            port: Serial device, e.g. /dev/ttyACM0 or COM3.
+            sink: Called with every parsed SensorReading. Should not block: while it
+                  does, no port on this event loop is read.
+            baud_rate: Defaults to config.SERIAL_BAUD_RATE.
+            parse: False hands each raw line to sink as (received_at, port, line_bytes)
+                   instead, leaving decoding and parsing to a later pipeline stage.
+        """
+        self.port = port
+        self.sink = sink
+        self.baud_rate = baud_rate or config.SERIAL_BAUD_RATE
+        self.parse = parse
+        self._parser = fast_parser.get_parser()
+        # Binary frames (config.SERIAL_PROTOCOL) are cut out by a decoder instead of split at newlines
+        self._decoder = binary_protocol.FrameDecoder() if config.SERIAL_PROTOCOL == "binary" else None
+        self._last_received = None # Receive times are kept strictly increasing per port
+        self.connected = False
+        self.connects = 0
+        self.errors = 0
+        self.lines = 0
+        self.readings = 0
+        self.rejected = 0 # Lines the parser couldn't parse
+
+    def stats(self) -> dict:
+        """Returns this port's counters (with crc_errors/skipped_bytes in binary mode)."""
+        stats = {"port": self.port, "connected": self.connected, "connects": self.connects, "errors": self.errors,
+                 "lines": self.lines, "readings": self.readings, "rejected": self.rejected}
+        if self._decoder:
+            stats.update(crc_errors=self._decoder.crc_errors, skipped_bytes=self._decoder.skipped_bytes)
+        return stats
+
+    async def run(self):
+        """Connects and reads until cancelled."""
+        delay = config.SERIAL_RETRY_DELAY
+        while True:
+            try:
+                # timeout=0: read() returns whatever is buffered instead of waiting
+                ser = serial.Serial(self.port, self.baud_rate, timeout=0)
+            except (serial.SerialException, OSError, ValueError) as e:
+                self.errors += 1
+                logging.warning(f"[{self.port}] Connection failed: {e}. Retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, config.SERIAL_RETRY_MAX_DELAY)
+                continue
+
+            self.connected = True
+            self.connects += 1
+            lines_before = self.lines
+            logging.info(f"[{self.port}] Successfully connected.")
+            try:
+                await self._read_lines(ser)
+            except (serial.SerialException, OSError) as e:
+                self.errors += 1
+                logging.error(f"[{self.port}] Serial communication error: {e}")
+            finally:
+                self.connected = False
+                ser.close()
+
+            # Only a connection that delivered data resets the backoff; a port that
+            # opens and fails straight away keeps backing off
+            if self.lines > lines_before:
+                delay = config.SERIAL_RETRY_DELAY
+            logging.info(f"[{self.port}] Attempting reconnection in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, config.SERIAL_RETRY_MAX_DELAY)
+
+    async def _read_lines(self, ser: serial.Serial):
+        """Reads from an open port until it fails (raises) or the task is cancelled."""
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        fd = None
+        try:
+            fd = ser.fileno()
+            loop.add_reader(fd, readable.set)
+        except (AttributeError, NotImplementedError, ValueError):
+            # No selectable descriptor (e.g. Windows): poll the driver's buffer instead
+            fd = None
+
+        line_reader = serial_reader.BufferedLineReader()
+        try:
+            while True:
+                if fd is not None:
+                    await readable.wait()
+                    readable.clear()
+                else:
+                    await asyncio.sleep(config.SERIAL_POLL_INTERVAL)
+                # With a readable descriptor but nothing waiting, pyserial raises
+                # SerialException (device disconnected), which ends the connection.
+                # timeout=0, so asking for more than is waiting never blocks.
+                data = ser.read(ser.in_waiting or config.SERIAL_READ_SIZE)
+                if data and self._decoder:
+                    self._handle_frames(data)
+                elif data:
+                    self._handle_data(line_reader, data)
+        finally:
+            if fd is not None:
+                loop.remove_reader(fd)
+
+    def _handle_data(self, line_reader: serial_reader.BufferedLineReader, data: bytes):
+        """Handles every line completed by data (a partial last line waits for the next read)."""
+        discarded = line_reader.discarded
+        for line in line_reader.feed(data):
+            self._handle_line(bytes(line)) # One copy per line; the slice is reused on the next read
+        if line_reader.discarded > discarded:
+            # No newline for far too long: noise or wrong baud rate
+            logging.warning(f"[{self.port}] Discarding {line_reader.discarded - discarded} bytes without a line ending.")
+
+    def _handle_frames(self, data: bytes):
+        """Decodes binary frames; each valid frame is handled like a line."""
+        crc_errors = self._decoder.crc_errors
+        for frame in self._decoder.feed(data):
+            self._handle_line(frame, strip=False)
+        if self._decoder.crc_errors > crc_errors:
+            logging.warning(f"[{self.port}] {self._decoder.crc_errors - crc_errors} frame(s) failed the CRC check "
+                            f"({self._decoder.crc_errors} so far).")
+
+    def _received_at(self) -> datetime:
+        """
+        The receive time of a line. Lines drained in one burst can read the same clock value;
+        each gets at least 1 microsecond more than the previous one, so readings of the same
+        sensor never collide on the (timestamp, sensor_id, type) primary key.
+        """
+        now = datetime.now(timezone.utc)
+        if self._last_received is not None and now <= self._last_received:
+            now = self._last_received + _ONE_MICROSECOND
+        self._last_received = now
+        return now
+
+    def _handle_line(self, line_bytes: bytes, strip: bool = True):
+        if strip:
+            line_bytes = line_bytes.strip()
+        if not line_bytes:
+            return
+        if not self.parse:
+            self.lines += 1
+            self.sink((self._received_at(), self.port, line_bytes))
+            return
+        self.lines += 1
+        logging.debug(f"[{self.port}] Received raw data: {line_bytes!r}")
+        # Parsed as bytes; undecodable bytes are ignored, same as before
+        sensor_reading = self._parser.parse(line_bytes, timestamp=self._received_at())
+        if sensor_reading:
+            self.readings += 1
+            self.sink(sensor_reading)
+        else:
+            self.rejected += 1 # The parser logged why
+
+
+class IngestEngine:
+    """Runs one PortReader per configured serial port on a single event loop."""
+    def __init__(self, sink: Callable, ports: list[str] = None, baud_rate: int = None, parse: bool = True):
+        """
+        Initializes an IngestEngine instance.
+
+        Args:
+            sink: Called with every parsed SensorReading from any port (e.g. BatchWriter.submit).
+            ports: Serial devices to read. Defaults to config.SERIAL_PORTS.
+            baud_rate: Defaults to config.SERIAL_BAUD_RATE.
+            parse: False passes raw lines to sink instead (see PortReader).
+        """
+        ports = config.SERIAL_PORTS if ports is None else ports
+        self.readers = [PortReader(port, sink, baud_rate, parse) for port in ports]
+        self._loop = None
+        self._stop = None
+        self._stop_requested = False
+        self._thread = None
+
+    async def run(self):
+        """Reads every port until request_stop() is called."""
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        if self._stop_requested:
+            return
+        logging.info(f"Ingest engine reading {len(self.readers)} port(s): {', '.join(r.port for r in self.readers)}")
+        tasks = [asyncio.create_task(reader.run(), name=f"serial {reader.port}") for reader in self.readers]
+        try:
+            await self._stop.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logging.info("Ingest engine stopped; serial ports closed.")
+
+    def request_stop(self):
+        """Makes run() return. Safe to call from other threads and from signal handlers."""
+        self._stop_requested = True
+        loop = self._loop
+        if loop is not None and self._stop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._stop.set)
+
+    def start(self):
+        """Runs the engine on its own event loop in a background thread."""
+        self._thread = threading.Thread(target=asyncio.run, args=(self.run(),), name="IngestEngine", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stops an engine started with start() and waits for its thread."""
+        self.request_stop()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def stats(self) -> list[dict]:
+        """Returns the counters of every port."""
+        return [reader.stats() for reader in self.readers]
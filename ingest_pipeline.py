@@ -0,0 +1,351 @@
+# ingest_pipeline.py
+#
+# Serial ingest split into three stages connected by bounded queues:
+#
+#   reader thread (ingest_engine, every port)  --line queue-->
+#   parse stage thread (fast_parser)           --reading queue-->
+#   writer stage thread (batch_writer)         --> SQLite
+#
+# A slow commit or fsync now only backs up the reading queue; the reader keeps draining
+# the serial ports. What happens when a queue is full is set by INGEST_OVERFLOW_POLICY:
+#   block       - the producer waits (the reader stops reading, so the serial buffers fill)
+#   drop_oldest - the oldest queued item is discarded to make room (counted as dropped)
+#   spill       - overflow is appended to a file under INGEST_SPILL_DIR and fed back in
+#                 order once the queue has room again; nothing is lost while the process runs
+#                 (the spill is not kept across restarts)
+# With INGEST_SPOOL_ENABLED the queues are replaced by the crash-safe on-disk spool (spool.py).
+# With a pubsub.Hub, readings are also published to live subscribers as they are parsed
+# (by the parse stage, or by the spool replayer), before the database write.
+import logging
+import os
+import pickle
+import queue
+import struct
+import threading
+import time
+from collections import deque
+
+import config
+import batch_writer
+import fast_parser
+import ingest_engine
+import spool
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "spill")
+
+# Sentinel that tells a stage to finish
+_STOP = object()
+
+_SPILL_RECORD = struct.Struct(">I") # Length prefix of each pickled item in a spill file
+
+
+class PipelineQueue:
+    """
+    Bounded FIFO between two pipeline stages with a configurable overflow policy.
+
+    Offers the queue.Queue methods the stages use (put, get, get_nowait, qsize), so it
+    can replace BatchWriter's unbounded queue. Control items put with put_control() skip
+    the size limit and the overflow policy.
+    """
+    def __init__(self, name: str, maxsize: int, policy: str = None, spill_dir: str = None):
+        """
+        Initializes a PipelineQueue instance.
+
+        Args:
+            name: Queue name, used in stats and for the spill file name.
+            maxsize: Items held in memory.
+            policy: One of OVERFLOW_POLICIES. Defaults to config.INGEST_OVERFLOW_POLICY.
+            spill_dir: Directory of the spill file. Defaults to config.INGEST_SPILL_DIR.
+
+        Raises:
+            ValueError: If policy is unknown.
+        """
+        self.name = name
+        self.maxsize = max(1, maxsize)
+        self.policy = policy or config.INGEST_OVERFLOW_POLICY
+        if self.policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{self.policy}' (expected one of {', '.join(OVERFLOW_POLICIES)})")
+        self._items = deque()
+        self._control = deque() # Items from put_control(), delivered once _items is empty
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        # Counters
+        self.put_count = 0
+        self.get_count = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.blocked_seconds = 0.0
+
+        # Spill file: items are appended at the end and read back in order by a second handle
+        self._spill_path = None
+        self._spill_pending = 0
+        self._spill_writer = None
+        self._spill_reader = None
+        if self.policy == "spill":
+            spill_dir = spill_dir or config.INGEST_SPILL_DIR
+            os.makedirs(spill_dir, exist_ok=True)
+            self._spill_path = os.path.join(spill_dir, f"{name}.spill")
+            self._open_spill()
+
+    # --- Spill file ---
+
+    def _open_spill(self):
+        """
+        Opens an empty spill file. The spill only extends the queue's memory; a file left
+        by a previous run is discarded, since part of it may already have been processed.
+        """
+        self._spill_writer = open(self._spill_path, "wb")
+        self._spill_reader = open(self._spill_path, "rb")
+
+    def _spill(self, item):
+        payload = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        self._spill_writer.write(_SPILL_RECORD.pack(len(payload)) + payload)
+        self._spill_writer.flush()
+        self._spill_pending += 1
+        self.spilled += 1
+
+    def _unspill(self):
+        """Moves spilled items back into memory while there is room (called with the lock held)."""
+        while self._spill_pending and len(self._items) < self.maxsize:
+            (length,) = _SPILL_RECORD.unpack(self._spill_reader.read(_SPILL_RECORD.size))
+            self._items.append(pickle.loads(self._spill_reader.read(length)))
+            self._spill_pending -= 1
+        if not self._spill_pending and self._spill_writer.tell():
+            # Everything was read back: start the file over
+            self._spill_writer.truncate(0)
+            self._spill_writer.seek(0)
+            self._spill_reader.seek(0)
+
+    # --- Queue interface ---
+
+    def put(self, item) -> bool:
+        """
+        Adds an item, applying the overflow policy if the queue is full.
+
+        Returns:
+            bool: False if an item had to be dropped to make room.
+        """
+        with self._lock:
+            self.put_count += 1
+            if self.policy == "spill":
+                # Once anything is spilled, newer items queue up behind it to keep FIFO order
+                if self._spill_pending or len(self._items) >= self.maxsize:
+                    self._spill(item)
+                    self._unspill()
+                else:
+                    self._items.append(item)
+                self._not_empty.notify()
+                return True
+            if len(self._items) >= self.maxsize:
+                if self.policy == "drop_oldest":
+                    self._items.popleft()
+                    self.dropped += 1
+                    self._items.append(item)
+                    self._not_empty.notify()
+                    return False
+                started = time.monotonic()
+                while len(self._items) >= self.maxsize:
+                    self._not_full.wait()
+                self.blocked_seconds += time.monotonic() - started
+            self._items.append(item)
+            self._not_empty.notify()
+            return True
+
+    def put_control(self, item):
+        """
+        Adds an item regardless of size limit and policy (e.g. a stop sentinel).
+        It is delivered after everything already queued, spilled items included.
+        """
+        with self._lock:
+            self._control.append(item)
+            self._not_empty.notify()
+
+    def get(self, block: bool = True, timeout: float = None):
+        """Removes and returns the oldest item. Raises queue.Empty like queue.Queue.get()."""
+        with self._lock:
+            if block:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while not self._items and not self._control:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise queue.Empty
+                    self._not_empty.wait(remaining)
+            elif not self._items and not self._control:
+                raise queue.Empty
+            if not self._items:
+                # Spilled items are moved into memory whenever there is room, so an
+                # empty deque means the spill file is empty too
+                return self._control.popleft()
+            item = self._items.popleft()
+            self.get_count += 1
+            if self._spill_pending:
+                self._unspill()
+            self._not_full.notify()
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self) -> int:
+        """Items waiting, in memory and spilled."""
+        with self._lock:
+            return len(self._items) + self._spill_pending
+
+    def close(self):
+        """Closes the spill file (items still in it are not processed)."""
+        with self._lock:
+            for f in (self._spill_writer, self._spill_reader):
+                if f:
+                    f.close()
+            self._spill_writer = self._spill_reader = None
+
+    def stats(self) -> dict:
+        """Returns depth and counters."""
+        with self._lock:
+            return {"depth": len(self._items), "spill_depth": self._spill_pending, "maxsize": self.maxsize,
+                    "policy": self.policy, "put": self.put_count, "got": self.get_count, "dropped": self.dropped,
+                    "spilled": self.spilled, "blocked_seconds": round(self.blocked_seconds, 3)}
+
+
+class ParseStage:
+    """Thread that turns raw lines from the reader into SensorReading objects."""
+    def __init__(self, lines: PipelineQueue, readings: PipelineQueue, hub=None):
+        self.lines = lines
+        self.readings = readings
+        self.hub = hub # pubsub.Hub to publish every reading to, if any
+        self._parser = fast_parser.get_parser()
+        self._thread = None
+        self.started = None
+        self.parsed = 0
+        self.rejected = 0
+
+    def start(self):
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="ParseStage", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = None):
+        """Stops the thread after every queued line has been parsed."""
+        self.lines.put_control(_STOP)
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self.lines.get()
+            if item is _STOP:
+                return
+            received_at, _port, line_bytes = item
+            # Parsed as bytes; only the ID and type fields get decoded
+            sensor_reading = self._parser.parse(line_bytes, timestamp=received_at)
+            if sensor_reading:
+                self.parsed += 1
+                if self.hub is not None:
+                    self.hub.publish((sensor_reading,))
+                self.readings.put(sensor_reading)
+            else:
+                self.rejected += 1 # The parser logged why
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started if self.started else 0
+        return {"parsed": self.parsed, "rejected": self.rejected,
+                "per_second": round(self.parsed / elapsed, 1) if elapsed else None}
+
+
+class IngestPipeline:
+    """
+    Wires the ingest stages together.
+
+    Without the spool: reader -> line queue -> parse stage -> reading queue -> batch writer.
+    With the spool (config.INGEST_SPOOL_ENABLED): reader -> spool.Spool (on disk) ->
+    spool.SpoolReplayer, which parses and writes with checkpoints; the on-disk spool
+    takes the place of the queues, so nothing read is lost on a database stall or restart.
+
+    start() launches the stage threads; stop() shuts them down in order (reader first),
+    so every line already read is parsed and written.
+    """
+    def __init__(self, ports: list[str] = None, policy: str = None, use_spool: bool = None, hub=None):
+        """
+        Initializes an IngestPipeline instance.
+
+        Args:
+            ports: Serial devices to read. Defaults to config.SERIAL_PORTS.
+            policy: Overflow policy of both queues. Defaults to config.INGEST_OVERFLOW_POLICY.
+                    Not used with the spool (there are no queues).
+            use_spool: Go through the on-disk spool. Defaults to config.INGEST_SPOOL_ENABLED.
+            hub: A started pubsub.Hub to publish every reading to as soon as it is parsed
+                 (before it is stored).
+        """
+        self.use_spool = config.INGEST_SPOOL_ENABLED if use_spool is None else use_spool
+        self.hub = hub
+        if self.use_spool:
+            self.spool = spool.Spool()
+            self.replayer = spool.SpoolReplayer(hub=hub)
+            sink = self.spool.append
+        else:
+            self.lines = PipelineQueue("lines", config.INGEST_LINE_QUEUE_SIZE, policy)
+            self.readings = PipelineQueue("readings", config.INGEST_READING_QUEUE_SIZE, policy)
+            self.parser = ParseStage(self.lines, self.readings, hub)
+            self.writer = batch_writer.BatchWriter(input_queue=self.readings)
+            sink = self.lines.put
+        self.reader = ingest_engine.IngestEngine(sink=sink, ports=ports, parse=False)
+        self.started = None
+
+    def start(self):
+        """Starts the stages, consumers first (the replayer first stores what a previous run spooled)."""
+        self.started = time.monotonic()
+        if self.use_spool:
+            self.replayer.start()
+            self.spool.start()
+        else:
+            self.writer.start()
+            self.parser.start()
+        self.reader.start()
+
+    def request_stop(self):
+        """Stops reading and asks the writer to flush. Safe to call from a signal handler."""
+        self.reader.request_stop()
+        if not self.use_spool:
+            self.writer.request_flush()
+
+    def stop(self, timeout: float = None):
+        """Stops every stage, writing everything that was read."""
+        self.reader.stop(timeout)
+        if self.use_spool:
+            self.spool.close()
+            self.replayer.close(timeout)
+            return
+        self.parser.close(timeout)
+        self.writer.close(timeout)
+        self.lines.close()
+        self.readings.close()
+
+    def stats(self) -> dict:
+        """Queue depths and per-stage counters (throughput is per second since start())."""
+        elapsed = time.monotonic() - self.started if self.started else 0
+        ports = self.reader.stats()
+        lines_read = sum(port["lines"] for port in ports)
+        stats = {"reader": {"lines": lines_read, "per_second": round(lines_read / elapsed, 1) if elapsed else None,
+                            "ports": ports}}
+        aligner = getattr(fast_parser.get_parser(), "aligner", None)
+        if aligner:
+            stats["clocks"] = aligner.stats() # Device clock offset/drift per sensor
+        if self.hub is not None:
+            stats["pubsub"] = self.hub.stats()
+        if self.use_spool:
+            stats["spool"] = self.spool.stats()
+            stats["replayer"] = self.replayer.stats()
+            return stats
+        stats.update({
+            "line_queue": self.lines.stats(),
+            "parser": self.parser.stats(),
+            "reading_queue": self.readings.stats(),
+            "writer": {"written": self.writer.readings_written, "failed": self.writer.readings_failed,
+                       "batches": self.writer.batches_written,
+                       "per_second": round(self.writer.readings_written / elapsed, 1) if elapsed else None},
+        })
+        return stats
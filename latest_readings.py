@@ -0,0 +1,111 @@
+# latest_readings.py
+#
+# Latest-value table: one row per (sensor_id, type) holding its newest reading.
+#
+# Updated in the same transaction as every raw insert, so it is shared by the logger and
+# API processes through the database file. "Current value of every sensor" is then a scan
+# of a table with one row per sensor instead of one ORDER BY ... LIMIT 1 query per sensor
+# against the raw readings.
+import logging
+import sqlite3
+
+import config
+import compact_schema
+from models import ReadingBatch
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# ts (epoch microseconds) decides which reading is newer; timestamp is the string
+# returned to API clients, exactly as the raw table would return it.
+_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS latest_readings (
+        sensor_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        timestamp TEXT NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (sensor_id, type)
+    ) WITHOUT ROWID
+'''
+
+# On equal timestamps the later write wins, like the raw tables' insertion-order tie-break
+_UPSERT_SQL = '''
+    INSERT INTO latest_readings(sensor_id, type, ts, timestamp, value)
+    VALUES(?,?,?,?,?)
+    ON CONFLICT(sensor_id, type) DO UPDATE SET
+        ts = excluded.ts,
+        timestamp = excluded.timestamp,
+        value = excluded.value
+    WHERE excluded.ts >= latest_readings.ts
+'''
+
+
+def create_schema(cursor: sqlite3.Cursor):
+    """
+    Creates the latest_readings table if it doesn't exist. A newly created table is
+    filled from the raw readings, so it is correct on existing databases too.
+    """
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='latest_readings'").fetchone()
+    cursor.execute(_TABLE_SQL)
+    if exists:
+        return
+
+    if config.DB_SCHEMA == "compact":
+        # Bare columns next to MAX() come from the row holding the maximum
+        rows = cursor.execute(
+            "SELECT s.sensor_id, t.type, MAX(r.ts), r.value FROM compact_readings r "
+            "JOIN sensors s ON s.sensor_key = r.sensor_key JOIN types t ON t.type_key = r.type_key "
+            "GROUP BY r.sensor_key, r.type_key").fetchall()
+        rows = [(sensor_id, sensor_type, ts, compact_schema.format_epoch_us(ts), value)
+                for sensor_id, sensor_type, ts, value in rows]
+    else:
+        rows = cursor.execute(
+            "SELECT sensor_id, type, MAX(timestamp), value FROM sensor_readings "
+            "GROUP BY sensor_id, type").fetchall()
+        rows = [(sensor_id, sensor_type, compact_schema.iso_to_epoch_us(timestamp), timestamp, value)
+                for sensor_id, sensor_type, timestamp, value in rows]
+    cursor.executemany(_UPSERT_SQL, rows)
+    if rows:
+        logging.info(f"Filled latest_readings for {len(rows)} sensors from existing readings.")
+
+def apply(cursor: sqlite3.Cursor, readings: list):
+    """
+    Records freshly stored readings (SensorReading objects or a ReadingBatch) as the
+    latest values where they are newer. Call inside the same transaction as the raw insert.
+    """
+    if isinstance(readings, ReadingBatch):
+        entries = ((sid, stype, ts, value, None) for sid, stype, ts, value in readings.epoch_rows())
+    else:
+        entries = ((r.sensor_id, r.sensor_type, compact_schema.to_epoch_us(r.timestamp), r.value, r) for r in readings)
+    newest = {}
+    for sid, stype, ts, value, reading in entries:
+        current = newest.get((sid, stype))
+        if current is None or ts >= current[0]:
+            newest[(sid, stype)] = (ts, value, reading)
+    # A legacy SensorReading keeps the exact string stored in sensor_readings; batches were
+    # stored with format_epoch_us() (see ReadingBatch.to_db_tuples) like the compact schema
+    legacy = config.DB_SCHEMA != "compact"
+    rows = [(sid, stype, ts, r.to_db_tuple()[0] if legacy and r is not None else compact_schema.format_epoch_us(ts), value)
+            for (sid, stype), (ts, value, r) in newest.items()]
+    cursor.executemany(_UPSERT_SQL, rows)
+
+def fetch(conn: sqlite3.Connection, sensor_id: str | None = None, sensor_type: str | None = None) -> list[dict]:
+    """
+    Returns the latest reading of every (sensor_id, type), optionally filtered,
+    as dictionaries shaped like get_readings_from_db() results.
+    """
+    query = "SELECT timestamp, sensor_id, type, value FROM latest_readings"
+    params = []
+    conditions = []
+    if sensor_id:
+        conditions.append("sensor_id = ?")
+        params.append(sensor_id)
+    if sensor_type:
+        conditions.append("type = ?")
+        params.append(sensor_type)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY sensor_id, type"
+    return [{"timestamp": timestamp, "sensor_id": sid, "type": stype, "value": value}
+            for timestamp, sid, stype, value in conn.execute(query, params)]
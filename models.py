@@ -1,10 +1,40 @@
 # models.py
 import datetime
+import json
+import math
+import sys
+from array import array
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+# Timestamp conversions for epoch-microsecond columns (compact schema, ReadingBatch, ...)
+
+def to_epoch_us(timestamp: datetime.datetime) -> int:
+    """Converts a datetime to integer microseconds since the epoch (naive = UTC)."""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return (timestamp - EPOCH) // _ONE_MICROSECOND
+
+def from_epoch_us(ts: int) -> datetime.datetime:
+    """Converts integer microseconds since the epoch to an aware UTC datetime."""
+    return EPOCH + datetime.timedelta(microseconds=ts)
+
+def format_epoch_us(ts: int) -> str:
+    """Formats epoch microseconds as an ISO-8601 UTC timestamp (with a +00:00 offset)."""
+    return from_epoch_us(ts).isoformat()
+
+def iso_to_epoch_us(timestamp: str) -> int:
+    """Converts an ISO-8601 timestamp string to epoch microseconds."""
+    return to_epoch_us(datetime.datetime.fromisoformat(timestamp))
 
 class SensorReading:
     """
     Represents a single sensor reading with its metadata.
     """
+    # No per-instance __dict__: a queued reading is four references
+    __slots__ = ("sensor_id", "sensor_type", "value", "timestamp")
+
     def __init__(self, sensor_id: str, sensor_type: str, value: float, timestamp: datetime.datetime = None):
         """
         Initializes a SensorReading instance.
@@ -28,6 +58,16 @@ class SensorReading:
         self.sensor_type = sensor_type
         self.timestamp = timestamp or datetime.datetime.now(datetime.timezone.utc)
 
+    @classmethod
+    def trusted(cls, sensor_id: str, sensor_type: str, value: float, timestamp: datetime.datetime) -> "SensorReading":
+        """Builds a reading from fields that are already validated (e.g. by fast_parser), skipping the checks."""
+        reading = cls.__new__(cls)
+        reading.sensor_id = sensor_id
+        reading.sensor_type = sensor_type
+        reading.value = value
+        reading.timestamp = timestamp
+        return reading
+
     def to_dict(self) -> dict:
         """Returns a dictionary representation of the reading."""
         return {
@@ -48,6 +88,151 @@ class SensorReading:
         return (f"SensorReading(id='{self.sensor_id}', type='{self.sensor_type}', "
                 f"value={self.value}, time='{self.timestamp.isoformat()}')")
 
+class ReadingBatch:
+    """
+    Many readings stored column-wise: parallel arrays of epoch-microsecond timestamps
+    (int64) and values (float64), plus sensor/type codes (uint32) into per-batch name
+    tables. Appending a reading allocates no per-row objects, and the bulk conversions
+    (to_db_tuples, to_json, ...) work straight from the columns.
+
+    Iterating yields SensorReading objects, so a batch can be passed wherever a list of
+    readings is expected (store_readings, rollups, ...).
+    """
+    __slots__ = ("timestamps", "values", "sensor_codes", "type_codes", "sensor_names", "type_names",
+                 "_sensor_lookup", "_type_lookup", "_iso")
+
+    def __init__(self):
+        self.timestamps = array("q") # Epoch microseconds (UTC)
+        self.values = array("d")
+        self.sensor_codes = array("I") # Index into sensor_names
+        self.type_codes = array("I") # Index into type_names
+        self.sensor_names = [] # Interned sensor IDs, in order of first appearance
+        self.type_names = []
+        self._sensor_lookup = {} # name -> code
+        self._type_lookup = {}
+        self._iso = {} # epoch us -> formatted timestamp, filled lazily (or from stored strings)
+
+    @classmethod
+    def from_readings(cls, readings) -> "ReadingBatch":
+        """Builds a batch from SensorReading objects."""
+        batch = cls()
+        for reading in readings:
+            batch.append(reading.sensor_id, reading.sensor_type, reading.value,
+                         to_epoch_us(reading.timestamp))
+        return batch
+
+    @classmethod
+    def from_rows(cls, rows) -> "ReadingBatch":
+        """
+        Builds a batch from (timestamp, sensor_id, type, value, ...) database rows, with the
+        timestamp as stored: an ISO string (legacy schema) or epoch microseconds (compact).
+        """
+        batch = cls()
+        for row in rows:
+            ts = row[0]
+            if isinstance(ts, str):
+                iso, ts = ts, iso_to_epoch_us(ts)
+                batch._iso[ts] = iso # Returned exactly as stored
+            batch.append(row[1], row[2], row[3], ts)
+        return batch
+
+    def sensor_code(self, sensor_id: str) -> int:
+        """Returns the code of sensor_id, adding it to the name table if new."""
+        code = self._sensor_lookup.get(sensor_id)
+        if code is None:
+            code = self._sensor_lookup[sensor_id] = len(self.sensor_names)
+            self.sensor_names.append(sys.intern(sensor_id))
+        return code
+
+    def type_code(self, sensor_type: str) -> int:
+        """Returns the code of sensor_type, adding it to the name table if new."""
+        code = self._type_lookup.get(sensor_type)
+        if code is None:
+            code = self._type_lookup[sensor_type] = len(self.type_names)
+            self.type_names.append(sys.intern(sensor_type))
+        return code
+
+    def append(self, sensor_id: str, sensor_type: str, value: float, ts: int):
+        """Adds one reading (ts in epoch microseconds)."""
+        self.sensor_codes.append(self.sensor_code(sensor_id))
+        self.type_codes.append(self.type_code(sensor_type))
+        self.values.append(value)
+        self.timestamps.append(ts)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __bool__(self) -> bool:
+        return len(self.values) > 0
+
+    def __iter__(self):
+        return iter(self.to_readings())
+
+    def epoch_rows(self):
+        """Yields (sensor_id, type, ts, value) per reading, with ts in epoch microseconds."""
+        sensors, types = self.sensor_names, self.type_names
+        for sensor_code, type_code, ts, value in zip(self.sensor_codes, self.type_codes, self.timestamps, self.values):
+            yield sensors[sensor_code], types[type_code], ts, value
+
+    def to_readings(self) -> list[SensorReading]:
+        """Materializes SensorReading objects (one per row; prefer the bulk methods)."""
+        return [SensorReading.trusted(sensor_id, sensor_type, value, from_epoch_us(ts))
+                for sensor_id, sensor_type, ts, value in self.epoch_rows()]
+
+    def iso_timestamps(self) -> list[str]:
+        """
+        ISO-8601 timestamps, one per reading; repeated timestamps are formatted once.
+
+        Timestamps are normalized to UTC with a +00:00 offset (a reading built from a naive or
+        non-UTC datetime formats differently through SensorReading.to_db_tuple()), except for
+        batches built by from_rows(), whose timestamps are returned exactly as stored.
+        """
+        formatted = self._iso
+        result = []
+        for ts in self.timestamps:
+            iso = formatted.get(ts)
+            if iso is None:
+                iso = formatted[ts] = format_epoch_us(ts)
+            result.append(iso)
+        return result
+
+    def to_db_tuples(self) -> list[tuple]:
+        """Returns (timestamp, sensor_id, type, value) rows, with timestamps as in iso_timestamps()."""
+        sensors, types = self.sensor_names, self.type_names
+        return [(iso, sensors[sensor_code], types[type_code], value) for iso, sensor_code, type_code, value
+                in zip(self.iso_timestamps(), self.sensor_codes, self.type_codes, self.values)]
+
+    def to_dicts(self) -> list[dict]:
+        """Returns one dictionary per reading, like SensorReading.to_dict() (timestamps as in iso_timestamps())."""
+        return [{"timestamp": iso, "sensor_id": sensor_id, "type": sensor_type, "value": value}
+                for iso, sensor_id, sensor_type, value in self.to_db_tuples()]
+
+    def to_json(self) -> str:
+        """
+        Serializes the batch as a JSON array of to_dict() objects (keys sorted and compact
+        separators, like Flask's jsonify), without building the dictionaries. Each sensor
+        and type name is escaped once per batch.
+        """
+        sensors = [json.dumps(name) for name in self.sensor_names]
+        types = [json.dumps(name) for name in self.type_names]
+        # float.__repr__ is what json uses for finite values
+        values = [repr(value) if math.isfinite(value) else json.dumps(value) for value in self.values]
+        return "[" + ",".join(
+            f'{{"sensor_id":{sensors[sensor_code]},"timestamp":"{iso}","type":{types[type_code]},"value":{value}}}'
+            for iso, sensor_code, type_code, value
+            in zip(self.iso_timestamps(), self.sensor_codes, self.type_codes, values)) + "]"
+
+class ParsedBatch(ReadingBatch):
+    """
+    ReadingBatch returned by the serial parsers (fast_parser.LineParser.parse_batch(),
+    binary_protocol.FrameParser.parse_batch()), plus the count of rejected lines/frames.
+    """
+    __slots__ = ("rejected",)
+
+    def __init__(self):
+        super().__init__()
+        self.rejected = 0
+
 # Example of how you might define known sensor types (optional, but good practice)
 # You could load this from config.py or define it here/elsewhere
 # KNOWN_SENSOR_TYPES = {
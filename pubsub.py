@@ -0,0 +1,384 @@
+# pubsub.py
+#
+# Live readings hub: the logger publishes every reading on a local Unix-domain socket
+# (config.PUBSUB_SOCKET) as soon as the pipeline has parsed it, before it is stored, so consumers
+# such as alerting, a dosing-pump control loop or an MQTT bridge get readings without polling
+# SQLite. A published reading is the one that gets stored, timestamp included, so it can be
+# matched to its row. With the spool (INGEST_SPOOL_ENABLED) lines are parsed when they are
+# replayed from it, so readings are published up to a couple of spool flush intervals later.
+#
+# Protocol (newline-delimited JSON, so any language with a socket library can subscribe):
+#   client -> hub   one subscription line: {"sensor_id": "PHProbe-Tank1", "type": ["pH", "EC"]}
+#                   (both optional, a string or a list; {} or an empty line = everything).
+#                   A later line replaces the filters.
+#   hub -> client   {"subscribed": {"sensor_id": [...], "type": [...]}}     acknowledgement
+#                   {"timestamp": "...", "sensor_id": "...", "type": "...", "value": ...}   per reading
+#                   {"dropped": n}    n readings were discarded because the client fell behind
+#                   {"error": "..."}  the subscription line was invalid
+#
+# Publishing never blocks the logger: each subscriber has a bounded queue
+# (config.PUBSUB_BUFFER_SIZE readings); when a slow subscriber's queue is full its oldest
+# readings are dropped and counted. Sockets are served by one selector thread.
+#
+# Run this file to print the live readings: python pubsub.py [--sensor-id ID] [--type TYPE]
+import argparse
+import json
+import logging
+import os
+import selectors
+import socket
+import stat
+import threading
+from collections import deque
+
+import config
+from models import ReadingBatch
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_SEND_BUFFER_BYTES = 64 * 1024 # Encoded readings moved to a socket's send buffer at a time
+_MAX_LINE_BYTES = 64 * 1024 # Longest subscription line accepted
+
+
+def _encode(message: dict) -> bytes:
+    return (json.dumps(message, separators=(",", ":")) + "\n").encode()
+
+def _name_set(value, field: str) -> frozenset:
+    """Parses one filter of a subscription line (missing, a string or a list of strings)."""
+    if value is None:
+        return frozenset()
+    if isinstance(value, str):
+        return frozenset([value])
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return frozenset(value)
+    raise ValueError(f"{field} must be a string or a list of strings")
+
+
+class _Client:
+    """Hub-side state of one subscriber connection."""
+    __slots__ = ("sock", "inbuf", "outbuf", "pending", "subscribed", "sensor_ids", "sensor_types",
+                 "unreported", "dropped", "delivered")
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.pending = deque() # Encoded readings waiting for outbuf
+        self.subscribed = False
+        self.sensor_ids = frozenset()
+        self.sensor_types = frozenset()
+        self.unreported = 0 # Dropped since the last {"dropped": n} notice
+        self.dropped = 0
+        self.delivered = 0
+
+    def matches(self, sensor_id: str, sensor_type: str) -> bool:
+        return ((not self.sensor_ids or sensor_id in self.sensor_ids) and
+                (not self.sensor_types or sensor_type in self.sensor_types))
+
+
+class Hub:
+    """Publishes readings to subscribers connected on a Unix-domain socket."""
+    def __init__(self, path: str = None, buffer_size: int = None):
+        """
+        Initializes a Hub instance (call start() to open the socket).
+
+        Args:
+            path: Socket file. Defaults to config.PUBSUB_SOCKET.
+            buffer_size: Readings queued per subscriber before the oldest are dropped.
+                         Defaults to config.PUBSUB_BUFFER_SIZE.
+        """
+        self.path = path or config.PUBSUB_SOCKET
+        self.buffer_size = buffer_size or config.PUBSUB_BUFFER_SIZE
+        self._lock = threading.Lock()
+        self._clients = {} # socket -> _Client; added/removed by the selector thread only
+        self._subscribed = 0
+        self._selector = None
+        self._listener = None
+        self._wake_r = self._wake_w = None
+        self._wake_pending = False
+        self._closing = False
+        self._thread = None
+        self.connections = 0
+        self.published = 0
+
+    @property
+    def has_subscribers(self) -> bool:
+        """True while at least one client is subscribed (publishers can skip work otherwise)."""
+        return self._subscribed > 0
+
+    def start(self) -> bool:
+        """Opens the socket and starts the selector thread. False if the socket can't be opened."""
+        if not hasattr(socket, "AF_UNIX"):
+            logging.warning("Live readings hub disabled: Unix-domain sockets are not available on this platform.")
+            return False
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # A socket file left by a previous run that didn't shut down cleanly
+            if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.unlink(self.path)
+            self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._listener.bind(self.path)
+            os.chmod(self.path, 0o660) # Only the logger's user and group may subscribe
+            self._listener.listen(16)
+        except OSError as e:
+            logging.error(f"Live readings hub disabled: could not listen on {self.path}: {e}")
+            if self._listener is not None:
+                self._listener.close()
+                self._listener = None
+            return False
+        self._listener.setblocking(False)
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run, name="PubSubHub", daemon=True)
+        self._thread.start()
+        logging.info(f"Live readings hub listening on {self.path}")
+        return True
+
+    def publish(self, readings) -> int:
+        """
+        Queues SensorReading objects (or a ReadingBatch) for every subscriber whose filters
+        match. Never blocks.
+
+        Returns:
+            int: Number of (reading, subscriber) deliveries queued.
+        """
+        if not self._subscribed:
+            return 0
+        # Encoded once, whatever the number of subscribers
+        if isinstance(readings, ReadingBatch):
+            encoded = [(r["sensor_id"], r["type"], _encode(r)) for r in readings.to_dicts()]
+        else:
+            encoded = [(r.sensor_id, r.sensor_type, _encode(r.to_dict())) for r in readings]
+        queued = 0
+        with self._lock:
+            self.published += len(encoded)
+            for client in self._clients.values():
+                if not client.subscribed:
+                    continue
+                for sensor_id, sensor_type, line in encoded:
+                    if client.matches(sensor_id, sensor_type):
+                        if len(client.pending) >= self.buffer_size:
+                            client.pending.popleft()
+                            client.unreported += 1
+                            client.dropped += 1
+                        client.pending.append(line)
+                        queued += 1
+            wake = queued and not self._wake_pending
+            if wake:
+                self._wake_pending = True
+        if wake:
+            try:
+                self._wake_w.send(b"\0")
+            except (BlockingIOError, OSError):
+                pass # Already has a wake-up byte waiting, or closing
+        return queued
+
+    # --- Selector thread ---
+
+    def _run(self):
+        while not self._closing:
+            for key, mask in self._selector.select(timeout=1.0):
+                if key.fileobj is self._listener:
+                    self._accept()
+                elif key.fileobj is self._wake_r:
+                    try:
+                        self._wake_r.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    with self._lock:
+                        self._wake_pending = False
+                else:
+                    client = key.data
+                    if mask & selectors.EVENT_READ and not self._read(client):
+                        continue
+            for client in list(self._clients.values()):
+                self._flush(client)
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except (BlockingIOError, OSError):
+            return
+        sock.setblocking(False)
+        client = _Client(sock)
+        with self._lock:
+            self._clients[sock] = client
+        self.connections += 1
+        self._selector.register(sock, selectors.EVENT_READ, client)
+
+    def _read(self, client: _Client) -> bool:
+        """Reads subscription lines. False if the client was disconnected."""
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return True
+        except OSError:
+            data = b""
+        if not data:
+            self._drop_client(client)
+            return False
+        client.inbuf += data
+        while b"\n" in client.inbuf:
+            line, _, rest = bytes(client.inbuf).partition(b"\n")
+            client.inbuf = bytearray(rest)
+            self._subscribe(client, line)
+        if len(client.inbuf) > _MAX_LINE_BYTES:
+            self._drop_client(client)
+            return False
+        return True
+
+    def _subscribe(self, client: _Client, line: bytes):
+        """Applies a subscription line (replacing earlier filters) and acknowledges it."""
+        try:
+            filters = json.loads(line) if line.strip() else {}
+            if not isinstance(filters, dict):
+                raise ValueError("subscription must be a JSON object")
+            sensor_ids = _name_set(filters.get("sensor_id"), "sensor_id")
+            sensor_types = _name_set(filters.get("type"), "type")
+        except ValueError as e:
+            client.outbuf += _encode({"error": f"Invalid subscription: {e}"})
+            return
+        with self._lock:
+            if not client.subscribed:
+                self._subscribed += 1
+            client.subscribed = True
+            client.sensor_ids, client.sensor_types = sensor_ids, sensor_types
+            client.outbuf += _encode({"subscribed": {"sensor_id": sorted(sensor_ids), "type": sorted(sensor_types)}})
+
+    def _flush(self, client: _Client):
+        """Moves queued readings into the send buffer and sends what the socket takes."""
+        if client.sock not in self._clients:
+            return
+        with self._lock:
+            if client.unreported:
+                client.outbuf += _encode({"dropped": client.unreported})
+                client.unreported = 0
+            while client.pending and len(client.outbuf) < _SEND_BUFFER_BYTES:
+                client.outbuf += client.pending.popleft()
+                client.delivered += 1
+        if client.outbuf:
+            try:
+                sent = client.sock.send(client.outbuf)
+                del client.outbuf[:sent]
+            except BlockingIOError:
+                pass
+            except OSError:
+                self._drop_client(client)
+                return
+        # Wait for the socket to take more only while something is left to send
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.outbuf or client.pending else 0)
+        if self._selector.get_key(client.sock).events != events:
+            self._selector.modify(client.sock, events, client)
+
+    def _drop_client(self, client: _Client):
+        with self._lock:
+            if self._clients.pop(client.sock, None) is None:
+                return
+            if client.subscribed:
+                self._subscribed -= 1
+        self._selector.unregister(client.sock)
+        client.sock.close()
+
+    # ---
+
+    def stats(self) -> dict:
+        """Returns publishing counters and each subscriber's filters, queue depth and drops."""
+        with self._lock:
+            clients = [{"sensor_id": sorted(c.sensor_ids), "type": sorted(c.sensor_types), "queued": len(c.pending),
+                        "delivered": c.delivered, "dropped": c.dropped}
+                       for c in self._clients.values() if c.subscribed]
+            return {"socket": self.path, "connections": self.connections, "published": self.published,
+                    "subscribers": clients}
+
+    def close(self):
+        """Disconnects every subscriber, stops the thread and removes the socket file."""
+        if self._thread is None:
+            return
+        self._closing = True
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+        self._thread.join()
+        self._thread = None
+        for client in list(self._clients.values()):
+            self._drop_client(client)
+        self._selector.close()
+        self._listener.close()
+        self._wake_r.close()
+        self._wake_w.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class Subscriber:
+    """Client side of the hub: iterating over it yields reading dictionaries as they are published."""
+    def __init__(self, sensor_id=None, sensor_type=None, path: str = None, timeout: float = None):
+        """
+        Initializes a Subscriber instance (connects and subscribes).
+
+        Args:
+            sensor_id: A sensor ID or a list of them (None for all).
+            sensor_type: A sensor type or a list of them (None for all).
+            path: Socket file. Defaults to config.PUBSUB_SOCKET.
+            timeout: Seconds to wait for a reading before socket.timeout is raised (None waits forever).
+
+        Raises:
+            OSError: If the hub isn't running.
+            ValueError: If the hub rejected the filters.
+        """
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.dropped = 0 # Readings the hub discarded because this subscriber fell behind
+        try:
+            self.sock.connect(path or config.PUBSUB_SOCKET)
+            filters = {name: value for name, value in (("sensor_id", sensor_id), ("type", sensor_type)) if value}
+            self.sock.sendall(_encode(filters))
+            self._file = self.sock.makefile("rb")
+            reply = json.loads(self._file.readline() or b"{}")
+        except BaseException:
+            self.sock.close()
+            raise
+        if "subscribed" not in reply:
+            self.close()
+            raise ValueError(reply.get("error", "Hub closed the connection"))
+
+    def __iter__(self):
+        for line in self._file:
+            message = json.loads(line)
+            if "dropped" in message:
+                self.dropped += message["dropped"]
+                continue
+            yield message
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Print the readings the logger publishes.")
+    arg_parser.add_argument("--sensor-id", action="append", help="Only this sensor (repeatable)")
+    arg_parser.add_argument("--type", action="append", help="Only this sensor type (repeatable)")
+    arg_parser.add_argument("--socket", default=None, help=f"Socket file (default {config.PUBSUB_SOCKET})")
+    args = arg_parser.parse_args()
+    try:
+        with Subscriber(args.sensor_id, args.type, args.socket) as subscriber:
+            for reading in subscriber:
+                print(json.dumps(reading), flush=True)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        logging.error(f"Could not connect to the live readings hub (is the logger running?): {e}")
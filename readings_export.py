@@ -0,0 +1,74 @@
+# readings_export.py
+#
+# Serializers for /readings/export (api_server.py).
+#
+# Each serializer turns the row chunks of data_processor.iter_reading_chunks() into a stream
+# of bytes, one piece per chunk, so a Flask generator response can send any number of
+# readings while holding only one chunk in memory.
+import csv
+import io
+import json
+import zlib
+
+import columnar
+import compact_schema
+
+# format name -> (mimetype, file extension)
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "columnar": (columnar.MIMETYPE, "rcol"), # Binary, see columnar.py
+}
+
+CSV_HEADER = ["timestamp", "sensor_id", "type", "value"]
+
+
+def _iso(timestamp) -> str:
+    """Stored timestamp (ISO string or compact epoch microseconds) -> ISO string."""
+    return timestamp if isinstance(timestamp, str) else compact_schema.format_epoch_us(timestamp)
+
+def ndjson_stream(chunks):
+    """One JSON object per line, with the same fields as /readings."""
+    for rows in chunks:
+        yield "".join(
+            json.dumps({"timestamp": _iso(ts), "sensor_id": sensor_id, "type": sensor_type, "value": value}) + "\n"
+            for ts, sensor_id, sensor_type, value in rows
+        ).encode("utf-8")
+
+def csv_stream(chunks):
+    """CSV with a header row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(CSV_HEADER)
+    for rows in chunks:
+        writer.writerows((_iso(ts), sensor_id, sensor_type, value) for ts, sensor_id, sensor_type, value in rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell(): # Header only (no readings)
+        yield buffer.getvalue().encode("utf-8")
+
+def gzip_stream(pieces, level: int = 6):
+    """Compresses a byte stream on the fly into a single gzip member."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # 16+: gzip header/trailer
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def stream(fmt: str, chunks, gzip: bool = False):
+    """
+    Serializes row chunks in the given format.
+
+    Args:
+        fmt: A key of FORMATS.
+        chunks: Iterable of row lists from data_processor.iter_reading_chunks().
+        gzip: Compress the output.
+
+    Returns:
+        An iterator of bytes.
+    """
+    serializers = {"ndjson": ndjson_stream, "csv": csv_stream, "columnar": columnar.encode_stream}
+    pieces = serializers[fmt](chunks)
+    return gzip_stream(pieces) if gzip else pieces
@@ -0,0 +1,120 @@
+# response_cache.py
+#
+# In-memory LRU cache of rendered API responses (used by api_server.py).
+#
+# Dashboards tend to poll the same URL every few seconds. A cached response is reused until
+# the database changes (checked with PRAGMA data_version, which costs no table reads), so
+# repeated polls skip both the SQL query and the JSON serialization. Responses carry an
+# ETag, so a client that sends If-None-Match gets an empty 304 while nothing has changed.
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import config
+import db_pool
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class CachedResponse:
+    """A rendered response body plus what is needed to replay it."""
+    __slots__ = ("body", "etag", "mimetype", "headers", "version", "created")
+
+    def __init__(self, body: bytes, mimetype: str, headers: dict, version: tuple):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.mimetype = mimetype
+        self.headers = headers
+        self.version = version
+        self.created = time.monotonic()
+
+
+class ResponseCache:
+    """
+    LRU cache of rendered API responses, invalidated by database changes.
+
+    Entries are tagged with the database's change marker (PRAGMA data_version, read on
+    a dedicated connection that never writes). data_version changes whenever any other
+    connection - in this process or the logger's - commits, so an entry is served only
+    while the data it was built from is unchanged. ttl is just an upper bound on age.
+    """
+    def __init__(self, max_entries: int = None, ttl: float = None):
+        """
+        Initializes a ResponseCache instance.
+
+        Args:
+            max_entries: Max cached responses. Defaults to config.RESPONSE_CACHE_SIZE.
+            ttl: Max age of an entry in seconds. Defaults to config.RESPONSE_CACHE_TTL.
+        """
+        self.max_entries = config.RESPONSE_CACHE_SIZE if max_entries is None else max_entries
+        self.ttl = config.RESPONSE_CACHE_TTL if ttl is None else ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_path = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def data_version(self) -> tuple:
+        """
+        Returns the current change marker of config.DATABASE_NAME.
+        Cheap: no table is read, only a counter kept by SQLite.
+        """
+        with self._lock:
+            if self._conn is None or self._conn_path != config.DATABASE_NAME:
+                if self._conn is not None:
+                    self._conn.close()
+                self._conn = db_pool.open_connection(config.DATABASE_NAME)
+                self._conn_path = config.DATABASE_NAME
+            return (self._conn_path, self._conn.execute("PRAGMA data_version").fetchone()[0])
+
+    def get(self, key: tuple, version: tuple) -> CachedResponse | None:
+        """Returns the entry for key if it was built from the current data and isn't too old."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.version != version or time.monotonic() - entry.created > self.ttl:
+                del self._entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, entry: CachedResponse):
+        """Stores an entry, evicting the least recently used ones beyond max_entries."""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drops every entry and the change-marker connection (e.g. when the DB file is replaced)."""
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except sqlite3.Error:
+                    pass
+            self._conn = None
+            self._conn_path = None
+
+    def stats(self) -> dict:
+        """Returns cache usage counters."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
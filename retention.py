@@ -0,0 +1,237 @@
+# retention.py
+#
+# Retention and compaction for the readings database.
+#
+# Raw readings older than the configured age (per sensor type, see RETENTION_POLICIES in
+# config.py) are deleted in small chunks, each in its own short transaction, so the logger's
+# writes are never blocked for long. Rollup tables have their own ages, so raw data can be
+# dropped after e.g. 14 days while hourly/daily rollups are kept. Freed pages are then
+# returned to the file system with incremental vacuum.
+#
+# Runs as a background thread inside serial_data_logger.py (RETENTION_ENABLED), or once
+# from the command line:
+#     python retention.py [--dry-run] [--enable-incremental-vacuum]
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import config
+import db_pool
+import compact_schema
+import rollups
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def _cutoff(days: float, now: datetime) -> datetime:
+    """Oldest timestamp kept by a policy of the given number of days."""
+    return now - timedelta(days=days)
+
+def _delete_in_chunks(delete_sql: str, params: list, stop: threading.Event | None) -> int:
+    """
+    Repeatedly deletes up to RETENTION_CHUNK_SIZE matching rows per transaction.
+
+    Args:
+        delete_sql: DELETE statement whose last parameter is the chunk size.
+        params: Parameters for delete_sql (without the chunk size).
+        stop: Event that aborts the loop between chunks (e.g. on shutdown).
+
+    Returns:
+        int: Rows deleted.
+    """
+    deleted = 0
+    while not (stop and stop.is_set()):
+        with db_pool.pool.connection() as conn:
+            count = conn.execute(delete_sql, params + [config.RETENTION_CHUNK_SIZE]).rowcount
+            conn.commit()
+        deleted += count
+        if count < config.RETENTION_CHUNK_SIZE:
+            break
+        # Give the logger's batch writer a window to commit between chunks
+        time.sleep(config.RETENTION_CHUNK_PAUSE)
+    return deleted
+
+def _raw_jobs(now: datetime) -> list[tuple[str, str, list]]:
+    """
+    Turns RETENTION_POLICIES into (description, delete_sql, params) jobs for the raw readings.
+    Each DELETE removes at most one chunk (last parameter) through an index range.
+    """
+    policies = dict(config.RETENTION_POLICIES)
+    default_days = policies.pop("*", None)
+    jobs = []
+    compact = config.DB_SCHEMA == "compact"
+    with db_pool.pool.connection() as conn:
+        for sensor_type, days in policies.items():
+            if days is None:
+                continue
+            if compact:
+                type_key = compact_schema.keys.lookup(conn, "types", sensor_type)
+                if type_key is None:
+                    continue
+                sql = ("DELETE FROM compact_readings WHERE (sensor_key, ts, type_key) IN "
+                       "(SELECT sensor_key, ts, type_key FROM compact_readings "
+                       "WHERE type_key = ? AND ts < ? LIMIT ?)")
+                params = [type_key, compact_schema.to_epoch_us(_cutoff(days, now))]
+            else:
+                sql = ("DELETE FROM sensor_readings WHERE rowid IN "
+                       "(SELECT rowid FROM sensor_readings WHERE type = ? AND timestamp < ? LIMIT ?)")
+                params = [sensor_type, _cutoff(days, now).isoformat()]
+            jobs.append((f"raw {sensor_type} > {days}d", sql, params))
+
+        if default_days is not None:
+            # Every type without its own policy
+            named = list(policies)
+            if compact:
+                keys = [compact_schema.keys.lookup(conn, "types", t) for t in named]
+                keys = [k for k in keys if k is not None]
+                exclude = f"AND type_key NOT IN ({', '.join('?' for _ in keys)})" if keys else ""
+                sql = ("DELETE FROM compact_readings WHERE (sensor_key, ts, type_key) IN "
+                       "(SELECT sensor_key, ts, type_key FROM compact_readings "
+                       f"WHERE ts < ? {exclude} LIMIT ?)")
+                params = [compact_schema.to_epoch_us(_cutoff(default_days, now))] + keys
+            else:
+                exclude = f"AND type NOT IN ({', '.join('?' for _ in named)})" if named else ""
+                sql = ("DELETE FROM sensor_readings WHERE rowid IN "
+                       f"(SELECT rowid FROM sensor_readings WHERE timestamp < ? {exclude} LIMIT ?)")
+                params = [_cutoff(default_days, now).isoformat()] + named
+            jobs.append((f"raw * > {default_days}d", sql, params))
+    return jobs
+
+def _rollup_jobs(now: datetime) -> list[tuple[str, str, list]]:
+    """(description, delete_sql, params) jobs for the rollup tables."""
+    jobs = []
+    for name, _ in rollups.LEVELS:
+        days = config.RETENTION_ROLLUP_DAYS.get(name)
+        if days is None:
+            continue
+        sql = (f"DELETE FROM rollup_{name} WHERE (sensor_id, type, bucket) IN "
+               f"(SELECT sensor_id, type, bucket FROM rollup_{name} WHERE bucket < ? LIMIT ?)")
+        jobs.append((f"rollup_{name} > {days}d", sql, [int(_cutoff(days, now).timestamp())]))
+    return jobs
+
+def _page_stats() -> tuple[int, int, int, int]:
+    """Returns (page_size, page_count, freelist_count, auto_vacuum mode)."""
+    with db_pool.pool.connection() as conn:
+        return tuple(conn.execute(f"PRAGMA {name}").fetchone()[0]
+                     for name in ("page_size", "page_count", "freelist_count", "auto_vacuum"))
+
+def incremental_vacuum(stop: threading.Event | None = None) -> int:
+    """
+    Returns free pages to the file system a few at a time (needs auto_vacuum=INCREMENTAL).
+
+    Returns:
+        int: Pages released.
+    """
+    released = 0
+    while not (stop and stop.is_set()):
+        with db_pool.pool.connection() as conn:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if before == 0:
+                break
+            conn.execute(f"PRAGMA incremental_vacuum({config.RETENTION_VACUUM_PAGES})").fetchall()
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        released += before - after
+        if after == before:
+            break
+        time.sleep(config.RETENTION_CHUNK_PAUSE)
+    return released
+
+def run_retention(dry_run: bool = False, stop: threading.Event | None = None) -> dict:
+    """
+    Applies every retention policy once, then runs incremental vacuum.
+
+    Args:
+        dry_run: Only report which jobs would run.
+        stop: Event that aborts the run between chunks.
+
+    Returns:
+        dict: {"rows_deleted": {job: rows}, "bytes_reclaimed": int, "free_bytes": int}
+    """
+    now = datetime.now(timezone.utc)
+    jobs = _raw_jobs(now)
+    if config.ROLLUPS_ENABLED:
+        jobs += _rollup_jobs(now)
+
+    report = {"rows_deleted": {}, "bytes_reclaimed": 0, "free_bytes": 0}
+    if dry_run:
+        report["rows_deleted"] = {description: None for description, _, _ in jobs}
+        return report
+
+    page_size, pages_before, _, auto_vacuum = _page_stats()
+    for description, sql, params in jobs:
+        try:
+            report["rows_deleted"][description] = _delete_in_chunks(sql, params, stop)
+        except sqlite3.Error as e:
+            logging.error(f"Retention job '{description}' failed: {e}")
+
+    if auto_vacuum == 2: # INCREMENTAL
+        incremental_vacuum(stop)
+    elif sum(report["rows_deleted"].values()):
+        logging.info("auto_vacuum is not INCREMENTAL, so freed pages are reused but the file won't shrink. "
+                     "Run 'python retention.py --enable-incremental-vacuum' once to change that.")
+
+    _, pages_after, free_pages, _ = _page_stats()
+    report["bytes_reclaimed"] = max(0, pages_before - pages_after) * page_size
+    report["free_bytes"] = free_pages * page_size
+    logging.info(f"Retention run: deleted {sum(report['rows_deleted'].values())} rows "
+                 f"{report['rows_deleted']}, reclaimed {report['bytes_reclaimed']} bytes.")
+    return report
+
+def enable_incremental_vacuum(database: str = None):
+    """Switches an existing database to auto_vacuum=INCREMENTAL (rewrites the file with VACUUM)."""
+    conn = db_pool.open_connection(database or config.DATABASE_NAME)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        logging.info("auto_vacuum set to INCREMENTAL.")
+    finally:
+        conn.close()
+
+
+class RetentionWorker:
+    """Background thread that runs run_retention() every RETENTION_INTERVAL seconds."""
+    def __init__(self, interval: float = None):
+        self.interval = config.RETENTION_INTERVAL if interval is None else interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_report = None
+
+    def start(self):
+        """Starts the background thread (first run happens right away)."""
+        self._thread = threading.Thread(target=self._run, name="RetentionWorker", daemon=True)
+        self._thread.start()
+        logging.info(f"Retention worker started (every {self.interval}s).")
+
+    def stop(self, timeout: float = None):
+        """Stops the thread; an in-progress run is abandoned between chunks."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.last_report = run_retention(stop=self._stop)
+            except Exception as e:
+                logging.exception(f"Retention run failed: {e}")
+            self._stop.wait(self.interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete readings past their retention period and compact the database.")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the retention jobs")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="Switch the database to auto_vacuum=INCREMENTAL first (runs a full VACUUM)")
+    args = parser.parse_args()
+    try:
+        if args.enable_incremental_vacuum:
+            enable_incremental_vacuum()
+        print(json.dumps(run_retention(dry_run=args.dry_run), indent=2))
+    except sqlite3.Error as e:
+        logging.error(f"Retention failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,326 @@
+# rollups.py
+#
+# Continuous rollup tables for sensor readings.
+#
+# Every stored reading also updates one row per level in rollup_1m, rollup_1h and rollup_1d
+# (count, sum, min, max, first, last per sensor_id/type/bucket), in the same transaction as
+# the raw insert. Aggregate queries whose bucket is a multiple of a rollup level are then
+# answered from the coarsest matching rollup instead of scanning the raw readings.
+#
+# Rebuild the rollups from the raw readings (e.g. after enabling them on an existing
+# database) with:
+#     python rollups.py
+# Only buckets still covered by raw readings are rebuilt: rollups older than the oldest raw
+# reading of a series (e.g. kept after retention.py deleted the raw readings) are left as they are.
+# Stop serial_data_logger.py while it runs, or readings stored meanwhile may be counted twice.
+import argparse
+import logging
+import sqlite3
+import sys
+from datetime import datetime, timezone
+
+import config
+import db_pool
+import compact_schema
+from models import ReadingBatch
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# (name, bucket width in seconds), finest first
+LEVELS = [("1m", 60), ("1h", 3600), ("1d", 86400)]
+
+_ROLLUP_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS rollup_{name} (
+        sensor_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        sum_value REAL NOT NULL,
+        min_value REAL NOT NULL,
+        max_value REAL NOT NULL,
+        first_value REAL NOT NULL,
+        first_ts INTEGER NOT NULL,
+        last_value REAL NOT NULL,
+        last_ts INTEGER NOT NULL,
+        PRIMARY KEY (sensor_id, type, bucket)
+    ) WITHOUT ROWID
+'''
+# bucket is the bucket start in epoch seconds; first_ts/last_ts are epoch microseconds
+
+_META_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS rollup_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+'''
+
+# Merges a partial aggregate into the stored one. On equal timestamps the later
+# write wins for last_value, matching the raw tables' insertion-order tie-break.
+_UPSERT_SQL = '''
+    INSERT INTO rollup_{name}(sensor_id, type, bucket, count, sum_value, min_value, max_value,
+                              first_value, first_ts, last_value, last_ts)
+    VALUES(?,?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(sensor_id, type, bucket) DO UPDATE SET
+        count = count + excluded.count,
+        sum_value = sum_value + excluded.sum_value,
+        min_value = MIN(min_value, excluded.min_value),
+        max_value = MAX(max_value, excluded.max_value),
+        first_value = CASE WHEN excluded.first_ts < first_ts THEN excluded.first_value ELSE first_value END,
+        first_ts = MIN(first_ts, excluded.first_ts),
+        last_value = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last_value ELSE last_value END,
+        last_ts = MAX(last_ts, excluded.last_ts)
+'''
+
+
+def create_schema(cursor: sqlite3.Cursor):
+    """
+    Creates the rollup tables if they don't exist.
+
+    If the raw readings are still empty at that point, the rollups are complete by
+    construction and are marked usable; otherwise they stay unused until a backfill.
+    """
+    for name, _ in LEVELS:
+        cursor.execute(_ROLLUP_TABLE_SQL.format(name=name))
+    cursor.execute(_META_TABLE_SQL)
+    if cursor.execute("SELECT 1 FROM rollup_meta WHERE key = 'complete'").fetchone():
+        return
+    raw_table = "compact_readings" if config.DB_SCHEMA == "compact" else "sensor_readings"
+    if cursor.execute(f"SELECT 1 FROM {raw_table} LIMIT 1").fetchone() is None:
+        cursor.execute("INSERT INTO rollup_meta(key, value) VALUES('complete', '1')")
+    else:
+        logging.warning("Rollup tables are not populated for existing readings; run 'python rollups.py' "
+                        "to backfill them. Aggregates are computed from raw readings until then.")
+
+def mark_incomplete(cursor: sqlite3.Cursor):
+    """
+    Records that readings were stored without updating the rollups (ROLLUPS_ENABLED off), so
+    they aren't used again until a backfill. Call inside the same transaction as the raw insert.
+    """
+    try:
+        cursor.execute("DELETE FROM rollup_meta WHERE key = 'complete'")
+    except sqlite3.OperationalError:
+        pass # Rollup tables don't exist
+
+def is_complete(conn: sqlite3.Connection) -> bool:
+    """True if the rollups cover every stored reading (and can answer aggregate queries)."""
+    try:
+        return conn.execute("SELECT 1 FROM rollup_meta WHERE key = 'complete'").fetchone() is not None
+    except sqlite3.OperationalError:
+        return False # Rollup tables don't exist
+
+def _accumulate(partials: dict, key: tuple, ts: int, value: float):
+    """Folds one reading into the in-memory partial aggregate for key."""
+    agg = partials.get(key)
+    if agg is None:
+        partials[key] = [1, value, value, value, value, ts, value, ts]
+        return
+    agg[0] += 1
+    agg[1] += value
+    if value < agg[2]:
+        agg[2] = value
+    if value > agg[3]:
+        agg[3] = value
+    if ts < agg[5]:
+        agg[4], agg[5] = value, ts
+    if ts >= agg[7]:
+        agg[6], agg[7] = value, ts
+
+def _upsert_partials(cursor: sqlite3.Cursor, rows, skip: set | None = None) -> int:
+    """
+    Aggregates (sensor_id, type, ts_us, value) rows per level and upserts the result.
+
+    Args:
+        skip: (level name, sensor_id, type, bucket) keys whose rows are left out.
+
+    Returns:
+        int: The number of input rows processed.
+    """
+    partials = {name: {} for name, _ in LEVELS}
+    count = 0
+    for sensor_id, sensor_type, ts, value in rows:
+        seconds = ts // 1000000
+        for name, width in LEVELS:
+            key = (sensor_id, sensor_type, seconds - seconds % width)
+            if skip and (name,) + key in skip:
+                continue
+            _accumulate(partials[name], key, ts, value)
+        count += 1
+    for name, _ in LEVELS:
+        cursor.executemany(_UPSERT_SQL.format(name=name),
+                           [key + tuple(agg) for key, agg in partials[name].items()])
+    return count
+
+def apply(cursor: sqlite3.Cursor, readings: list):
+    """
+    Adds freshly stored readings (SensorReading objects or a ReadingBatch) to every
+    rollup level. Call inside the same transaction as the raw insert.
+    """
+    if not readings:
+        return
+    # A batch usually spans a few buckets per sensor, so this is a handful of upserts
+    if isinstance(readings, ReadingBatch):
+        _upsert_partials(cursor, readings.epoch_rows())
+        return
+    _upsert_partials(cursor, ((r.sensor_id, r.sensor_type, compact_schema.to_epoch_us(r.timestamp), r.value)
+                              for r in readings))
+
+
+# --- Query support ---
+
+def choose_level(bucket_seconds: int, start: datetime | None, end: datetime | None) -> tuple[str, int] | None:
+    """
+    Picks the coarsest rollup level that can answer an aggregate query exactly.
+
+    A level qualifies if the requested bucket is a whole multiple of it and the
+    start/end bounds (if given) fall on its bucket boundaries.
+
+    Returns:
+        (name, width_seconds), or None if the raw readings must be used.
+    """
+    for name, width in reversed(LEVELS):
+        if bucket_seconds % width:
+            continue
+        if any(bound is not None and (bound.timestamp() % width) for bound in (start, end)):
+            continue
+        return name, width
+    return None
+
+def build_aggregate_query(level: str, bucket_seconds: int, sensor_id: str | None, sensor_type: str | None,
+                          start: datetime | None, end: datetime | None) -> tuple[str, list]:
+    """
+    Builds the aggregate query over rollup_<level>, returning rows shaped like
+    data_processor's raw aggregate query:
+    (bucket_epoch, sensor_id, type, count, min, max, avg, first, last).
+    """
+    params = [bucket_seconds, bucket_seconds]
+    conditions = []
+    if sensor_id:
+        conditions.append("sensor_id = ?")
+        params.append(sensor_id)
+    if sensor_type:
+        conditions.append("type = ?")
+        params.append(sensor_type)
+    if start:
+        conditions.append("bucket >= ?")
+        params.append(int(start.timestamp()))
+    if end:
+        conditions.append("bucket < ?")
+        params.append(int(end.timestamp()))
+    where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+    query = (
+        "SELECT b, sensor_id, type, SUM(count), MIN(min_value), MAX(max_value), "
+        "SUM(sum_value) / SUM(count), MAX(fv), MAX(lv) "
+        "FROM (SELECT sensor_id, type, b, count, sum_value, min_value, max_value, "
+        "FIRST_VALUE(first_value) OVER (PARTITION BY sensor_id, type, b ORDER BY first_ts "
+        "ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS fv, "
+        "LAST_VALUE(last_value) OVER (PARTITION BY sensor_id, type, b ORDER BY last_ts "
+        "ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS lv "
+        "FROM (SELECT *, (bucket / ?) * ? AS b "
+        f"FROM rollup_{level}{where})) "
+        "GROUP BY sensor_id, type, b ORDER BY sensor_id, type, b"
+    )
+    return query, params
+
+
+# --- Backfill ---
+
+def _clear_covered_buckets(cursor: sqlite3.Cursor) -> set:
+    """
+    Deletes, per series and level, the rollup buckets that start at or after the series' oldest
+    raw reading, so they can be rebuilt from the raw readings. Older buckets (e.g. kept after
+    retention deleted their raw readings) stay.
+
+    Returns:
+        set: (level name, sensor_id, type, bucket) keys of the kept buckets that still contain
+             raw readings; their rows must not be folded in again.
+    """
+    if config.DB_SCHEMA == "compact":
+        series = cursor.execute("SELECT s.sensor_id, t.type, MIN(r.ts) FROM compact_readings r "
+                                "CROSS JOIN sensors s ON s.sensor_key = r.sensor_key "
+                                "CROSS JOIN types t ON t.type_key = r.type_key "
+                                "GROUP BY r.sensor_key, r.type_key").fetchall()
+    else:
+        series = [(sensor_id, sensor_type, compact_schema.iso_to_epoch_us(oldest)) for sensor_id, sensor_type, oldest in
+                  cursor.execute("SELECT sensor_id, type, MIN(timestamp) FROM sensor_readings GROUP BY sensor_id, type")]
+    skip = set()
+    for sensor_id, sensor_type, oldest_us in series:
+        for name, width in LEVELS:
+            bucket = oldest_us // 1000000 // width * width
+            covered = bucket if bucket * 1000000 == oldest_us else bucket + width # First bucket holding no deleted readings
+            cursor.execute(f"DELETE FROM rollup_{name} WHERE sensor_id = ? AND type = ? AND bucket >= ?",
+                           (sensor_id, sensor_type, covered))
+            if covered != bucket and cursor.execute(f"SELECT 1 FROM rollup_{name} WHERE sensor_id = ? AND type = ? AND bucket = ?",
+                                                    (sensor_id, sensor_type, bucket)).fetchone():
+                skip.add((name, sensor_id, sensor_type, bucket))
+    return skip
+
+def backfill(database: str = None, chunk_size: int = 50000) -> int:
+    """
+    Rebuilds every rollup level from the raw readings.
+
+    Buckets older than a series' oldest raw reading are kept, and so is an existing bucket
+    that starts before it (its earlier readings may have been deleted), so rollup history
+    beyond the raw retention window survives.
+
+    Args:
+        database: Database file. Defaults to config.DATABASE_NAME.
+        chunk_size: Raw rows read and folded in per transaction.
+
+    Returns:
+        int: The number of raw readings processed.
+    """
+    database = database or config.DATABASE_NAME
+    conn = db_pool.open_connection(database)
+    try:
+        cursor = conn.cursor()
+        create_schema(cursor)
+        cursor.execute("DELETE FROM rollup_meta WHERE key = 'complete'")
+        skip = _clear_covered_buckets(cursor)
+        conn.commit()
+
+        if config.DB_SCHEMA == "compact":
+            query = ("SELECT s.sensor_id, t.type, r.ts, r.value, r.sensor_key, r.ts, r.type_key "
+                     "FROM compact_readings r "
+                     "CROSS JOIN sensors s ON s.sensor_key = r.sensor_key "
+                     "CROSS JOIN types t ON t.type_key = r.type_key "
+                     "WHERE (r.sensor_key, r.ts, r.type_key) > (?, ?, ?) "
+                     "ORDER BY r.sensor_key, r.ts, r.type_key LIMIT ?")
+            position = [-1, -1, -1]
+        else:
+            query = ("SELECT sensor_id, type, timestamp, value, rowid FROM sensor_readings "
+                     "WHERE rowid > ? ORDER BY rowid LIMIT ?")
+            position = [-1]
+
+        processed = 0
+        while True:
+            rows = cursor.execute(query, position + [chunk_size]).fetchall()
+            if not rows:
+                break
+            position = list(rows[-1][4:])
+            if config.DB_SCHEMA == "compact":
+                processed += _upsert_partials(cursor, (row[:4] for row in rows), skip)
+            else:
+                processed += _upsert_partials(cursor, ((sensor_id, sensor_type, compact_schema.iso_to_epoch_us(ts), value)
+                                                       for sensor_id, sensor_type, ts, value, _ in rows), skip)
+            conn.commit()
+            logging.info(f"Rolled up {processed} readings")
+
+        cursor.execute("INSERT OR REPLACE INTO rollup_meta(key, value) VALUES('complete', ?)",
+                       (datetime.now(timezone.utc).isoformat(),))
+        conn.commit()
+        logging.info(f"Rollup backfill complete ({processed} readings).")
+        return processed
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the 1m/1h/1d rollup tables from the raw readings.")
+    parser.add_argument("--database", default=None, help="Database file (default: config.DATABASE_NAME)")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="Raw rows processed per transaction")
+    args = parser.parse_args()
+    try:
+        backfill(args.database, chunk_size=args.chunk_size)
+    except sqlite3.Error as e:
+        logging.error(f"Rollup backfill failed: {e}")
+        sys.exit(1)
@@ -1,110 +1,93 @@
 # serial_data_logger.py
-import time
+import json
 import logging
 import signal
 import sys
-import serial
+import time
 
 import config
-import serial_reader # Assuming serial_reader.py exists and has connect/read functions
+import ingest_pipeline # Reader, parser and batch writer stages connected by bounded queues
 import data_processor # Uses the updated data_processor
+import pubsub # Publishes readings to live subscribers on a local socket
+import retention # Deletes readings past their retention period
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Global flag to control the main loop
 running = True
+# Serial ingest pipeline (created in main)
+pipeline = None
 
 def signal_handler(sig, frame):
     """Handles termination signals gracefully."""
     global running
     logging.info("Termination signal received. Shutting down gracefully...")
     running = False
+    # Stop reading and get queued readings onto disk right away; main() does the final flush on exit
+    if pipeline:
+        pipeline.request_stop()
 
 # Register signal handlers for SIGINT (Ctrl+C) and SIGTERM
 signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
 def main():
-    """Main function to read from serial and store data."""
+    """Main function to read from the serial ports and store data."""
+    global pipeline
     logging.info("Starting Serial Data Logger...")
 
     # Initialize database (ensure table exists)
     data_processor.initialize_database()
 
-    ser = None
-    while running: # Loop until signal handler sets running to False
-        try:
-            if ser is None or not ser.is_open:
-                logging.info(f"Attempting to connect to serial port {config.SERIAL_PORT}...")
-                # Add a timeout (e.g., 1 second) to prevent blocking indefinitely if no data arrives
-                ser = serial.Serial(config.SERIAL_PORT, config.SERIAL_BAUD_RATE, timeout=1)
-
-                if ser:
-                    logging.info(f"Successfully connected to {config.SERIAL_PORT}.")
-                else:
-                    logging.warning(f"Failed to connect. Retrying in {config.SERIAL_RETRY_DELAY} seconds...")
-                    time.sleep(config.SERIAL_RETRY_DELAY)
-                    continue # Skip to the next iteration
-
-            # Read data
-            # Check if data is available (optional but good practice with timeout=0)
-            # Since we have a timeout in serial.Serial, readline() will wait
-            # if ser.in_waiting > 0: # You might or might not need this check depending on timeout behavior
-
-            line_bytes = ser.readline()  # Read bytes until newline or timeout
-
-            # Decode bytes to string. Use 'utf-8' typically.
-            # 'errors='ignore'' prevents crashing on weird bytes, but might hide issues.
-            # 'errors='replace'' is another option.
-            line = line_bytes.decode('utf-8', errors='ignore').strip()
-
-            logging.debug(f"Received line: {line_bytes}")  # Log raw bytes if needed for debugging
-
-            if line:
-                logging.debug(f"Received raw data: {line}")
-                # Parse the data using the updated processor function
-                sensor_reading = data_processor.parse_serial_data(line)
-
-                if sensor_reading:
-                    # Store the SensorReading object
-                    success = data_processor.store_reading(sensor_reading)
-                    if not success:
-                        logging.warning(f"Failed to store reading: {sensor_reading}")
-                # If parse_serial_data returned None, it logged the error already
-
-            else:
-                # No data received, maybe short timeout occurred, just loop again
-                pass
-
-        except serial.SerialException as e:
-            logging.error(f"Serial communication error: {e}")
-            if ser and ser.is_open:
-                ser.close()
-            ser = None # Force reconnection attempt
-            logging.info(f"Attempting reconnection in {config.SERIAL_RETRY_DELAY} seconds...")
-            time.sleep(config.SERIAL_RETRY_DELAY)
-        except KeyboardInterrupt: # Should be caught by signal handler, but good practice
-             logging.info("KeyboardInterrupt caught. Exiting.")
-             break # Exit the while loop
-        except Exception as e:
-            logging.exception(f"An unexpected error occurred: {e}") # Log full traceback
-            # Decide if to retry or exit on unexpected errors
-            time.sleep(5) # Wait a bit before retrying
+    # Optional retention/compaction thread (config.RETENTION_ENABLED)
+    retention_worker = None
+    if config.RETENTION_ENABLED:
+        retention_worker = retention.RetentionWorker()
+        retention_worker.start()
+
+    # Optional live readings hub (config.PUBSUB_ENABLED); logging goes on without it if the socket can't be opened
+    hub = None
+    if config.PUBSUB_ENABLED:
+        hub = pubsub.Hub()
+        if not hub.start():
+            hub = None
+
+    # Every port feeds the same pipeline; each one reconnects on its own.
+    # Reading, parsing and writing each run in their own thread.
+    pipeline = ingest_pipeline.IngestPipeline(hub=hub)
+    pipeline.start()
+    last_stats = time.monotonic()
+    try:
+        while running: # Loop until signal handler sets running to False
+            time.sleep(0.2)
+            if config.INGEST_STATS_INTERVAL and time.monotonic() - last_stats >= config.INGEST_STATS_INTERVAL:
+                last_stats = time.monotonic()
+                logging.info(f"Ingest pipeline: {json.dumps(pipeline.stats())}")
+    except KeyboardInterrupt: # Should be caught by signal handler, but good practice
+        logging.info("KeyboardInterrupt caught. Exiting.")
 
     # Cleanup
-    if ser and ser.is_open:
-        ser.close()
-        logging.info("Serial port closed.")
+    if retention_worker:
+        retention_worker.stop(timeout=10)
+    # Stop reading, then parse and write everything still queued before exiting
+    pipeline.stop()
+    logging.info(f"Ingest pipeline: {json.dumps(pipeline.stats())}")
+    if hub:
+        hub.close()
+    data_processor.close_connections()
     logging.info("Serial Data Logger stopped.")
 
 if __name__ == "__main__":
     # Add a check in config for required settings
-    required_configs = ['SERIAL_PORT', 'SERIAL_BAUD_RATE', 'DATABASE_NAME', 'ARDUINO_DATA_ORDER', 'ARDUINO_DATA_SEPARATOR']
+    required_configs = ['SERIAL_PORTS', 'SERIAL_BAUD_RATE', 'DATABASE_NAME', 'ARDUINO_DATA_ORDER', 'ARDUINO_DATA_SEPARATOR']
     missing_configs = [cfg for cfg in required_configs if not hasattr(config, cfg)]
     if missing_configs:
         logging.error(f"Configuration error: Missing required settings in config.py: {', '.join(missing_configs)}")
         sys.exit(1)
+    if not config.SERIAL_PORTS:
+        logging.error("Configuration error: SERIAL_PORTS is empty.")
+        sys.exit(1)
 
     if "Value" not in config.ARDUINO_DATA_ORDER or \
        "SensorID" not in config.ARDUINO_DATA_ORDER or \
@@ -3,10 +3,102 @@
 import serial
 import logging
 import time
-from config import SERIAL_PORT, SERIAL_BAUD_RATE, SERIAL_TIMEOUT
+from typing import Iterator
+from config import SERIAL_PORT, SERIAL_BAUD_RATE, SERIAL_TIMEOUT, SERIAL_MAX_LINE_LENGTH, SERIAL_READ_SIZE
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+class BufferedLineReader:
+    """
+    Splits a serial byte stream into lines using one preallocated buffer.
+
+    Feed it whatever a large read() returned; complete lines come back as memoryview
+    slices of the buffer (no copy per line) and a partial last line is kept for the next
+    feed. The buffer is never resized, only reused, so a slice is valid until the next
+    feed() call: convert it with bytes() if you need to keep it.
+    """
+    def __init__(self, max_line_length: int = None, read_size: int = None):
+        """
+        Initializes a BufferedLineReader instance.
+
+        Args:
+            max_line_length: Bytes without a newline before the partial line is discarded as
+                             noise. Defaults to config.SERIAL_MAX_LINE_LENGTH.
+            read_size: Largest chunk expected per feed(); bigger ones are split. Defaults
+                       to config.SERIAL_READ_SIZE.
+        """
+        self.max_line_length = max_line_length or SERIAL_MAX_LINE_LENGTH
+        self.read_size = read_size or SERIAL_READ_SIZE
+        self._buffer = bytearray(self.max_line_length + self.read_size)
+        self._view = memoryview(self._buffer)
+        self._length = 0 # Bytes of an unfinished line at the start of the buffer
+        self.discarded = 0 # Bytes dropped because no newline came within max_line_length
+
+    def feed(self, data: bytes) -> Iterator[memoryview]:
+        """
+        Adds received bytes and yields every line they complete, without the newline
+        (a trailing '\r' is left for the caller's strip()).
+        """
+        for offset in range(0, len(data), self.read_size):
+            yield from self._feed_chunk(data[offset:offset + self.read_size] if len(data) > self.read_size else data)
+
+    def _feed_chunk(self, chunk: bytes) -> Iterator[memoryview]:
+        buffer, view = self._buffer, self._view
+        end = self._length + len(chunk)
+        view[self._length:end] = chunk
+        start = 0
+        while True:
+            newline = buffer.find(b"\n", start, end)
+            if newline < 0:
+                break
+            yield view[start:newline]
+            start = newline + 1
+        remaining = end - start
+        if remaining > self.max_line_length:
+            # No newline for far too long: noise or wrong baud rate
+            self.discarded += remaining
+            remaining = 0
+        elif start and remaining:
+            view[0:remaining] = view[start:end] # Move the partial line to the front
+        self._length = remaining
+
+def iter_lines(serial_connection, duration: float = None) -> Iterator[str]:
+    """
+    Yields decoded, non-empty lines from an open serial connection.
+
+    Each read() takes everything the driver has buffered (or waits up to the port's
+    timeout for the first byte), and the lines are split by a BufferedLineReader.
+
+    Args:
+        serial_connection (serial.Serial): An active PySerial connection object.
+        duration: Stop after this many seconds. None reads until the port fails.
+
+    Yields:
+        str: Each line, decoded and stripped of whitespace.
+    """
+    reader = BufferedLineReader()
+    deadline = None if duration is None else time.monotonic() + duration
+    while deadline is None or time.monotonic() < deadline:
+        try:
+            data = serial_connection.read(serial_connection.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            logging.error(f"Serial error during read: {e}")
+            return
+        discarded = reader.discarded
+        for line in reader.feed(data):
+            raw = bytes(line).strip()
+            if not raw:
+                continue
+            try:
+                decoded_line = raw.decode('utf-8')
+            except UnicodeDecodeError:
+                decoded_line = raw.decode('ascii', errors='ignore')
+                logging.warning(f"Decoded with ASCII (potential data loss) from: {raw}")
+            logging.debug(f"Raw data received: '{decoded_line}'")
+            yield decoded_line
+        if reader.discarded > discarded:
+            logging.warning(f"Discarded {reader.discarded - discarded} bytes without a line ending.")
+
 def setup_serial_connection():
     """Attempts to establish a connection to the Arduino via serial."""
     ser = None
@@ -31,6 +123,7 @@ def setup_serial_connection():
 def read_line_from_serial(serial_connection):
     """
     Reads a single line of data from the provided serial connection.
+    (One readline() per call; iter_lines() reads in large chunks and is preferred.)
 
     Args:
         serial_connection (serial.Serial): An active PySerial connection object.
@@ -86,11 +179,8 @@ if __name__ == "__main__":
     if ser:
         print("Connection successful. Waiting for data for 10 seconds (Press Ctrl+C to stop)...")
         try:
-            for _ in range(100): # Read for ~10 seconds (100 * 0.1s)
-                data = read_line_from_serial(ser)
-                if data:
-                    print(f"Read: {data}")
-                time.sleep(0.1)
+            for data in iter_lines(ser, duration=10):
+                print(f"Read: {data}")
         except KeyboardInterrupt:
             print("\nStopping test.")
         finally:
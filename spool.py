@@ -0,0 +1,354 @@
+# spool.py
+#
+# Write-ahead spool for serial ingest.
+#
+# Raw serial lines are appended to segment files under INGEST_SPOOL_DIR before anything
+# else happens to them; a replayer thread then parses them and writes them into SQLite,
+# recording how far it got in a checkpoint file after every committed batch. A locked
+# database or a restart therefore only delays readings instead of losing them: the
+# replayer retries, and on startup it continues from the checkpoint.
+#
+# Segment files (NNNNNNNNNN.spool) are sequences of records:
+#     u32 line length | u32 CRC-32 of (timestamp + line) | i64 receive time (epoch us) | line bytes
+# A new segment is started on every start-up and whenever the current one reaches
+# INGEST_SPOOL_SEGMENT_BYTES; segments behind the checkpoint are deleted.
+# Replaying after a crash may write a batch a second time. When readings are timed by the
+# device clock (clock_sync.py), the checkpoint also holds the aligners' state as of that
+# position, so the batch gets the same timestamps again and the readings' primary key makes
+# the duplicates no-ops. (Without a device clock a reading's time is its receive time, which
+# is in the spool record.)
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import config
+import compact_schema
+import data_processor
+import fast_parser
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_RECORD = struct.Struct("<IIq")
+_SEGMENT_SUFFIX = ".spool"
+_CHECKPOINT_FILE = "checkpoint"
+
+
+def _segment_path(directory: str, seq: int) -> str:
+    return os.path.join(directory, f"{seq:010d}{_SEGMENT_SUFFIX}")
+
+def list_segments(directory: str) -> list[int]:
+    """Sequence numbers of the segment files in directory, oldest first."""
+    return sorted(int(name[:-len(_SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                  if name.endswith(_SEGMENT_SUFFIX) and name[:-len(_SEGMENT_SUFFIX)].isdigit())
+
+def encode_record(received_at: datetime, line: bytes) -> bytes:
+    """Packs one raw line and its receive time into a spool record."""
+    ts = compact_schema.to_epoch_us(received_at)
+    crc = zlib.crc32(line, zlib.crc32(struct.pack("<q", ts)))
+    return _RECORD.pack(len(line), crc, ts) + line
+
+def read_checkpoint(directory: str) -> tuple[int, int]:
+    """Returns the (segment, offset) the replayer has committed up to, (0, 0) if none."""
+    try:
+        with open(os.path.join(directory, _CHECKPOINT_FILE)) as f:
+            seq, offset = f.readline().split()
+            return int(seq), int(offset)
+    except (OSError, ValueError):
+        return 0, 0
+
+def read_clock_state(directory: str) -> dict | None:
+    """Returns the TimestampAligner state saved with the checkpoint, None if there is none."""
+    try:
+        with open(os.path.join(directory, _CHECKPOINT_FILE)) as f:
+            f.readline()
+            line = f.readline()
+        return json.loads(line) if line.strip() else None
+    except (OSError, ValueError):
+        return None
+
+def _write_checkpoint(directory: str, seq: int, offset: int, clock_state: str = None):
+    """Atomically replaces the checkpoint file (clock_state: aligner state as a JSON line)."""
+    path = os.path.join(directory, _CHECKPOINT_FILE)
+    with open(path + ".tmp", "w") as f:
+        f.write(f"{seq} {offset}\n")
+        if clock_state:
+            f.write(clock_state + "\n")
+        if config.INGEST_SPOOL_FSYNC:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+class Spool:
+    """
+    Append side of the spool. append() only buffers in memory; a flusher thread writes
+    the buffer with one sequential write (and fsync) every INGEST_SPOOL_FLUSH_INTERVAL.
+    """
+    def __init__(self, directory: str = None):
+        self.directory = directory or config.INGEST_SPOOL_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        segments = list_segments(self.directory)
+        # Never append to a segment from an earlier run: its tail may be torn
+        self.seq = (segments[-1] + 1) if segments else max(1, read_checkpoint(self.directory)[0])
+        self._file = open(_segment_path(self.directory, self.seq), "ab")
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock() # Serializes flush() between the thread and close()
+        self._stop = threading.Event()
+        self._thread = None
+        self.records = 0
+        self.bytes_written = 0
+        self.writes = 0
+
+    def start(self):
+        """Starts the flusher thread."""
+        self._thread = threading.Thread(target=self._run, name="SpoolFlusher", daemon=True)
+        self._thread.start()
+
+    def append(self, item: tuple):
+        """Buffers a (received_at, port, line_bytes) item from the serial reader. Never blocks on I/O."""
+        received_at, _port, line = item
+        # Stored as received: the reader already stripped ASCII lines, and binary frames must stay intact
+        record = encode_record(received_at, line)
+        with self._lock:
+            self._buffer += record
+            self.records += 1
+
+    def flush(self):
+        """
+        Writes everything buffered so far with a single write, rolling to a new segment if needed.
+
+        Raises:
+            OSError: If the write fails. The data stays buffered and is retried in a new
+                     segment (the failed write may have left a torn record behind).
+        """
+        with self._write_lock:
+            with self._lock:
+                if not self._buffer:
+                    return
+                data, self._buffer = bytes(self._buffer), bytearray()
+            try:
+                self._file.write(data)
+                self._file.flush()
+                if config.INGEST_SPOOL_FSYNC:
+                    os.fsync(self._file.fileno())
+            except OSError:
+                with self._lock:
+                    self._buffer[:0] = data
+                self._roll()
+                raise
+            self.bytes_written += len(data)
+            self.writes += 1
+            if self._file.tell() >= config.INGEST_SPOOL_SEGMENT_BYTES:
+                self._roll()
+
+    def _roll(self):
+        """Starts the next segment. The replayer only moves on once the old one is complete."""
+        try:
+            self._file.close()
+        except OSError:
+            pass
+        self.seq += 1
+        self._file = open(_segment_path(self.directory, self.seq), "ab")
+
+    def _run(self):
+        while not self._stop.wait(config.INGEST_SPOOL_FLUSH_INTERVAL):
+            try:
+                self.flush()
+            except OSError as e:
+                logging.error(f"Spool write failed (retrying): {e}")
+
+    def close(self):
+        """Stops the flusher thread after a final flush."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+        self._file.close()
+
+    def stats(self) -> dict:
+        return {"segment": self.seq, "records": self.records, "bytes_written": self.bytes_written, "writes": self.writes}
+
+
+class SpoolReplayer:
+    """
+    Thread that parses spooled lines and stores them in batches, checkpointing after
+    each committed batch. Database errors are retried; nothing is skipped.
+    """
+    def __init__(self, directory: str = None, batch_size: int = None, hub=None):
+        self.directory = directory or config.INGEST_SPOOL_DIR
+        self.hub = hub # pubsub.Hub to publish every parsed batch to before storing it, if any
+        self._published = None # (segment, offset) of the last batch published
+        os.makedirs(self.directory, exist_ok=True)
+        self.batch_size = batch_size or config.WRITE_BATCH_MAX_SIZE
+        self.seq, self.offset = read_checkpoint(self.directory)
+        # Device clock state as of the checkpoint, restored into the parser before the next batch
+        self._clock_state = read_clock_state(self.directory) or {}
+        self._clock_json = json.dumps(self._clock_state, separators=(",", ":")) if self._clock_state else None
+        self._file = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.started = None
+        self.replayed = 0 # Records processed (committed)
+        self.written = 0 # Readings stored
+        self.rejected = 0 # Lines that couldn't be parsed
+        self.corrupt = 0 # Segments abandoned because of a bad record
+        self.retries = 0 # Database errors retried
+
+    def start(self):
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="SpoolReplayer", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = None):
+        """Stops the thread once everything already in the spool has been stored."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    # --- Reading segments ---
+
+    def _open_current(self) -> bool:
+        """Opens the segment at the checkpoint (or the next existing one). False if there is none."""
+        if self._file:
+            return True
+        segments = [seq for seq in list_segments(self.directory) if seq >= self.seq]
+        if not segments:
+            return False
+        if segments[0] != self.seq:
+            self.seq, self.offset = segments[0], 0
+        self._file = open(_segment_path(self.directory, self.seq), "rb")
+        self._file.seek(self.offset)
+        return True
+
+    def _next_segment_exists(self) -> bool:
+        return any(seq > self.seq for seq in list_segments(self.directory))
+
+    def _advance_segment(self):
+        """Moves past the current (finished) segment and deletes it."""
+        self._file.close()
+        self._file = None
+        finished = self.seq
+        self.seq, self.offset = self.seq + 1, 0
+        _write_checkpoint(self.directory, self.seq, self.offset, self._clock_json)
+        try:
+            os.remove(_segment_path(self.directory, finished))
+        except OSError as e:
+            logging.warning(f"Could not delete spool segment {finished}: {e}")
+
+    def _read_batch(self) -> tuple[list, int]:
+        """
+        Reads up to batch_size complete records from the current position.
+
+        Returns:
+            (records, end_offset): records are (received_at_us, line) tuples; end_offset is
+            the position after the last one (in the current segment).
+        """
+        records = []
+        offset = self.offset
+        while len(records) < self.batch_size:
+            header = self._file.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                break
+            length, crc, ts = _RECORD.unpack(header)
+            line = self._file.read(length)
+            if len(line) < length:
+                break
+            if zlib.crc32(line, zlib.crc32(struct.pack("<q", ts))) != crc:
+                self.corrupt += 1
+                logging.error(f"Spool segment {self.seq} is corrupt at offset {offset}; skipping the rest of it.")
+                self._file.seek(0, os.SEEK_END)
+                return records, self._file.tell()
+            records.append((ts, line))
+            offset += _RECORD.size + length
+        self._file.seek(offset) # Re-read a partial record next time
+        return records, offset
+
+    # --- Replay ---
+
+    def _store(self, records: list) -> bool:
+        """Parses and stores records in one transaction. False on a database error."""
+        parser = fast_parser.get_parser()
+        aligner = getattr(parser, "aligner", None)
+        if aligner is not None and self._clock_state is not None:
+            aligner.restore(self._clock_state) # After a restart or a failed batch
+        # The receive time comes from the spool, not the parse time
+        batch = parser.parse_batch([line for _ts, line in records], timestamps=[ts for ts, _line in records])
+        if self.hub is not None and self._published != (self.seq, self.offset):
+            self.hub.publish(batch) # Once, not again when a failed batch is retried
+            self._published = (self.seq, self.offset)
+        try:
+            self.written += data_processor.store_readings(batch, raise_errors=True)
+        except sqlite3.Error:
+            # The retry must see the same state as this attempt
+            self._clock_state = json.loads(self._clock_json) if self._clock_json else {}
+            return False
+        self._clock_state = None
+        if aligner is not None:
+            self._clock_json = json.dumps(aligner.state(), separators=(",", ":"))
+        self.rejected += batch.rejected
+        return True
+
+    def replay_available(self) -> int:
+        """
+        Stores every complete record currently in the spool.
+
+        Returns:
+            int: Records processed, or -1 if the database failed (nothing was skipped).
+        """
+        processed = 0
+        while self._open_current():
+            records, end = self._read_batch()
+            if records:
+                if not self._store(records):
+                    self._file.seek(self.offset) # Retry the same records later
+                    return -1
+                self.offset = end
+                _write_checkpoint(self.directory, self.seq, self.offset, self._clock_json)
+                self.replayed += len(records)
+                processed += len(records)
+                continue
+            if end != self.offset:
+                self.offset = end # Corrupt tail skipped
+            # Nothing more here; a newer segment means this one is finished
+            if self._next_segment_exists():
+                self._advance_segment()
+                continue
+            break
+        return processed
+
+    def _run(self):
+        delay = config.INGEST_SPOOL_FLUSH_INTERVAL
+        while True:
+            stopping = self._stop.is_set()
+            processed = self.replay_available()
+            if processed < 0:
+                self.retries += 1
+                logging.warning(f"Spool replay: database unavailable, retrying in {delay:.1f}s.")
+                if self._stop.wait(delay):
+                    # Shutting down with the database still failing: the spool keeps the readings
+                    if self.replay_available() < 0:
+                        logging.error("Spool replay stopped with readings left in the spool; they are replayed on next start.")
+                        return
+                delay = min(delay * 2, config.SERIAL_RETRY_MAX_DELAY)
+                continue
+            delay = config.INGEST_SPOOL_FLUSH_INTERVAL
+            if stopping:
+                return # Stop was requested before this last pass, so everything spooled is stored
+            if processed == 0:
+                self._stop.wait(config.INGEST_SPOOL_FLUSH_INTERVAL)
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started if self.started else 0
+        return {"segment": self.seq, "offset": self.offset, "replayed": self.replayed, "written": self.written,
+                "rejected": self.rejected, "retries": self.retries, "corrupt_segments": self.corrupt,
+                "per_second": round(self.replayed / elapsed, 1) if elapsed else None}
@@ -43,9 +43,12 @@ def test_db(monkeypatch):
 
 
     # Clean up any old test database file before starting
-    if os.path.exists(db_path):
-        os.remove(db_path)
-        print(f"\nRemoved old test database: {db_path}")
+    # (pooled connections must be closed first, and WAL mode leaves -wal/-shm files)
+    data_processor.close_connections()
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"\nRemoved old test database file: {path}")
 
     # Initialize the database schema using the (now patched) config path
     try:
@@ -64,12 +67,12 @@ def test_db(monkeypatch):
     # Add a small delay/retry for cleanup on Windows potentially
     time.sleep(0.1)
     try:
-        if os.path.exists(db_path):
-            # Ensure connections are closed (in case of errors in tests)
-            # This is tricky as connections are function-scoped in data_processor
-            # Relying on Python's garbage collection or explicit close is ideal
-            os.remove(db_path)
-            print("Test database removed.")
+        # Ensure pooled connections are closed so the files can be removed
+        data_processor.close_connections()
+        for path in (db_path, db_path + "-wal", db_path + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        print("Test database removed.")
     except Exception as e:
         print(f"Warning: Could not remove test database {db_path}: {e}")
 
@@ -86,13 +89,23 @@ def api_client(test_db, monkeypatch):
     # Configure the app for testing
     api_server.app.config['TESTING'] = True
     api_server.app.config['DATABASE'] = test_db # Optional: Explicitly pass db path if app uses it
+    # Responses cached for a previous test's database must not leak into this one
+    api_server.cache.clear()
 
     # Create a test client
     with api_server.app.test_client() as client:
         yield client # Provide the test client to the test function
+    api_server.cache.clear()
 
     # Teardown (if any specific client teardown needed) happens automatically by exiting 'with'
 
+@pytest.fixture(scope="function")
+def compact_db(test_db, monkeypatch):
+    """Fixture that switches the test database to the compact integer-keyed schema."""
+    monkeypatch.setattr(config, 'DB_SCHEMA', 'compact')
+    data_processor.initialize_database()
+    yield test_db
+
 # --- Test Functions ---
 
 def test_database_initialization(test_db):
@@ -136,6 +149,41 @@ def test_parse_invalid_serial_data():
     assert data_processor.parse_serial_data("OnlyOnePart") is None
     # Test with different config order (if needed, use monkeypatch on config)
 
+@pytest.mark.parametrize("order, separator", [
+    (["SensorID", "SensorType", "Value"], ","),
+    (["Value", "Unit", "SensorType", "SensorID"], ";"),
+])
+def test_fast_parser_matches_parse_serial_data(monkeypatch, order, separator):
+    """The compiled parser accepts and rejects the same lines, as str or bytes, singly or in a batch."""
+    import compact_schema
+    import fast_parser
+    monkeypatch.setattr(config, "ARDUINO_DATA_ORDER", order)
+    monkeypatch.setattr(config, "ARDUINO_DATA_SEPARATOR", separator)
+    fields = {"SensorID": "PHProbe-Tank1", "SensorType": "pH", "Value": " 7.01", "Unit": "pH"}
+    lines = [separator.join(fields[name] for name in order) + "\r\n",
+             separator.join(fields[name] if name != "SensorID" else "" for name in order),
+             separator.join(fields[name] if name != "Value" else "NaNo" for name in order),
+             separator.join(fields[name] for name in order) + separator,
+             "OnlyOnePart", ""]
+    parser = fast_parser.get_parser()
+    assert fast_parser.get_parser() is parser # Compiled once per config
+
+    timestamp = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+    for line in lines:
+        expected = data_processor.parse_serial_data(line, timestamp=timestamp)
+        for raw in (line, line.encode("utf-8")):
+            reading = parser.parse(raw, timestamp=timestamp)
+            assert (reading is None) == (expected is None), raw
+            if expected:
+                assert reading.to_db_tuple() == expected.to_db_tuple()
+
+    ts = compact_schema.to_epoch_us(timestamp)
+    batch = parser.parse_batch([line.encode("utf-8") for line in lines], timestamps=[ts + i for i in range(len(lines))])
+    assert len(batch) == 1 and batch.rejected == len(lines) - 1
+    assert list(batch.timestamps) == [ts] and list(batch.values) == [7.01]
+    assert batch.sensor_names == ["PHProbe-Tank1"] and batch.type_names == ["pH"]
+    assert batch.to_readings()[0].to_db_tuple() == (timestamp.isoformat(), "PHProbe-Tank1", "pH", 7.01)
+
 def test_store_and_retrieve_reading(test_db):
     """Test storing a reading via data_processor and retrieving it directly."""
     now = datetime.now(timezone.utc)
@@ -292,4 +340,1190 @@ def test_simulated_logger_run(api_client, test_db):
 
     # Compare timestamp of the last retrieved item (oldest)
     retrieved_ts = datetime.fromisoformat(results[2]['timestamp'])
-    assert abs(retrieved_ts - stored_timestamps[0]) < timedelta(seconds=1)
\ No newline at end of file
+    assert abs(retrieved_ts - stored_timestamps[0]) < timedelta(seconds=1)
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs pseudo-terminals")
+def test_logger_stores_buffered_readings_on_sigterm(test_db, tmp_path):
+    """SIGTERM (docker stop) makes the logger write its pending batch before it exits."""
+    import signal
+    import subprocess
+    master, slave = os.openpty()
+    log_path = tmp_path / "logger.log"
+    env = dict(os.environ, DATABASE_NAME=test_db, SERIAL_PORTS=os.ttyname(slave), WRITE_BATCH_MAX_LATENCY="60",
+               INGEST_SPOOL_ENABLED="0", PUBSUB_ENABLED="0")
+    with open(log_path, "w") as log:
+        logger = subprocess.Popen([sys.executable, "serial_data_logger.py"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        deadline = time.monotonic() + 10
+        while "Successfully connected" not in log_path.read_text() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        os.write(master, b"".join(f"pH-1,pH,{i}\n".encode() for i in range(25)))
+        time.sleep(0.5)
+        assert data_processor.get_readings_from_db() == [] # Still waiting in the write batch
+        logger.send_signal(signal.SIGTERM)
+        assert logger.wait(timeout=10) == 0
+    finally:
+        if logger.poll() is None:
+            logger.kill()
+        os.close(master)
+        os.close(slave)
+    assert len(data_processor.get_readings_from_db(limit=100)) == 25
+
+
+def test_store_readings_batch_skips_only_duplicates(test_db):
+    """A duplicate key inside a batch should only drop that row, not the whole batch."""
+    now = datetime.now(timezone.utc)
+    batch = [
+        SensorReading("pH-1", "pH", 6.8, now),
+        SensorReading("pH-1", "pH", 6.9, now), # Same (timestamp, sensor_id, type) -> duplicate
+        SensorReading("EC-1", "EC", 1.4, now),
+    ]
+    stored = data_processor.store_readings(batch)
+    assert stored == 2
+
+    readings_out = data_processor.get_readings_from_db(limit=10)
+    assert len(readings_out) == 2
+    assert {r['sensor_id'] for r in readings_out} == {'pH-1', 'EC-1'}
+
+
+@pytest.mark.parametrize("schema", ["legacy", "compact"])
+def test_reading_batch_stores_like_sensor_readings(api_client, test_db, monkeypatch, schema):
+    """A ReadingBatch is stored, rolled up and serialized exactly like the equivalent SensorReading list."""
+    from models import ReadingBatch
+    monkeypatch.setattr(config, 'DB_SCHEMA', schema)
+    data_processor.initialize_database()
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    readings = [SensorReading(sensor, sensor_type, i / 4, base + timedelta(seconds=i, microseconds=i % 2))
+                for i in range(10) for sensor, sensor_type in (("pH-1", "pH"), ("EC-1", "EC"))]
+    batch = ReadingBatch.from_readings(readings)
+    assert len(batch) == 20 and batch.sensor_names == ["pH-1", "EC-1"]
+    assert batch.to_db_tuples() == [r.to_db_tuple() for r in readings]
+    assert batch.to_dicts() == [r.to_dict() for r in readings]
+    with pytest.raises(AttributeError):
+        readings[0].note = "no __dict__"
+
+    assert data_processor.store_readings(batch) == 20
+    assert data_processor.store_readings(ReadingBatch.from_readings(readings[:2])) == 0 # Duplicates skipped
+    stored = api_client.get('/readings?limit=100').json
+    key = lambda r: (r['timestamp'], r['sensor_id'])
+    assert sorted(stored, key=key) == sorted((r.to_dict() for r in readings), key=key)
+    latest = {(r['sensor_id'], r['type']): r['value'] for r in api_client.get('/readings/latest').json}
+    assert latest == {("pH-1", "pH"): 2.25, ("EC-1", "EC"): 2.25}
+
+    rows = list(data_processor.iter_reading_chunks())[0]
+    assert ReadingBatch.from_rows(rows).to_json() == api_client.get('/readings?limit=100').get_data(as_text=True).rstrip()
+
+
+def test_reading_batch_normalizes_timestamps_to_utc():
+    """ReadingBatch rows carry UTC (+00:00) timestamps even for naive or non-UTC readings."""
+    import compact_schema
+    import models
+    from models import ReadingBatch
+    assert compact_schema.to_epoch_us is models.to_epoch_us # Re-exported, not imported the other way
+    assert "compact_schema" not in vars(models)
+    local = datetime(2024, 1, 1, 14, 0, 0, 250, tzinfo=timezone(timedelta(hours=2)))
+    readings = [SensorReading("pH-1", "pH", 7.0, local), SensorReading("pH-1", "pH", 7.1, datetime(2024, 1, 1, 12, 0, 1))]
+    batch = ReadingBatch.from_readings(readings)
+    assert batch.iso_timestamps() == ["2024-01-01T12:00:00.000250+00:00", "2024-01-01T12:00:01+00:00"]
+    assert batch.to_db_tuples()[0] == ("2024-01-01T12:00:00.000250+00:00", "pH-1", "pH", 7.0)
+    assert [datetime.fromisoformat(d["timestamp"]) for d in batch.to_dicts()] == [local, datetime(2024, 1, 1, 12, 0, 1, tzinfo=timezone.utc)]
+    # Rows read back from the database keep their stored strings
+    assert ReadingBatch.from_rows([("2024-01-01T14:00:00+02:00", "pH-1", "pH", 7.0)]).to_db_tuples()[0][0] == "2024-01-01T14:00:00+02:00"
+
+
+def test_batch_writer_flushes_on_close(test_db):
+    """Readings submitted to the BatchWriter must all be stored once it is closed."""
+    import batch_writer
+
+    writer = batch_writer.BatchWriter(max_batch_size=4, max_latency=10)
+    writer.start()
+    start = datetime.now(timezone.utc)
+    for i in range(10):
+        writer.submit(SensorReading("Temp-1", "Water temperature", 20 + i, start + timedelta(seconds=i)))
+    writer.close(timeout=5)
+
+    assert writer.readings_written == 10
+    assert writer.batches_written == 3 # 4 + 4 + 2
+    assert len(data_processor.get_readings_from_db(limit=100)) == 10
+
+
+def test_connection_pool_reuses_connections_with_wal(api_client, test_db):
+    """Pooled connections should be reused across calls and run in WAL mode."""
+    data_processor.store_reading(SensorReading("pH-1", "pH", 7.0))
+    before = data_processor.get_pool_stats()
+    for _ in range(5):
+        data_processor.get_readings_from_db(limit=1)
+    after = data_processor.get_pool_stats()
+    assert after['hits'] - before['hits'] == 5
+    assert after['misses'] == before['misses']
+
+    with data_processor.db_pool.pool.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0].lower() == config.DB_JOURNAL_MODE.lower()
+
+    response = api_client.get('/status/db')
+    assert response.status_code == 200
+    assert response.json['pool']['hits'] >= 5
+
+
+def test_compact_schema_returns_same_shape(api_client, compact_db):
+    """The compact schema must be invisible to /readings clients."""
+    t1 = datetime.now(timezone.utc) - timedelta(minutes=5)
+    t2 = datetime.now(timezone.utc)
+    assert data_processor.store_reading(SensorReading("pH-1", "pH", 6.8, t1)) is True
+    assert data_processor.store_readings([
+        SensorReading("pH-1", "pH", 6.9, t2),
+        SensorReading("EC-1", "EC", 1.4, t2),
+        SensorReading("EC-1", "EC", 1.4, t2), # Duplicate
+    ]) == 2
+
+    # Nothing went into the legacy table
+    with sqlite3.connect(compact_db) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM compact_readings").fetchone()[0] == 3
+        assert conn.execute("SELECT COUNT(*) FROM sensors").fetchone()[0] == 2
+
+    response = api_client.get('/readings?sensor_id=pH-1')
+    assert response.status_code == 200
+    assert response.json == [
+        {"timestamp": t2.isoformat(), "sensor_id": "pH-1", "type": "pH", "value": 6.9},
+        {"timestamp": t1.isoformat(), "sensor_id": "pH-1", "type": "pH", "value": 6.8},
+    ]
+    assert len(api_client.get('/readings?type=EC').json) == 1
+    assert api_client.get('/readings?sensor_id=unknown').json == []
+
+
+def test_migrate_legacy_to_compact(test_db, monkeypatch):
+    """Migrating must preserve every reading exactly as the API returns it."""
+    import compact_schema
+
+    start = datetime.now(timezone.utc) - timedelta(hours=1)
+    data_processor.store_readings([
+        SensorReading(f"Sensor-{i % 3}", "pH" if i % 2 else "EC", i / 10, start + timedelta(seconds=i))
+        for i in range(25)
+    ])
+    before = data_processor.get_readings_from_db(limit=100)
+
+    assert compact_schema.migrate_from_legacy(test_db, batch_size=10) == 25
+    # Running it again is harmless
+    assert compact_schema.migrate_from_legacy(test_db, batch_size=10) == 25
+
+    monkeypatch.setattr(config, 'DB_SCHEMA', 'compact')
+    after = data_processor.get_readings_from_db(limit=100)
+    assert after == before
+
+
+@pytest.mark.parametrize("schema", ["legacy", "compact"])
+def test_database_setup_creates_every_table(tmp_path, monkeypatch, schema):
+    """database_setup creates the raw table of the configured schema plus the same auxiliary tables."""
+    import database_setup
+    db_path = str(tmp_path / "setup.db")
+    monkeypatch.setattr(config, 'DATABASE_NAME', db_path)
+    monkeypatch.setattr(config, 'DB_SCHEMA', schema)
+    monkeypatch.setattr(config, 'CHANGE_FEED_ENABLED', True)
+    database_setup.setup()
+    conn = sqlite3.connect(db_path)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    conn.close()
+    raw = {"sensor_readings"} if schema == "legacy" else {"sensors", "types", "compact_readings"}
+    assert tables == raw | {"rollup_1m", "rollup_1h", "rollup_1d", "rollup_meta", "latest_readings", "readings_feed"}
+
+
+def _page_through(api_client, url):
+    """Follows X-Next-Cursor until the last page; returns all readings and the page count."""
+    readings, pages, cursor = [], 0, None
+    while True:
+        response = api_client.get(url + (f"&cursor={cursor}" if cursor else ""))
+        assert response.status_code == 200
+        readings.extend(response.json)
+        pages += 1
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            return readings, pages
+
+
+@pytest.mark.parametrize("schema", ["legacy", "compact"])
+def test_api_cursor_pagination_and_time_range(api_client, test_db, monkeypatch, schema):
+    """Pages must cover every reading exactly once, newest first, within start/end."""
+    monkeypatch.setattr(config, 'DB_SCHEMA', schema)
+    data_processor.initialize_database()
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    # Two sensors share every timestamp, so the tie-breaker matters
+    data_processor.store_readings([
+        SensorReading(sensor, "pH", i, base + timedelta(minutes=i))
+        for i in range(12) for sensor in ("pH-1", "pH-2")
+    ])
+
+    readings, pages = _page_through(api_client, '/readings?limit=5')
+    assert pages == 5
+    assert len(readings) == 24
+    assert len({(r['timestamp'], r['sensor_id']) for r in readings}) == 24
+    assert [r['value'] for r in readings] == sorted((r['value'] for r in readings), reverse=True)
+
+    readings, _ = _page_through(api_client, '/readings?limit=3&sensor_id=pH-2')
+    assert [r['value'] for r in readings] == list(range(11, -1, -1))
+
+    start, end = (base + timedelta(minutes=3)).isoformat(), (base + timedelta(minutes=7)).isoformat()
+    readings, _ = _page_through(api_client, f'/readings?limit=3&type=pH&start={start}&end={end}'.replace('+', '%2B'))
+    assert sorted({r['value'] for r in readings}) == [3, 4, 5, 6]
+    assert len(readings) == 8
+
+    assert api_client.get('/readings?cursor=not-a-cursor').status_code == 400
+    assert api_client.get('/readings?start=yesterday').status_code == 400
+
+
+@pytest.mark.parametrize("schema", ["legacy", "compact"])
+def test_api_readings_batch(api_client, test_db, monkeypatch, schema):
+    """POST /readings/batch must return what /readings returns for each sensor, keyed by sensor."""
+    monkeypatch.setattr(config, 'DB_SCHEMA', schema)
+    data_processor.initialize_database()
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    data_processor.store_readings([
+        SensorReading(sensor, sensor_type, i, base + timedelta(minutes=i))
+        for i in range(10) for sensor, sensor_type in (("pH-1", "pH"), ("pH-2", "pH"), ("EC-1", "EC"))
+    ])
+
+    response = api_client.post('/readings/batch', json={"sensor_ids": ["pH-1", "EC-1", "unknown", "pH-1"], "limit": 4})
+    assert response.status_code == 200
+    assert sorted(response.json['readings']) == ["EC-1", "pH-1", "unknown"]
+    for sensor in ("pH-1", "EC-1"):
+        single = api_client.get(f'/readings?sensor_id={sensor}&limit=4')
+        assert response.json['readings'][sensor] == single.json
+        assert response.json['next_cursors'][sensor] == single.headers['X-Next-Cursor']
+    assert response.json['readings']['unknown'] == []
+    assert "unknown" not in response.json['next_cursors']
+
+    # Cursors page each sensor on; filters apply to every sensor
+    start = (base + timedelta(minutes=2)).isoformat()
+    response = api_client.post('/readings/batch', json={"sensor_ids": ["pH-1", "pH-2", "EC-1"], "limit": 4, "type": "pH",
+                                                         "start": start, "cursors": response.json['next_cursors']})
+    assert [r['value'] for r in response.json['readings']['pH-1']] == [5, 4, 3, 2]
+    assert [r['value'] for r in response.json['readings']['pH-2']] == [9, 8, 7, 6]
+    assert response.json['readings']['EC-1'] == []
+
+    assert api_client.post('/readings/batch', json={"sensor_ids": []}).status_code == 400
+    assert api_client.post('/readings/batch', json={"sensor_ids": "pH-1"}).status_code == 400
+    # An empty ID would match every sensor
+    assert api_client.post('/readings/batch', json={"sensor_ids": [""]}).status_code == 400
+    assert api_client.post('/readings/batch', json={"sensor_ids": ["pH-1", "  "]}).status_code == 400
+    with pytest.raises(ValueError):
+        data_processor.get_readings_batch(["pH-1", ""])
+    assert api_client.post('/readings/batch', json={"sensor_ids": ["pH-1"], "limit": True}).status_code == 400
+    assert api_client.post('/readings/batch', json={"sensor_ids": ["pH-1"], "limit": "4"}).status_code == 400
+    assert api_client.post('/readings/batch', json={"sensor_ids": ["pH-1"], "start": "yesterday"}).status_code == 400
+    assert api_client.post('/readings/batch', json={"sensor_ids": ["pH-1"], "cursors": {"pH-1": "x"}}).status_code == 400
+    assert api_client.post('/readings/batch', json={"sensor_ids": ["s"] * (config.BATCH_MAX_SENSORS + 1)}).status_code == 400
+    assert api_client.post('/readings/batch', data="not json").status_code == 400
+
+
+@pytest.mark.parametrize("schema", ["legacy", "compact"])
+def test_api_aggregate_buckets(api_client, test_db, monkeypatch, schema):
+    """/readings/aggregate must return min/max/avg/count/first/last per bucket and series."""
+    monkeypatch.setattr(config, 'DB_SCHEMA', schema)
+    data_processor.initialize_database()
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    readings = [SensorReading("pH-1", "pH", i, base + timedelta(minutes=10 * i)) for i in range(12)] # 2 hours
+    # Just before the 1h boundary: must stay in the first bucket despite the sub-ms fraction
+    readings.append(SensorReading("pH-1", "pH", 100, base + timedelta(minutes=59, seconds=59, microseconds=999999)))
+    readings.append(SensorReading("EC-1", "EC", 1.5, base + timedelta(minutes=5)))
+    data_processor.store_readings(readings)
+
+    response = api_client.get('/readings/aggregate?bucket=1h&sensor_id=pH-1')
+    assert response.status_code == 200
+    assert response.json == [
+        {"bucket": base.isoformat(), "sensor_id": "pH-1", "type": "pH",
+         "count": 7, "min": 0, "max": 100, "avg": 115 / 7, "first": 0, "last": 100},
+        {"bucket": (base + timedelta(hours=1)).isoformat(), "sensor_id": "pH-1", "type": "pH",
+         "count": 6, "min": 6, "max": 11, "avg": 8.5, "first": 6, "last": 11},
+    ]
+
+    start = (base + timedelta(minutes=30)).isoformat().replace('+', '%2B')
+    response = api_client.get(f'/readings/aggregate?bucket=1d&start={start}')
+    assert [(r['sensor_id'], r['count']) for r in response.json] == [("pH-1", 10)]
+
+    assert api_client.get('/readings/aggregate?bucket=1w').status_code == 400
+    assert api_client.get('/readings/aggregate').status_code == 400
+
+
+@pytest.mark.parametrize("schema", ["legacy", "compact"])
+def test_rollup_backfill_matches_raw_aggregates(test_db, monkeypatch, schema):
+    """Rollup-backed aggregates (incremental or backfilled) must equal raw-scan aggregates."""
+    import rollups
+
+    monkeypatch.setattr(config, 'DB_SCHEMA', schema)
+    monkeypatch.setattr(config, 'ROLLUPS_ENABLED', False)
+    data_processor.initialize_database()
+    # Simulate a database created before rollups existed
+    with sqlite3.connect(test_db) as conn:
+        for table in ("rollup_1m", "rollup_1h", "rollup_1d", "rollup_meta"):
+            conn.execute(f"DROP TABLE {table}")
+    base = datetime(2024, 3, 1, 22, tzinfo=timezone.utc)
+    readings = [SensorReading(f"Temp-{i % 2}", "Water temperature", (i * 7) % 23, base + timedelta(seconds=97 * i))
+                for i in range(200)] # ~5.4 hours, crosses midnight
+    data_processor.store_readings(readings[:100])
+    queries = [(60, None, None), (3600, None, None), (86400, None, None), (7200, base, base + timedelta(hours=4))]
+
+    # Enable rollups on the existing data: not used until backfilled
+    monkeypatch.setattr(config, 'ROLLUPS_ENABLED', True)
+    data_processor.initialize_database()
+    with data_processor.db_pool.pool.connection() as conn:
+        assert not rollups.is_complete(conn)
+    assert rollups.backfill(test_db) == 100
+
+    # The rest arrives through the ingest path and is rolled up incrementally
+    data_processor.store_readings(readings[100:])
+    monkeypatch.setattr(config, 'ROLLUPS_ENABLED', False)
+    expected = [data_processor.get_aggregated_readings(b, start=s, end=e) for b, s, e in queries]
+    monkeypatch.setattr(config, 'ROLLUPS_ENABLED', True)
+    actual = [data_processor.get_aggregated_readings(b, start=s, end=e) for b, s, e in queries]
+
+    for exp, act in zip(expected, actual):
+        assert len(exp) == len(act) > 0
+        for e, a in zip(exp, act):
+            assert a == pytest.approx(e)
+    with sqlite3.connect(test_db) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM rollup_1d").fetchone()[0] == 4 # 2 sensors x 2 days
+
+
+@pytest.mark.parametrize("schema", ["legacy", "compact"])
+def test_retention_deletes_old_raw_readings_in_chunks(test_db, monkeypatch, schema):
+    """Retention must honour per-type policies, delete in chunks and keep rollups."""
+    import retention
+
+    monkeypatch.setattr(config, 'DB_SCHEMA', schema)
+    data_processor.initialize_database()
+    monkeypatch.setattr(config, 'RETENTION_POLICIES', {"*": 14, "pH": 30})
+    monkeypatch.setattr(config, 'RETENTION_CHUNK_SIZE', 7)
+    monkeypatch.setattr(config, 'RETENTION_CHUNK_PAUSE', 0)
+    now = datetime.now(timezone.utc)
+    data_processor.store_readings(
+        [SensorReading("pH-1", "pH", d, now - timedelta(days=d)) for d in range(40)] +
+        [SensorReading("EC-1", "EC", d, now - timedelta(days=d, hours=1)) for d in range(40)])
+
+    report = retention.run_retention()
+    assert report["rows_deleted"] == {"raw pH > 30d": 10, "raw * > 14d": 26}
+    remaining = data_processor.get_readings_from_db(limit=1000)
+    assert len([r for r in remaining if r['type'] == 'pH']) == 30
+    assert len([r for r in remaining if r['type'] == 'EC']) == 14
+
+    # Daily rollups still cover the deleted range
+    daily = data_processor.get_aggregated_readings(86400, sensor_type="EC")
+    assert sum(bucket['count'] for bucket in daily) == 40
+
+
+@pytest.mark.parametrize("schema", ["legacy", "compact"])
+def test_rollup_backfill_keeps_history_beyond_retention(test_db, monkeypatch, schema):
+    """A backfill after retention rebuilds only what raw readings cover and keeps older rollups."""
+    import retention
+    import rollups
+
+    monkeypatch.setattr(config, 'DB_SCHEMA', schema)
+    data_processor.initialize_database()
+    monkeypatch.setattr(config, 'RETENTION_POLICIES', {"*": 14, "pH": 30})
+    monkeypatch.setattr(config, 'RETENTION_CHUNK_PAUSE', 0)
+    now = datetime.now(timezone.utc)
+    # Every 5 hours, so the retention cutoffs fall inside rollup buckets
+    data_processor.store_readings(
+        [SensorReading("pH-1", "pH", i, now - timedelta(hours=5 * i)) for i in range(200)] +
+        [SensorReading("EC-1", "EC", i, now - timedelta(hours=5 * i, minutes=1)) for i in range(200)])
+    retention.run_retention()
+    remaining = len(data_processor.get_readings_from_db(limit=1000))
+    assert remaining < 400
+
+    levels = (60, 3600, 86400, 7 * 86400)
+    before = [data_processor.get_aggregated_readings(width) for width in levels]
+    assert rollups.backfill(test_db) == remaining
+    after = [data_processor.get_aggregated_readings(width) for width in levels]
+    assert after == before
+    assert sum(bucket['count'] for bucket in after[2]) == 400
+
+
+def test_rollups_unused_after_readings_stored_with_them_disabled(test_db, monkeypatch):
+    """Readings stored while ROLLUPS_ENABLED was off keep aggregates on raw readings until a backfill."""
+    import rollups
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    data_processor.store_readings([SensorReading("pH-1", "pH", i, base + timedelta(minutes=i)) for i in range(10)])
+    monkeypatch.setattr(config, 'ROLLUPS_ENABLED', False)
+    data_processor.store_readings([SensorReading("pH-1", "pH", i, base + timedelta(minutes=i)) for i in range(10, 20)])
+    assert data_processor.store_reading(SensorReading("pH-1", "pH", 20, base + timedelta(minutes=20)))
+    expected = data_processor.get_aggregated_readings(3600)
+    assert expected[0]["count"] == 21
+
+    monkeypatch.setattr(config, 'ROLLUPS_ENABLED', True)
+    with data_processor.db_pool.pool.connection() as conn:
+        assert not rollups.is_complete(conn)
+    assert data_processor.get_aggregated_readings(3600) == expected
+    rollups.backfill(test_db)
+    with data_processor.db_pool.pool.connection() as conn:
+        assert rollups.is_complete(conn)
+    assert data_processor.get_aggregated_readings(3600) == expected
+
+
+@pytest.mark.parametrize("schema", ["legacy", "compact"])
+def test_api_latest_readings(api_client, test_db, monkeypatch, schema):
+    """/readings/latest must return the newest reading per (sensor_id, type), even for out-of-order writes."""
+    monkeypatch.setattr(config, 'DB_SCHEMA', schema)
+    data_processor.initialize_database()
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    data_processor.store_readings([SensorReading("pH-1", "pH", i, base + timedelta(minutes=i)) for i in range(5)])
+    data_processor.store_reading(SensorReading("EC-1", "EC", 1.2, base))
+    data_processor.store_reading(SensorReading("pH-1", "pH", -1, base - timedelta(hours=1))) # Late, older reading
+
+    response = api_client.get('/readings/latest')
+    assert response.status_code == 200
+    assert response.json == [
+        {"timestamp": base.isoformat(), "sensor_id": "EC-1", "type": "EC", "value": 1.2},
+        {"timestamp": (base + timedelta(minutes=4)).isoformat(), "sensor_id": "pH-1", "type": "pH", "value": 4},
+    ]
+    # Same answer as the newest row of /readings
+    assert response.json[1] == api_client.get('/readings?sensor_id=pH-1&limit=1').json[0]
+    assert [r['sensor_id'] for r in api_client.get('/readings/latest?type=EC').json] == ["EC-1"]
+
+
+def test_latest_readings_filled_from_existing_data(test_db):
+    """Creating latest_readings on a database with readings must fill it from the raw table."""
+    now = datetime.now(timezone.utc)
+    data_processor.store_readings([SensorReading("T-1", "Air temperature", v, now + timedelta(seconds=v)) for v in range(3)])
+    with sqlite3.connect(test_db) as conn:
+        conn.execute("DROP TABLE latest_readings")
+    data_processor.initialize_database()
+    assert [r['value'] for r in data_processor.get_latest_readings()] == [2]
+
+
+def test_api_response_cache_and_etag(api_client, test_db):
+    """Identical polls are served from the cache until a write, and If-None-Match gets a 304."""
+    import api_server
+    now = datetime.now(timezone.utc)
+    data_processor.store_reading(SensorReading("pH-1", "pH", 7.0, now))
+
+    first = api_client.get('/readings?sensor_id=pH-1&limit=5')
+    assert first.status_code == 200 and first.headers['ETag']
+    # Same parameters in a different order hit the same entry
+    hits = api_server.cache.stats()['hits']
+    second = api_client.get('/readings?limit=5&sensor_id=pH-1')
+    assert second.json == first.json and second.headers['ETag'] == first.headers['ETag']
+    assert api_server.cache.stats()['hits'] == hits + 1
+
+    not_modified = api_client.get('/readings?sensor_id=pH-1&limit=5', headers={'If-None-Match': first.headers['ETag']})
+    assert not_modified.status_code == 304 and not_modified.data == b''
+
+    # A write invalidates the entry: new body, new ETag, full 200 for the old ETag
+    data_processor.store_reading(SensorReading("pH-1", "pH", 7.1, now + timedelta(seconds=1)))
+    changed = api_client.get('/readings?sensor_id=pH-1&limit=5', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert [r['value'] for r in changed.json] == [7.1, 7.0]
+    assert changed.headers['ETag'] != first.headers['ETag']
+    assert api_server.cache.stats()['invalidations'] >= 1
+
+    # Errors are not cached
+    assert api_client.get('/readings?start=nonsense').status_code == 400
+    assert api_client.get('/status/db').json['response_cache']['entries'] == 1
+
+
+@pytest.mark.parametrize("schema", ["legacy", "compact"])
+def test_api_export_streams_ndjson_and_csv(api_client, test_db, monkeypatch, schema):
+    """/readings/export returns every matching reading across chunks, as NDJSON, CSV or gzip."""
+    import csv
+    import gzip
+    import io
+    import json
+    monkeypatch.setattr(config, 'DB_SCHEMA', schema)
+    monkeypatch.setattr(config, 'EXPORT_CHUNK_SIZE', 7) # Force several chunks
+    data_processor.initialize_database()
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    data_processor.store_readings([SensorReading("pH-1", "pH", i, base + timedelta(seconds=i)) for i in range(30)])
+    data_processor.store_readings([SensorReading("EC-1", "EC", i, base + timedelta(seconds=i)) for i in range(5)])
+
+    response = api_client.get('/readings/export?type=pH')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [r['value'] for r in rows] == list(range(29, -1, -1)) # No gaps or repeats at chunk edges
+    assert rows[0] == api_client.get('/readings?type=pH&limit=1').json[0]
+
+    response = api_client.get(f'/readings/export?format=csv&gzip=1&start={(base + timedelta(seconds=3)).isoformat().replace("+", "%2B")}')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.data).decode())))
+    assert len(rows) == 27 + 2
+    assert rows[0] == {"timestamp": (base + timedelta(seconds=29)).isoformat(), "sensor_id": "pH-1", "type": "pH", "value": "29.0"}
+
+    assert api_client.get('/readings/export?format=csv&sensor_id=nope').data.decode() == "timestamp,sensor_id,type,value\n"
+    assert api_client.get('/readings/export?format=xml').status_code == 400
+
+
+@pytest.mark.parametrize("schema", ["legacy", "compact"])
+def test_api_export_columnar_round_trip(api_client, test_db, monkeypatch, schema):
+    """format=columnar must decode to the same readings as the NDJSON export."""
+    import json
+    import columnar
+    import compact_schema
+    monkeypatch.setattr(config, 'DB_SCHEMA', schema)
+    monkeypatch.setattr(config, 'EXPORT_CHUNK_SIZE', 4) # Names first seen in later batches, too
+    data_processor.initialize_database()
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    data_processor.store_readings([SensorReading("pH-1", "pH", 7 + i / 100, base + timedelta(seconds=i)) for i in range(10)])
+    data_processor.store_readings([SensorReading("Temp-é", "Water temperature", 20.5, base - timedelta(hours=1))])
+
+    response = api_client.get('/readings/export?format=columnar')
+    assert response.status_code == 200 and response.mimetype == columnar.MIMETYPE
+    columns = columnar.decode(response.data)
+    decoded = [{"timestamp": compact_schema.format_epoch_us(int(ts)), "sensor_id": columns["sensors"][s],
+                "type": columns["types"][t], "value": v}
+               for ts, s, t, v in zip(columns["timestamp_us"], columns["sensor_index"],
+                                      columns["type_index"], columns["value"])]
+    expected = [json.loads(line) for line in api_client.get('/readings/export').data.decode().splitlines()]
+    assert decoded == expected and len(decoded) == 11
+
+    empty = columnar.decode(api_client.get('/readings/export?format=columnar&sensor_id=nope').data)
+    assert len(empty["timestamp_us"]) == 0 and empty["sensors"] == []
+    with pytest.raises(ValueError):
+        columnar.decode(response.data[:-12])
+
+    # Names longer than 64 KiB; a name cut off mid-way is reported, not read short
+    encoder = columnar.ColumnarEncoder()
+    long_name = "s" * 70000
+    stream = encoder.header() + encoder.batch([(0, long_name, "pH", 1.0)]) + encoder.end()
+    assert columnar.decode(stream)["sensors"] == [long_name]
+    with pytest.raises(ValueError):
+        columnar.decode(stream[:1000])
+    # Version 1 streams (u16 name fields) still decode
+    import struct
+    v1 = (struct.pack("<4sB3x", b"RCOL", 1) + struct.pack("<IHH", 1, 1, 1) + struct.pack("<H", 3) + b"pH1"
+          + struct.pack("<H", 2) + b"pH" + b"\0" * 7 + struct.pack("<qdII", 5, 7.5, 0, 0) + struct.pack("<IHH", 0, 0, 0))
+    old = columnar.decode(v1)
+    assert (old["sensors"], old["types"], list(old["value"])) == (["pH1"], ["pH"], [7.5])
+
+
+def _wait_for(condition, timeout=5.0):
+    """Polls condition() until it is true or timeout seconds pass."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs pseudo-terminals")
+def test_buffered_line_reader_splits_chunks():
+    """Lines split across reads, CRLF endings and overlong noise are handled with one reused buffer."""
+    import serial
+    import serial_reader
+    reader = serial_reader.BufferedLineReader(max_line_length=16, read_size=8)
+    stream = b"pH-1,pH,7.0\r\nEC-1,EC,1.2\n" + b"x" * 40 + b"\nT-1,Temp,2" + b"5.5\n"
+    lines = [bytes(line) for i in range(0, len(stream), 5) for line in reader.feed(stream[i:i + 5])]
+    assert lines == [b"pH-1,pH,7.0\r", b"EC-1,EC,1.2", b"", b"T-1,Temp,25.5"] # The noise is dropped
+    assert reader.discarded == 40
+    assert [bytes(line) for line in reader.feed(b"a\nb\n" * 10)] == [b"a", b"b"] * 10 # Larger than read_size
+
+    master, slave = os.openpty()
+    try:
+        ser = serial.Serial(os.ttyname(slave), timeout=0.1)
+        os.write(master, b"pH-1,pH,7.0\r\n\r\nEC-1,EC,1.2\npartial")
+        assert list(serial_reader.iter_lines(ser, duration=0.5)) == ["pH-1,pH,7.0", "EC-1,EC,1.2"]
+        ser.close()
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs pseudo-terminals")
+def test_ingest_engine_reads_several_ports(monkeypatch, tmp_path):
+    """Two pty "Arduinos" are read concurrently; a missing or unplugged port doesn't stall the others."""
+    import ingest_engine
+    monkeypatch.setattr(config, 'SERIAL_RETRY_DELAY', 0.05)
+    monkeypatch.setattr(config, 'SERIAL_RETRY_MAX_DELAY', 0.2)
+    masters, slaves, ports = [], [], []
+    for _ in range(2):
+        master, slave = os.openpty()
+        masters.append(master)
+        slaves.append(slave)
+        ports.append(os.ttyname(slave))
+    received = []
+    engine = ingest_engine.IngestEngine(sink=received.append, ports=ports + [str(tmp_path / "no-such-port")])
+    engine.start()
+    try:
+        assert _wait_for(lambda: all(s["connected"] for s in engine.stats()[:2]))
+        os.write(masters[0], b"pH-1,pH,7.0\npH-1,pH,7.")     # Second line arrives in two pieces
+        os.write(masters[1], b"EC-1,EC,1.5\r\ngarbage\n")
+        os.write(masters[0], b"1\n")
+        assert _wait_for(lambda: len(received) == 3)
+        assert sorted((r.sensor_id, r.value) for r in received) == [("EC-1", 1.5), ("pH-1", 7.0), ("pH-1", 7.1)]
+
+        # Unplug the first Arduino: the second keeps delivering
+        os.close(masters[0])
+        masters[0] = None
+        os.write(masters[1], b"EC-1,EC,1.6\n")
+        assert _wait_for(lambda: len(received) == 4 and not engine.stats()[0]["connected"])
+
+        first, second, missing = engine.stats()
+        assert second["lines"] == 3 and second["readings"] == 2 and second["rejected"] == 1
+        assert missing["connects"] == 0 and missing["errors"] >= 1
+    finally:
+        engine.stop(timeout=5)
+        for fd in masters + slaves:
+            if fd is not None:
+                os.close(fd)
+    assert not any(s["connected"] for s in engine.stats())
+
+
+def test_pipeline_queue_overflow_policies(tmp_path):
+    """drop_oldest bounds memory by dropping; spill keeps every item, in order."""
+    import queue
+    import ingest_pipeline
+    q = ingest_pipeline.PipelineQueue("lines", 3, "drop_oldest")
+    assert [q.put(i) for i in range(5)] == [True, True, True, False, False]
+    assert [q.get_nowait() for _ in range(3)] == [2, 3, 4] and q.stats()["dropped"] == 2
+
+    q = ingest_pipeline.PipelineQueue("lines", 3, "spill", spill_dir=str(tmp_path))
+    for i in range(10):
+        q.put(i)
+    q.put_control("stop")
+    assert q.stats()["depth"] == 3 and q.stats()["spill_depth"] == 7 and q.qsize() == 10
+    assert [q.get_nowait() for _ in range(4)] == [0, 1, 2, 3]
+    q.put(10)
+    # Control items come after everything queued before them, spilled ones included
+    assert [q.get_nowait() for _ in range(q.qsize() + 1)] == [4, 5, 6, 7, 8, 9, 10, "stop"]
+    with pytest.raises(queue.Empty):
+        q.get(timeout=0.01)
+    assert os.path.getsize(tmp_path / "lines.spill") == 0 # Emptied spill files are truncated
+    q.close()
+    with pytest.raises(ValueError):
+        ingest_pipeline.PipelineQueue("lines", 3, "sometimes")
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs pseudo-terminals")
+@pytest.mark.parametrize("policy", ["block", "spill"])
+def test_ingest_pipeline_stores_everything_read(test_db, monkeypatch, tmp_path, policy):
+    """Lines go reader -> parser -> writer through small bounded queues without loss."""
+    import ingest_pipeline
+    monkeypatch.setattr(config, 'INGEST_LINE_QUEUE_SIZE', 5)
+    monkeypatch.setattr(config, 'INGEST_READING_QUEUE_SIZE', 5)
+    monkeypatch.setattr(config, 'INGEST_SPILL_DIR', str(tmp_path))
+    master, slave = os.openpty()
+    pipeline = ingest_pipeline.IngestPipeline(ports=[os.ttyname(slave)], policy=policy, use_spool=False)
+    pipeline.start()
+    try:
+        assert _wait_for(lambda: pipeline.reader.stats()[0]["connected"])
+        os.write(master, b"".join(f"pH-{i},pH,{i}\n".encode() for i in range(200)) + b"bad line\n")
+        assert _wait_for(lambda: pipeline.stats()["writer"]["written"] == 200)
+    finally:
+        pipeline.stop(timeout=5)
+        os.close(master)
+        os.close(slave)
+    stats = pipeline.stats()
+    assert stats["reader"]["lines"] == 201 and stats["parser"]["rejected"] == 1
+    assert stats["line_queue"]["dropped"] == stats["reading_queue"]["dropped"] == 0
+    assert len(data_processor.get_readings_from_db(limit=1000)) == 200
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs pseudo-terminals")
+@pytest.mark.parametrize("use_spool", [True, False])
+def test_pubsub_hub_publishes_readings_as_stored(test_db, monkeypatch, tmp_path, use_spool):
+    """Parsed readings reach matching subscribers exactly as they are stored; a slow subscriber loses its oldest, counted."""
+    import itertools
+    import ingest_pipeline
+    import pubsub
+    import stat
+    monkeypatch.setattr(config, 'INGEST_SPOOL_DIR', str(tmp_path / "spool"))
+    # Timed by the device clock, so the published timestamps must come from the same parse as the stored ones
+    monkeypatch.setattr(config, 'ARDUINO_DATA_ORDER', ["SensorID", "SensorType", "Value", "DeviceTime"])
+    # Without the spool nothing is stored until stop()
+    monkeypatch.setattr(config, 'WRITE_BATCH_MAX_LATENCY', 60)
+    hub = pubsub.Hub(str(tmp_path / "h.sock"), buffer_size=30)
+    assert hub.start()
+    assert stat.S_IMODE(os.stat(tmp_path / "h.sock").st_mode) == 0o660
+    master, slave = os.openpty()
+    pipeline = ingest_pipeline.IngestPipeline(ports=[os.ttyname(slave)], use_spool=use_spool, hub=hub)
+    pipeline.start()
+    try:
+        # Read while nobody is subscribed; it still sets the device clock offset of pH-1
+        assert _wait_for(lambda: pipeline.reader.stats()[0]["connected"])
+        os.write(master, b"pH-1,pH,-1,0\n")
+        assert _wait_for(lambda: pipeline.stats()["reader"]["lines"] == 1)
+        time.sleep(0.3)
+        with pubsub.Subscriber(sensor_type="pH", path=hub.path, timeout=5) as ph, \
+             pubsub.Subscriber(sensor_id=["EC-1", "EC-2"], path=hub.path, timeout=5) as ec:
+            os.write(master, b"".join(f"pH-1,pH,{i},{1 + i // 2}\nEC-{i % 3},EC,{i},{1 + i // 2}\n".encode() for i in range(20)) + b"bad line\n")
+            published = list(itertools.islice(ph, 20))
+            assert [r['value'] for r in published] == list(range(20))
+            assert [r['value'] for r in itertools.islice(ec, 13)] == [i for i in range(20) if i % 3]
+            if not use_spool:
+                assert len(data_processor.get_readings_from_db()) <= 1 # Published before it is stored
+
+            with pubsub.Subscriber(path=hub.path, timeout=5) as slow:
+                hub.publish([SensorReading("pH-9", "pH", i) for i in range(50)])
+                assert [r['value'] for r in itertools.islice(slow, 30)] == list(range(20, 50))
+                assert slow.dropped == 20
+                assert [c["dropped"] for c in hub.stats()["subscribers"]] == [20, 0, 20] # ph's buffer overflowed too
+    finally:
+        pipeline.stop(timeout=5)
+        hub.close()
+        os.close(master)
+        os.close(slave)
+    assert not os.path.exists(hub.path)
+    # Published exactly as stored
+    stored = data_processor.get_readings_from_db(limit=100, sensor_type="pH")
+    assert sorted((r['timestamp'], r['value']) for r in stored)[1:] == [(r['timestamp'], r['value']) for r in published]
+    assert len(data_processor.get_readings_from_db(limit=100)) == 41
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs pseudo-terminals")
+def test_binary_protocol_frames_through_spool(test_db, monkeypatch, tmp_path):
+    """Binary frames are decoded across read boundaries, corrupt ones are counted, and the rest are stored."""
+    import binary_protocol
+    import ingest_pipeline
+    monkeypatch.setattr(config, 'SERIAL_PROTOCOL', 'binary')
+    monkeypatch.setattr(config, 'INGEST_SPOOL_DIR', str(tmp_path))
+    frames = [binary_protocol.encode_frame(i % 3, i % 3, 7.01 + i, 1000 * i) for i in range(30)]
+    corrupt = bytearray(frames[5])
+    corrupt[4] ^= 0xFF # Flipped bits in the value
+    stream = b"noise" + b"".join(frames[:5]) + bytes(corrupt) + b"".join(frames[6:])
+
+    decoder = binary_protocol.FrameDecoder()
+    decoded = [frame for i in range(0, len(stream), 7) for frame in decoder.feed(stream[i:i + 7])]
+    assert decoded == frames[:5] + frames[6:]
+    assert decoder.stats() == {"frames": 29, "crc_errors": 1, "skipped_bytes": 5 + 12}
+
+    master, slave = os.openpty()
+    pipeline = ingest_pipeline.IngestPipeline(ports=[os.ttyname(slave)], use_spool=True)
+    pipeline.start()
+    try:
+        assert _wait_for(lambda: pipeline.reader.stats()[0]["connected"])
+        os.write(master, stream)
+        assert _wait_for(lambda: pipeline.stats()["replayer"]["written"] == 29)
+    finally:
+        pipeline.stop(timeout=5)
+        os.close(master)
+        os.close(slave)
+    assert pipeline.stats()["reader"]["ports"][0]["crc_errors"] == 1
+    stored = data_processor.get_readings_from_db(limit=100)
+    assert len(stored) == 29
+    assert {(r['sensor_id'], r['type'], r['value']) for r in stored if r['value'] < 9} == {
+        ("PHProbe-Tank1", "pH", 7.01), ("ECMeter-Tank1", "EC", 8.01)}
+
+def test_parser_modules_import_in_any_order():
+    """binary_protocol and fast_parser import cleanly whichever is imported first, with no import cycle."""
+    import subprocess
+    for code in ("import sys, binary_protocol; assert 'fast_parser' not in sys.modules; import fast_parser",
+                 "import fast_parser, binary_protocol; assert fast_parser.ParsedBatch is binary_protocol.ParsedBatch"):
+        result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs pseudo-terminals")
+def test_burst_of_one_sensor_is_stored_without_collisions(test_db, monkeypatch, tmp_path):
+    """Hundreds of lines of one sensor read in one burst get distinct, increasing timestamps."""
+    import ingest_pipeline
+    monkeypatch.setattr(config, 'INGEST_SPOOL_DIR', str(tmp_path))
+    master, slave = os.openpty()
+    pipeline = ingest_pipeline.IngestPipeline(ports=[os.ttyname(slave)], use_spool=True)
+    pipeline.start()
+    try:
+        assert _wait_for(lambda: pipeline.reader.stats()[0]["connected"])
+        os.write(master, b"".join(f"pH-1,pH,{i}\n".encode() for i in range(500)))
+        assert _wait_for(lambda: pipeline.stats()["replayer"]["written"] == 500)
+    finally:
+        pipeline.stop(timeout=5)
+        os.close(master)
+        os.close(slave)
+    stored = data_processor.get_readings_from_db(limit=1000)
+    assert [r['value'] for r in stored] == [float(i) for i in reversed(range(500))] # Arrival order kept
+
+
+def test_device_timestamps_aligned_and_unique(monkeypatch):
+    """DeviceTime/Seq give readings the device's spacing, deterministic and unique even within a millisecond."""
+    import clock_sync
+    import compact_schema
+    import fast_parser
+    monkeypatch.setattr(config, 'CLOCK_SYNC_SEGMENT', 10)
+    # A device clock running 200 ppm slow, lines arriving 5-500 ms late (a stall drains a burst)
+    clock = clock_sync.DeviceClock()
+    host0 = compact_schema.to_epoch_us(datetime(2024, 1, 1, tzinfo=timezone.utc))
+    errors = []
+    for i in range(2000):
+        device_ms = i * 500
+        true_us = host0 + int(device_ms * 1000 * (1 + 200e-6))
+        delay_us = 5000 + (i * 7919) % 495000
+        aligned = clock.align(device_ms, true_us + delay_us)
+        errors.append(aligned - true_us)
+    assert max(abs(e) for e in errors[-500:]) < 25000 # Within 25 ms once settled, despite 0.5 s delays
+    assert 150 < -clock.drift_ppm < 250
+    clock.align(5, host0) # Device restarted
+    assert clock.resets == 1
+    clock.align(2**32 - 10, host0 + 10**9)
+    assert clock.align(20, host0 + 10**9 + 30000) == clock.align(25, host0 + 10**9 + 35000) - 5000 # Wrapped, not reset
+    assert clock.resets == 1
+
+    monkeypatch.setattr(config, 'ARDUINO_DATA_ORDER', ["SensorID", "SensorType", "Value", "DeviceTime", "Seq"])
+    # Both devices were heard on time once; the rest is drained 10 s later in the same instant
+    lines = [b"pH-1,pH,6.9,0,0", b"EC-1,EC,0.9,0,0", b"pH-1,pH,7.0,1000,1", b"pH-1,pH,7.1,1000,2",
+             b"pH-1,pH,7.2,1001,3", b"EC-1,EC,1.0,1000,1", b"pH-1,pH,7.3,x,4"]
+    received = [host0, host0] + [host0 + 10**7] * 5
+    first = fast_parser.LineParser().parse_batch(lines, timestamps=received)
+    again = fast_parser.LineParser().parse_batch(lines, timestamps=received)
+    assert first.rejected == 1 and list(first.timestamps) == list(again.timestamps)
+    assert len(set(zip(first.sensor_codes, first.timestamps))) == 6
+    ph = [ts - host0 for ts, code in zip(first.timestamps, first.sensor_codes) if code == 0]
+    assert ph == [0, 1000001, 1000002, 1001003] # Device spacing kept; Seq orders the same millisecond
+
+    # More readings in one millisecond than it has microseconds, and Seq values 1000 apart
+    aligner = clock_sync.TimestampAligner()
+    burst = [aligner.timestamp_us("pH-1", 5, host0) for _ in range(1500)]
+    assert burst == list(range(host0, host0 + 1500)) and aligner.stats()["pH-1"]["carried"] == 1
+    state = aligner.state()
+    assert aligner.timestamp_us("EC-1", 5, host0, seq=7) + 1 == aligner.timestamp_us("EC-1", 5, host0, seq=1007)
+    restored = clock_sync.TimestampAligner()
+    restored.restore(state)
+    assert restored.timestamp_us("pH-1", 5, host0) == host0 + 1500
+
+
+def test_aligner_stats_while_clocks_reset():
+    """stats() can be read from another thread while readings (and device resets) are being aligned."""
+    import clock_sync
+    assert clock_sync.DeviceClock().current_offset_us() is None
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6) # Switch threads as often as possible
+    aligner, done, errors = clock_sync.TimestampAligner(), threading.Event(), []
+
+    def align():
+        try:
+            for i in range(20000):
+                aligner.timestamp_us(f"s{i % 50}", 1000 - i // 50 % 2 * 500, 10**12 + i) # Device "restarts" every cycle
+        except Exception as e:
+            errors.append(e)
+        done.set()
+    thread = threading.Thread(target=align)
+    thread.start()
+    try:
+        while not done.is_set():
+            for entry in aligner.stats().values():
+                assert entry["offset_ms"] is not None
+    finally:
+        sys.setswitchinterval(switch_interval)
+        thread.join()
+    assert not errors and aligner.stats()["s0"]["resets"] > 0
+
+
+def test_spool_survives_database_lock_and_restart(test_db, monkeypatch, tmp_path):
+    """Spooled lines wait out a locked database, and a new run replays what the last one left."""
+    import spool
+    monkeypatch.setattr(config, 'INGEST_SPOOL_DIR', str(tmp_path))
+    monkeypatch.setattr(config, 'DB_BUSY_TIMEOUT', 0.05)
+    data_processor.close_connections() # Reopen pooled connections with the short busy timeout
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    # First run: lines are spooled but the database is locked, so nothing can be stored
+    writer = spool.Spool()
+    for i in range(10):
+        writer.append((base + timedelta(seconds=i), "/dev/ttyACM0", f"pH-1,pH,{i}\r".encode()))
+    writer.append((base, "/dev/ttyACM0", b"not a reading"))
+    writer.close()
+    blocker = sqlite3.connect(test_db)
+    blocker.execute("BEGIN EXCLUSIVE")
+    replayer = spool.SpoolReplayer(batch_size=4)
+    assert replayer.replay_available() == -1
+    replayer.close()
+    blocker.rollback()
+    blocker.close()
+    assert data_processor.get_readings_from_db() == []
+
+    # Second run: a new segment is started and the old one is replayed from the checkpoint
+    writer = spool.Spool()
+    writer.append((base + timedelta(seconds=10), "/dev/ttyACM0", b"pH-1,pH,10"))
+    writer.close()
+    replayer = spool.SpoolReplayer(batch_size=4)
+    assert replayer.replay_available() == 12
+    replayer.close()
+    readings = data_processor.get_readings_from_db(limit=100)
+    assert [r["value"] for r in readings] == list(range(10, -1, -1))
+    assert readings[-1]["timestamp"] == base.isoformat() # Receive time from the spool, not replay time
+    assert replayer.rejected == 1
+    assert spool.list_segments(str(tmp_path)) == [writer.seq] # Replayed segments are deleted
+
+    # A crash after the commit but before the checkpoint replays the batch again: no duplicates
+    with open(tmp_path / "checkpoint", "w") as f:
+        f.write(f"{writer.seq} 0\n")
+    replayer = spool.SpoolReplayer()
+    assert replayer.replay_available() == 1
+    replayer.close()
+    assert len(data_processor.get_readings_from_db(limit=100)) == 11
+
+
+def test_spool_replay_after_crash_keeps_device_timestamps(test_db, monkeypatch, tmp_path):
+    """Replaying from an older checkpoint restores the device clocks with it, so no reading is stored twice."""
+    import spool
+    monkeypatch.setattr(config, 'INGEST_SPOOL_DIR', str(tmp_path))
+    monkeypatch.setattr(config, 'ARDUINO_DATA_ORDER', ["SensorID", "SensorType", "Value", "DeviceTime"])
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def spool_lines(start, count):
+        writer = spool.Spool()
+        for i in range(start, start + count):
+            # Two readings per device millisecond, received with varying delays
+            writer.append((base + timedelta(milliseconds=i * 100 + (i * 37) % 90), "/dev/ttyACM0",
+                           f"pH-1,pH,{i},{i // 2 * 200}".encode()))
+        writer.close()
+
+    spool_lines(0, 4)
+    replayer = spool.SpoolReplayer(batch_size=4)
+    assert replayer.replay_available() == 4
+    checkpoint = (tmp_path / "checkpoint").read_text()
+    assert spool.read_clock_state(str(tmp_path))["pH-1"]["last_us"] is not None
+    spool_lines(4, 10)
+    assert replayer.replay_available() == 10
+    replayer.close()
+    stored = data_processor.get_readings_from_db(limit=100)
+    assert len(stored) == 14
+
+    # Crash before the later checkpoints were written: the rest is replayed with the same times
+    (tmp_path / "checkpoint").write_text(checkpoint)
+    fast_parser_aligner = spool.fast_parser.get_parser().aligner
+    fast_parser_aligner.timestamp_us("pH-1", 10**6, 0) # State of the parser before the crash must not matter
+    replayer = spool.SpoolReplayer(batch_size=4)
+    assert replayer.replay_available() == 10
+    replayer.close()
+    assert data_processor.get_readings_from_db(limit=100) == stored
+
+
+def test_spool_skips_torn_tail_of_crashed_segment(test_db, monkeypatch, tmp_path):
+    """A half-written record at the end of an old segment is skipped, later segments still replay."""
+    import spool
+    monkeypatch.setattr(config, 'INGEST_SPOOL_DIR', str(tmp_path))
+    now = datetime.now(timezone.utc)
+    writer = spool.Spool()
+    writer.append((now, "p", b"T-1,Water temperature,20.5"))
+    writer.close()
+    with open(tmp_path / f"{writer.seq:010d}.spool", "ab") as f:
+        f.write(spool.encode_record(now, b"T-1,Water temperature,21.0")[:-5]) # Torn write
+    writer = spool.Spool()
+    writer.append((now + timedelta(seconds=1), "p", b"T-1,Water temperature,22.0"))
+    writer.close()
+    replayer = spool.SpoolReplayer()
+    assert replayer.replay_available() == 2
+    replayer.close()
+    assert [r["value"] for r in data_processor.get_readings_from_db()] == [22.0, 20.5]
+
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs pseudo-terminals")
+def test_bench_suite_simulated_arduino_and_compare(test_db, monkeypatch, tmp_path):
+    """The benchmark's simulated Arduino feeds the real pipeline, and a slowdown is reported as a regression."""
+    import bench_suite
+    monkeypatch.setattr(config, 'INGEST_SPOOL_DIR', str(tmp_path))
+    monkeypatch.setattr(config, 'ARDUINO_DATA_ORDER', ["SensorID", "SensorType", "Value", "DeviceTime", "Seq"])
+    simulator = bench_suite.SimulatedArduino(sensors=4, rate=0)
+    try:
+        assert simulator.reading(3, 0) == b"PHProbe-Tank2,pH,7.00,0,3\r\n" # Same values as arduinosintest.txt
+    finally:
+        simulator.close()
+
+    result = bench_suite.run_ingest(sensors=4, rate=2000, duration=0.5)
+    assert result["sent"] > 0 and result["stored"] == result["sent"] and result["lost"] == 0
+    stored = data_processor.get_readings_from_db(limit=10000)
+    assert len(stored) == result["sent"]
+    assert {r['sensor_id'] for r in stored} == {"PHProbe-Tank1", "ECMeter-Tank1", "TempProbe-Tank1", "PHProbe-Tank2"}
+
+    baseline = {"results": {"ingest": {"stored_per_second": 1000.0, "sent": 10},
+                            "query": {"latest": {"p50_ms": 1.0, "max_ms": 1.0}}}}
+    current = {"results": {"ingest": {"stored_per_second": 950.0, "sent": 99},
+                           "query": {"latest": {"p50_ms": 1.5, "max_ms": 9.0}}}}
+    assert bench_suite.compare(current, baseline, tolerance=0.10) == [
+        {"metric": "query.latest.p50_ms", "baseline": 1.0, "current": 1.5, "worse_by": 0.5}]
+
+
+
+def test_wsgi_server_serves_with_read_only_connections(test_db, monkeypatch):
+    """The production server's workers answer requests on a pooled server and can't write to the database."""
+    import json
+    import urllib.request
+    import api_server
+    import db_pool
+    import wsgi
+    monkeypatch.setattr(config, 'DB_READ_ONLY', False) # create_app() turns it on; restored after the test
+    assert data_processor.store_reading(SensorReading("pH-1", "pH", 7.0))
+    app = wsgi.create_app()
+    assert config.DB_READ_ONLY
+    with pytest.raises(sqlite3.OperationalError):
+        with db_pool.pool.connection() as conn:
+            conn.execute("DELETE FROM sensor_readings")
+
+    listener = wsgi._listen("127.0.0.1", 0)
+    server = wsgi.PooledWSGIServer("127.0.0.1", 0, app, threads=2, fd=listener.fileno())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f"http://127.0.0.1:{listener.getsockname()[1]}"
+        for _ in range(5):
+            with urllib.request.urlopen(f"{url}/readings") as response:
+                assert [r['value'] for r in json.loads(response.read())] == [7.0]
+    finally:
+        server.shutdown()
+        thread.join(5)
+        listener.close()
+        api_server.cache.clear()
+    assert server.finish(timeout=5) # Nothing left in progress
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_wsgi_supervisor_ignores_processes_it_did_not_start(test_db):
+    """A sibling started by the shell that exec'd the server (the Docker setup) isn't taken for a dead worker."""
+    import signal
+    import subprocess
+    code = "import wsgi; wsgi.serve(host='127.0.0.1', port=0, workers=2, threads=1)"
+    server = subprocess.Popen(["sh", "-c", f'sleep 0.2 & exec "{sys.executable}" -c "{code}"'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.PIPE, text=True,
+                              env=dict(os.environ, DATABASE_NAME=test_db))
+    time.sleep(1.5) # The sleep has exited and been reaped by the server's os.wait()
+    server.send_signal(signal.SIGTERM)
+    _, log = server.communicate(timeout=10)
+    assert "API server stopped." in log
+    assert "exited unexpectedly" not in log
+
+
+
+def test_async_api_matches_flask_and_coalesces(api_client, test_db, monkeypatch):
+    """The ASGI endpoints answer exactly like the Flask ones; lanes keep latest polls free and identical queries share a run."""
+    import asyncio
+    import api_async
+    import async_queries
+    monkeypatch.setattr(config, 'DB_READ_ONLY', False) # startup() turns it on; restored after the test
+    monkeypatch.setattr(config, 'RESPONSE_CACHE_ENABLED', False)
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    data_processor.store_readings([SensorReading(f"s{i % 3}", "pH", i / 10, base + timedelta(seconds=i))
+                                   for i in range(30)])
+    api_async.startup()
+
+    async def get(url):
+        path, _, query = url.partition("?")
+        sent = []
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+        async def send(message):
+            sent.append(message)
+        await api_async.app({"type": "http", "method": "GET", "path": path, "query_string": query.encode(),
+                             "headers": []}, receive, send)
+        return sent[0]["status"], dict(sent[0]["headers"]), sent[1]["body"]
+
+    try:
+        for url in ["/readings?limit=4&sensor_id=s1", "/readings?limit=abc&start=2024-01-01T00:00:10",
+                    "/readings?start=yesterday", "/readings/latest?type=pH", "/readings/aggregate?bucket=10s",
+                    "/readings/aggregate", "/status"]:
+            status, headers, body = asyncio.run(get(url))
+            expected = api_client.get(url)
+            assert (status, body) == (expected.status_code, expected.data), url
+            assert headers.get(b"x-next-cursor", b"").decode() == expected.headers.get("X-Next-Cursor", "")
+    finally:
+        async_queries.shutdown()
+
+    executor = async_queries.QueryExecutor(query_threads=1, latest_threads=1, max_pending=2)
+    release = threading.Event()
+    try:
+        slow = executor.submit("query", release.wait, 5)
+        assert executor.submit("query", release.wait, 5) is slow # Identical call shares the running one
+        queued = executor.submit("query", release.wait, 4)
+        with pytest.raises(async_queries.Overloaded):
+            executor.submit("query", release.wait, 3)
+        # The query lane is stuck, the latest lane isn't
+        assert len(executor.submit("latest", data_processor.get_latest_readings).result(timeout=2)) == 3
+        release.set()
+        assert slow.result(timeout=5) and queued.result(timeout=5)
+        assert executor.stats()["coalesced"] == 1 and executor.stats()["rejected"] == 1
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+@pytest.mark.parametrize("schema", ["legacy", "compact"])
+def test_change_feed_and_readings_stream(api_client, test_db, monkeypatch, schema):
+    """New readings reach every stream subscriber from one tail query per tick, filtered and resumable by event id."""
+    import asyncio
+    import json
+    import api_async
+    import change_feed
+    monkeypatch.setattr(config, 'DB_SCHEMA', schema)
+    monkeypatch.setattr(config, 'STREAM_HEARTBEAT_INTERVAL', 0.05)
+    # Off by default: nothing is written to the feed and the stream is unavailable
+    data_processor.initialize_database()
+    assert data_processor.store_reading(SensorReading("pH-1", "pH", 9, datetime(2023, 1, 1, tzinfo=timezone.utc)))
+    with sqlite3.connect(config.DATABASE_NAME) as conn:
+        assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'readings_feed'").fetchall()
+    assert api_client.get('/readings/stream').status_code == 503
+    sent = []
+    async def send(message):
+        sent.append(message)
+    asyncio.run(api_async.app({"type": "http", "method": "GET", "path": "/readings/stream", "query_string": b"",
+                               "headers": []}, None, send))
+    assert sent[0]["status"] == 503
+    monkeypatch.setattr(config, 'CHANGE_FEED_ENABLED', True)
+    data_processor.initialize_database()
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    data_processor.store_reading(SensorReading("pH-1", "pH", 0, base)) # Before subscribing: not streamed
+    tailer = change_feed.FeedTailer(interval=60) # Ticks are driven by the test
+    monkeypatch.setattr(change_feed, '_tailer', tailer)
+
+    try:
+        ph = tailer.subscribe(sensor_id="pH-1")
+        ec = tailer.subscribe(sensor_type="EC")
+        small = tailer.subscribe(max_buffer=2)
+        data_processor.store_readings([SensorReading("pH-1", "pH", i, base + timedelta(minutes=i)) for i in (1, 2, 3)] +
+                                      [SensorReading("EC-1", "EC", 1.5, base)])
+        tailer.poll()
+        queries = tailer.queries
+        assert tailer.poll() == 0 and tailer.queries == queries # Nothing committed since: no query
+
+        entries, dropped = ph.get(timeout=1)
+        assert ([entry[4] for entry in entries], dropped) == ([1, 2, 3], 0)
+        # Same readings, as /readings returns them
+        assert [change_feed.to_dict(entry) for entry in reversed(entries)] == api_client.get('/readings?sensor_id=pH-1&limit=3').json
+        assert [entry[2] for entry in ec.get(timeout=1)[0]] == ["EC-1"]
+        assert small.get(timeout=1)[1] == 2 # Slow client: the oldest two were dropped
+        first_seq = entries[0][0]
+
+        # SSE: resume after the first pH reading, then get a newly stored one
+        response = api_client.get('/readings/stream?type=pH', headers={'Last-Event-ID': str(first_seq)}, buffered=False)
+        assert response.status_code == 200 and response.mimetype == 'text/event-stream'
+        events = response.iter_encoded()
+        assert next(events) == b": connected\n\n"
+        assert [r['value'] for r in json.loads(next(events).split(b"data: ")[1])] == [2, 3]
+        data_processor.store_readings([SensorReading("EC-1", "EC", 1.6, base + timedelta(minutes=9)),
+                                       SensorReading("pH-1", "pH", 4, base + timedelta(minutes=9))])
+        tailer.poll()
+        event = next(events)
+        assert event.startswith(f"id: {first_seq + 5}\n".encode())
+        assert [r['value'] for r in json.loads(event.split(b"data: ")[1])] == [4]
+        assert next(events) == b": keep-alive\n\n"
+        response.close()
+        assert tailer.subscriber_count() == 3
+
+        monkeypatch.setattr(config, 'STREAM_MAX_CLIENTS', 3)
+        assert api_client.get('/readings/stream').status_code == 503
+        assert api_client.get('/readings/stream?last_event_id=abc').status_code == 400
+
+        # Same events from the ASGI app; it stops when the client disconnects
+        async def stream_async():
+            disconnected = asyncio.Event()
+            sent = []
+            async def receive():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            async def send(message):
+                sent.append(message)
+                if message.get("body", b"").startswith(b"id:"):
+                    disconnected.set()
+            task = asyncio.ensure_future(api_async.app({"type": "http", "method": "GET", "path": "/readings/stream",
+                                                        "query_string": b"sensor_id=EC-1", "headers": []}, receive, send))
+            while len(sent) < 2:
+                await asyncio.sleep(0.01)
+            await asyncio.to_thread(data_processor.store_reading, SensorReading("EC-1", "EC", 1.7, base + timedelta(minutes=10)))
+            await asyncio.to_thread(tailer.poll)
+            await asyncio.wait_for(task, 5)
+            return sent
+
+        monkeypatch.setattr(config, 'ASYNC_STREAM_MAX_CLIENTS', 4)
+        sent = asyncio.run(stream_async())
+        assert sent[0]["status"] == 200
+        assert [r['value'] for r in json.loads(sent[-1]["body"].split(b"data: ")[1])] == [1.7]
+        assert tailer.subscriber_count() == 3
+    finally:
+        tailer.close()
@@ -0,0 +1,222 @@
+# wsgi.py
+#
+# Production serving for api_server.py (`python api_server.py` is Flask's development
+# server: one process, and its request handling serializes under concurrent polling).
+#
+#   python wsgi.py
+#       config.API_SERVER = 'builtin' (default): the listening socket is opened once and
+#       API_WORKERS worker processes are forked to accept on it, each handling requests on a
+#       pool of API_THREADS threads. SQLite releases the GIL while it works, so threads help
+#       too, and worker processes use every core for JSON encoding.
+#       'waitress': waitress (pip install waitress) with API_THREADS threads in one process.
+#
+#   gunicorn -w 4 --threads 8 -b 0.0.0.0:5000 "wsgi:create_app()"
+#   waitress-serve --threads 8 --port 5000 --call wsgi:create_app
+#       Any WSGI server can use the create_app() factory instead.
+#
+# Workers open their database connections read-only (config.DB_READ_ONLY); the logger is the
+# only writer. SIGTERM/SIGINT stop accepting connections and let requests in progress finish
+# (up to API_SHUTDOWN_TIMEOUT seconds) before exiting.
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler, select_address_family
+
+import change_feed
+import config
+import data_processor
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def create_app():
+    """
+    Returns the API's Flask app, set up for a worker process: the database is created if
+    needed, then every connection this process opens is read-only.
+    Call it in each worker (after forking), not before.
+    """
+    import api_server
+    if not os.path.exists(config.DATABASE_NAME):
+        # Nothing to read yet (the logger hasn't started); create the tables once, writable
+        data_processor.initialize_database()
+    config.DB_READ_ONLY = True
+    # Connections inherited from a parent process (or opened writable above) must not be reused
+    data_processor.close_connections()
+    api_server.cache.clear()
+    return api_server.app
+
+
+class RequestHandler(WSGIRequestHandler):
+    """One request per connection, so an idle keep-alive client never holds a pool thread."""
+    protocol_version = "HTTP/1.0"
+
+    def log_request(self, code="-", size="-"):
+        if config.API_ACCESS_LOG:
+            super().log_request(code, size)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug's WSGI server handing requests to a fixed pool of threads."""
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, threads: int = None, fd: int = None):
+        """
+        Initializes a PooledWSGIServer instance.
+
+        Args:
+            host, port: Address to listen on (ignored with fd).
+            app: The WSGI application.
+            threads: Requests handled at once. Defaults to config.API_THREADS.
+            fd: An already listening socket to accept on (shared by all workers).
+        """
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self.threads = threads or config.API_THREADS
+        self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="api")
+        self._in_flight = 0
+        self._idle = threading.Condition()
+
+    def process_request(self, request, client_address):
+        with self._idle:
+            self._in_flight += 1
+        self._executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._idle:
+                self._in_flight -= 1
+                self._idle.notify_all()
+
+    def finish(self, timeout: float = None) -> bool:
+        """
+        Waits until no request is in progress (call after serve_forever() returns), then stops
+        the threads. False if requests were still running at the timeout.
+        """
+        with self._idle:
+            done = self._idle.wait_for(lambda: self._in_flight == 0, timeout)
+        self._executor.shutdown(wait=done)
+        return done
+
+
+def _listen(host: str, port: int) -> socket.socket:
+    """Opens the listening socket shared by the workers."""
+    family = select_address_family(host, port)
+    return socket.create_server((host, port), family=family, backlog=128)
+
+def run_worker(listener: socket.socket, threads: int = None):
+    """Serves requests on listener until SIGTERM/SIGINT, then finishes the requests in progress."""
+    app = create_app()
+    host, port = listener.getsockname()[:2]
+    server = PooledWSGIServer(host, port, app, threads, fd=listener.fileno())
+
+    def stop(sig, frame):
+        # shutdown() waits for serve_forever() to return, so it can't run on this (the serving) thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        server.serve_forever() # Closes the server's copy of the listening socket when it returns
+    finally:
+        change_feed.shutdown() # Ends open /readings/stream responses, which would never finish
+        if not server.finish(config.API_SHUTDOWN_TIMEOUT):
+            logging.warning(f"Worker {os.getpid()}: requests still running after {config.API_SHUTDOWN_TIMEOUT}s; exiting anyway.")
+        data_processor.close_connections()
+
+def serve_waitress(host: str, port: int, threads: int):
+    """Serves with waitress (one process; SIGTERM exits cleanly like Ctrl+C)."""
+    import waitress
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+    waitress.serve(create_app(), host=host, port=port, threads=threads)
+
+def serve(host: str = None, port: int = None, workers: int = None, threads: int = None):
+    """
+    Runs the production API server until SIGTERM/SIGINT.
+
+    Args:
+        host, port: Defaults to config.API_HOST/API_PORT.
+        workers: Worker processes. Defaults to config.API_WORKERS (1 where os.fork is missing).
+        threads: Request threads per worker. Defaults to config.API_THREADS.
+    """
+    host = host or config.API_HOST
+    port = config.API_PORT if port is None else port
+    workers = workers or config.API_WORKERS
+    threads = threads or config.API_THREADS
+    # Create the database (if needed) before any worker opens it read-only
+    data_processor.initialize_database()
+    data_processor.close_connections()
+
+    if config.API_SERVER == "waitress":
+        logging.info(f"Starting API server (waitress, {threads} threads) on {host}:{port}")
+        serve_waitress(host, port, threads)
+        return
+
+    listener = _listen(host, port)
+    if workers <= 1 or not hasattr(os, "fork"):
+        logging.info(f"Starting API server (1 process, {threads} threads) on {host}:{port}")
+        run_worker(listener, threads)
+        return
+
+    logging.info(f"Starting API server ({workers} workers x {threads} threads) on {host}:{port}")
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(listener, threads)
+            except BaseException as e:
+                logging.error(f"Worker {os.getpid()} failed: {e}")
+                code = 1
+            finally:
+                os._exit(code) # Never run the parent's code in a worker
+        children.add(pid)
+
+    def stop(sig, frame):
+        nonlocal stopping
+        if not stopping:
+            logging.info("Termination signal received. Stopping API workers...")
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        if pid not in children:
+            continue # Not a worker (e.g. a process started by the shell that exec'd this server)
+        children.discard(pid)
+        if not stopping:
+            # A worker died on its own (crash, OOM kill); keep the configured number running
+            logging.warning(f"API worker {pid} exited unexpectedly (status {status}); starting a new one.")
+            time.sleep(1)
+            spawn()
+    listener.close()
+    logging.info("API server stopped.")
+
+
+if __name__ == '__main__':
+    serve()